@@ -0,0 +1,110 @@
+# Batch Budget vs Effettivo (senza UI)
+# Genera i report per ogni workbook Effettivo di una cartella (uno per business unit),
+# in parallelo su un process pool. Esempio:
+#
+#   python analisi_batch.py --budget budget.xlsx --effettivo-dir effettivi/ --out report/
+#   python analisi_batch.py --budget budget.xlsx --effettivo-dir effettivi/ --out report/ --formato xlsx,parquet --per-mese
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from analisi_engine import build_report, period_axis, parse_effettivo, stream_effettivo, read_budget
+from analisi_export import write_xlsx
+
+FORMATI = ("xlsx", "parquet")
+
+_budget_df = None  # Budget condiviso dai worker (caricato una volta per processo)
+
+def _init_worker(df_budget: pd.DataFrame):
+    global _budget_df
+    _budget_df = df_budget
+
+def _flat_columns(df: pd.DataFrame) -> pd.DataFrame:
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = [" | ".join(map(str, c)) for c in df.columns]
+    return df
+
+def write_report(report: dict, out_base: str, formati) -> list:
+    """Scrive le tabelle del report: un xlsx multi-foglio e/o una cartella di Parquet. Restituisce i path scritti."""
+    written = []
+    if "xlsx" in formati:
+        path = f"{out_base}.xlsx"
+        with open(path, "wb") as f:
+            f.write(write_xlsx(report))
+        written.append(path)
+    if "parquet" in formati:
+        os.makedirs(out_base, exist_ok=True)
+        for name, df in report.items():
+            path = os.path.join(out_base, f"{name.lower().replace(' ', '_')}.parquet")
+            _flat_columns(df).to_parquet(path)
+            written.append(path)
+    return written
+
+def report_slices(df_eff_tot: pd.DataFrame, per_mese: bool) -> list:
+    """[(suffisso, colonne)]: un unico report sull'intero file, oppure uno per mese presente."""
+    if not per_mese:
+        return [("", None)]
+    ax = period_axis(df_eff_tot.columns)
+    mesi = sorted({f"{y}-{m:02d}" for y, m in zip(ax["anno"], ax["mese"])})
+    return [(f"_{m}", [f"{m} (1-15)", f"{m} (1-fine)"]) for m in mesi]
+
+def process_file(path: str, out_dir: str, formati, per_mese: bool, streaming: bool = False) -> list:
+    """Job del pool: parse di un workbook Effettivo e scrittura dei suoi report."""
+    parsed = stream_effettivo(path) if streaming else parse_effettivo(path)
+    df_eff_tot, scartate = parsed["pivot"], parsed["date_scartate"]
+    if not scartate.empty:
+        print(f"Attenzione: {os.path.basename(path)}: {int(scartate['righe'].sum())} righe con data non interpretabile escluse "
+              f"(es. {', '.join(scartate['valore'].head(3))})", file=sys.stderr)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    written = []
+    for suffix, cols in report_slices(df_eff_tot, per_mese):
+        report = build_report(_budget_df, df_eff_tot, cols=cols)
+        written += write_report(report, os.path.join(out_dir, f"{stem}{suffix}"), formati)
+    return written
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Report Budget vs Effettivo in batch.")
+    parser.add_argument("--budget", required=True, help="workbook Budget (xlsx)")
+    parser.add_argument("--effettivo-dir", required=True, help="cartella con i workbook Effettivo (un report per file)")
+    parser.add_argument("--out", required=True, help="cartella di output")
+    parser.add_argument("--formato", default="xlsx", help="xlsx, parquet o entrambi separati da virgola (default: xlsx)")
+    parser.add_argument("--per-mese", action="store_true", help="un report per ogni mese presente in ciascun file")
+    parser.add_argument("--streaming", action="store_true", help="lettura Effettivo in streaming (memoria costante, solo data/cliente/ore)")
+    parser.add_argument("--workers", type=int, default=None, help="processi paralleli (default: numero di CPU)")
+    args = parser.parse_args(argv)
+
+    formati = {f.strip() for f in args.formato.split(",") if f.strip()}
+    if not formati or not formati <= set(FORMATI):
+        parser.error(f"--formato deve essere tra: {', '.join(FORMATI)}")
+
+    files = sorted(
+        os.path.join(args.effettivo_dir, f) for f in os.listdir(args.effettivo_dir)
+        if f.lower().endswith(".xlsx") and not f.startswith("~$")
+    )
+    if not files:
+        print(f"Nessun workbook .xlsx in {args.effettivo_dir}", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.out, exist_ok=True)
+    df_budget = read_budget(args.budget)
+
+    errori = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(df_budget,)) as pool:
+        futures = {pool.submit(process_file, f, args.out, formati, args.per_mese, args.streaming): f for f in files}
+        for fut in as_completed(futures):
+            src = futures[fut]
+            try:
+                for path in fut.result():
+                    print(f"{os.path.basename(src)} -> {path}")
+            except Exception as e:
+                errori += 1
+                print(f"Errore su {os.path.basename(src)}: {e}", file=sys.stderr)
+    return 1 if errori else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# Benchmark Budget vs Effettivo (senza UI)
+# Genera workbook Budget/Effettivo sintetici di varie taglie e cronometra ogni stadio della pipeline.
+# Ogni esecuzione aggiunge una riga JSON per taglia al file di output, per confrontare le run nel tempo.
+#
+#   python analisi_bench.py                                   # taglie di default
+#   python analisi_bench.py --taglie 200x12x20000,2000x24x200000 --ripetizioni 5 --out bench.jsonl
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analisi_engine import (
+    read_effettivo_sheet, add_periods, pivot_effettivo, daily_totals, stream_effettivo, read_budget, prepare_budget, align,
+    variance_frames, category_map, dashboard_table, monthly_table, period_rollup, cols_of_half, detail_table,
+    style_percent, heatmap_html, PERC_COLS, SUMMARY_FMT,
+)
+from analisi_budget_store import BudgetStore
+from analisi_category_rules import CATEGORIE
+from analisi_daily import DailyCube, budget_daily_cube, month_calendar, week_bounds
+from analisi_export import write_xlsx
+from analisi_profile import StageProfiler
+
+TAGLIE_DEFAULT = "100x12x10000,1000x24x100000"
+RIGHE_FINESTRA = 50  # righe della heatmap visibile di default nell'app (una pagina)
+ATTIVITA = ["Sviluppo", "Analisi", "Supporto", "Riunione", "Formazione"]
+
+# ------------------------------
+# Generatore sintetico
+# ------------------------------
+def parse_taglia(spec: str) -> dict:
+    """'CLIENTIxMESIxRIGHE' -> {"clienti", "mesi", "righe"}."""
+    try:
+        clienti, mesi, righe = (int(v) for v in spec.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Taglia non valida '{spec}': atteso CLIENTIxMESIxRIGHE, es. 500x24x50000")
+    return {"clienti": clienti, "mesi": mesi, "righe": righe}
+
+def _clienti(n: int) -> list:
+    return [f"Cliente {i:05d}" for i in range(n)]
+
+def generate_budget(clienti: int, mesi: int, start: str = "2024-01", seed: int = 0) -> pd.DataFrame:
+    """Budget largo come quello del Budget Editor: categoria_cliente + _coeff/_budget_mensile/_xselling/(1-15)/(1-fine).
+    Circa il 15% dei mesi cliente ha budget zero (per avere scostamenti 'None' ed 'Extrabudget')."""
+    rng = np.random.default_rng(seed)
+    periodi = pd.period_range(start, periods=mesi, freq="M")
+    nomi = _clienti(clienti)
+    grid = pd.MultiIndex.from_product([nomi, periodi], names=["cliente", "periodo"]).to_frame(index=False)
+    n = len(grid)
+    budget = rng.gamma(2.0, 1500.0, n).round(0)
+    budget[rng.random(n) < 0.15] = 0.0
+    long = pd.DataFrame({
+        "cliente": grid["cliente"],
+        "anno": grid["periodo"].dt.year,
+        "mese": grid["periodo"].dt.month,
+        "coeff": rng.integers(40, 80, n),
+        "budget_mensile": budget,
+        "xselling": np.where(rng.random(n) < 0.1, rng.gamma(2.0, 300.0, n).round(0), 0.0),
+    })
+    store = BudgetStore()
+    store.import_table(long)
+    store.upsert_clients(pd.DataFrame({"cliente": nomi, "categoria_cliente": rng.choice(CATEGORIE, clienti)}))
+    return store.to_wide()
+
+def generate_effettivo(clienti: int, mesi: int, righe: int, start: str = "2024-01", seed: int = 0) -> pd.DataFrame:
+    """Righe timesheet (Data, Cliente, Ore, Attività, Risorsa) distribuite sui giorni lavorativi del periodo.
+    I clienti seguono una distribuzione a coda lunga; ~2% delle righe è su clienti fuori Budget."""
+    rng = np.random.default_rng(seed + 1)
+    giorni = pd.bdate_range(pd.Period(start, "M").start_time, periods=max(1, int(mesi * 21.7)))
+    nomi = np.array(_clienti(clienti) + [f"Nuovo {i:03d}" for i in range(max(1, clienti // 50))])
+    peso = 1.0 / np.arange(1, clienti + 1) ** 0.8
+    peso = np.concatenate([peso / peso.sum() * 0.98, np.full(len(nomi) - clienti, 0.02 / (len(nomi) - clienti))])
+    return pd.DataFrame({
+        "Data": giorni[rng.integers(0, len(giorni), righe)],
+        "Cliente": nomi[rng.choice(len(nomi), righe, p=peso)],
+        "Ore": rng.choice([0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 8.0], righe),
+        "Attività": rng.choice(ATTIVITA, righe),
+        "Risorsa": [f"R{i:03d}" for i in rng.integers(0, 60, righe)],
+    })
+
+def write_workbooks(taglia: dict, folder: str, seed: int = 0) -> dict:
+    """Scrive budget.xlsx ed effettivo.xlsx della taglia in `folder`; restituisce i path."""
+    paths = {"budget": os.path.join(folder, "budget.xlsx"), "effettivo": os.path.join(folder, "effettivo.xlsx")}
+    with open(paths["budget"], "wb") as f:
+        f.write(write_xlsx({"Budget": generate_budget(taglia["clienti"], taglia["mesi"], seed=seed)}, index=False))
+    with open(paths["effettivo"], "wb") as f:
+        f.write(write_xlsx({"Effettivo": generate_effettivo(taglia["clienti"], taglia["mesi"], taglia["righe"], seed=seed)}, index=False))
+    return paths
+
+# ------------------------------
+# Stadi cronometrati
+# ------------------------------
+def run_stages(paths: dict, memory: bool = False) -> list:
+    """Una passata completa della pipeline; restituisce i record per stadio dello StageProfiler."""
+    prof = StageProfiler(memory=memory)
+    out = {}
+
+    def stadio(nome, fn):
+        out[nome] = prof.track(nome, fn)
+        return out[nome]
+
+    df_budget = stadio("lettura_budget", lambda: read_budget(paths["budget"]))
+    df_eff = stadio("lettura_effettivo", lambda: read_effettivo_sheet(paths["effettivo"]))
+    stadio("parsing_date", lambda: add_periods(df_eff))
+    df_eff_tot = stadio("pivot", lambda: pivot_effettivo(df_eff))
+    stadio("lettura_streaming", lambda: stream_effettivo(paths["effettivo"]))
+    df_prep = prepare_budget(df_budget)
+    daily = stadio("totali_giornalieri", lambda: daily_totals(df_eff))
+    inizio, fine = month_calendar(df_eff["mese"].dropna().unique())
+    cubo = stadio("cubo_giornaliero", lambda: {
+        "eff": DailyCube.from_daily(daily, df_eff_tot.index, inizio, fine),
+        "budget": budget_daily_cube(df_prep, df_eff_tot.index, inizio, fine),
+    })
+    stadio("bucket_settimane", lambda: {k: c.buckets(week_bounds(inizio, fine)) for k, c in cubo.items()})
+    al = stadio("allineamento", lambda: align(df_prep, df_eff_tot))
+    eff, budget = al["eff"], al["budget"]
+    var = stadio("scostamenti", lambda: variance_frames(budget, eff))
+    stadio("stile_heatmap", lambda: heatmap_html(var["perc"].iloc[:RIGHE_FINESTRA]))
+    stadio("dashboard", lambda: dashboard_table(budget, var["eff_in"], var["eff_extra"], category_map(df_prep)))
+    mensile = stadio("mensile", lambda: monthly_table(budget, var["eff_in"], var["eff_extra"]))
+    stadio("stile_mensile", lambda: style_percent(mensile, subset=PERC_COLS).format(SUMMARY_FMT).to_html())
+    cols_fine = cols_of_half(budget.columns, "1-fine")
+    trimestrale = stadio("trimestrale", lambda: period_rollup(budget, var["eff_in"], var["eff_extra"], cols_fine, "trimestre"))
+    stadio("export_xlsx", lambda: write_xlsx({
+        "Heatmap": var["perc"],
+        "Dettaglio": detail_table(eff, budget, var["perc"]),
+        "Dashboard": out["dashboard"],
+        "Mensile": mensile,
+        "Trimestrale": trimestrale,
+    }, percent_sheets=["Heatmap"]))
+    prof.close()
+    return prof.records
+
+def versions() -> dict:
+    v = {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__}
+    for mod in ("openpyxl", "xlsxwriter", "pyarrow"):
+        try:
+            v[mod] = __import__(mod).__version__
+        except ImportError:
+            v[mod] = None
+    return v
+
+def bench(taglia: dict, ripetizioni: int, seed: int = 0, memory: bool = False) -> dict:
+    """Record JSON di una taglia: mediana e minimo per stadio su `ripetizioni` passate
+    (+ celle prodotte e, con `memory`, picco di memoria della prima passata)."""
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_workbooks(taglia, folder, seed=seed)
+        dimensioni = {k: os.path.getsize(p) for k, p in paths.items()}
+        runs = [{r["stage"]: r for r in run_stages(paths, memory=memory)} for _ in range(ripetizioni)]
+    stadi = {}
+    for nome, first in runs[0].items():
+        durate = [r[nome]["dur_s"] for r in runs]
+        stadi[nome] = {"mediana_s": round(statistics.median(durate), 4), "min_s": round(min(durate), 4), "celle": first["cells"]}
+        if "peak_mb" in first:
+            stadi[nome]["picco_mb"] = first["peak_mb"]
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "taglia": taglia,
+        "ripetizioni": ripetizioni,
+        "memoria": memory,
+        "seed": seed,
+        "file_bytes": dimensioni,
+        "stadi": stadi,
+        "totale_mediana_s": round(sum(s["mediana_s"] for s in stadi.values()), 4),
+        "versioni": versions(),
+        "piattaforma": platform.platform(),
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark per stadio della pipeline Budget vs Effettivo.")
+    parser.add_argument("--taglie", default=TAGLIE_DEFAULT, help=f"CLIENTIxMESIxRIGHE separate da virgola (default: {TAGLIE_DEFAULT})")
+    parser.add_argument("--ripetizioni", type=int, default=3, help="passate per taglia (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seme del generatore (default: 0)")
+    parser.add_argument("--out", default="bench_results.jsonl", help="file JSON Lines a cui accodare i risultati")
+    parser.add_argument("--memoria", action="store_true", help="misura anche il picco di memoria per stadio (tracemalloc, più lento)")
+    args = parser.parse_args(argv)
+
+    try:
+        taglie = [parse_taglia(t) for t in args.taglie.split(",") if t.strip()]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.ripetizioni < 1:
+        parser.error("--ripetizioni deve essere almeno 1")
+
+    with open(args.out, "a", encoding="utf-8") as f:
+        for taglia in taglie:
+            record = bench(taglia, args.ripetizioni, seed=args.seed, memory=args.memoria)
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            print(f"{taglia['clienti']}x{taglia['mesi']}x{taglia['righe']}: totale {record['totale_mediana_s']:.2f}s")
+            for nome, s in record["stadi"].items():
+                print(f"  {nome:<18} {s['mediana_s']:8.3f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
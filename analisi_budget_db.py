@@ -0,0 +1,181 @@
+# Archivio Budget su SQLite (snapshot versionati)
+# - Ogni salvataggio è uno snapshot immutabile del BudgetStore: anagrafica clienti + righe (cliente, anno, mese)
+# - Lettura selettiva: solo i periodi e i clienti richiesti, sugli indici (snapshot, periodo) e (snapshot, cliente)
+# - Regole di categoria clienti: configurazione condivisa e modificabile, fuori dagli snapshot
+
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+from analisi_budget_store import BudgetStore, SLOT_FIELDS
+from analisi_category_rules import RULE_COLUMNS, clean_rules, merge_rules
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    creato TEXT NOT NULL,
+    etichetta TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS cliente (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshot(id),
+    cliente TEXT NOT NULL,
+    pos INTEGER NOT NULL,  -- ordine delle righe nel Budget
+    categoria_cliente TEXT NOT NULL DEFAULT '',
+    attributi TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (snapshot_id, cliente)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS slot (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshot(id),
+    periodo INTEGER NOT NULL,  -- anno * 100 + mese
+    cliente TEXT NOT NULL,
+    coeff REAL,
+    budget_mensile REAL,
+    xselling REAL,
+    ore_1_15 REAL,
+    ore_1_fine REAL,
+    PRIMARY KEY (snapshot_id, periodo, cliente)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS slot_cliente ON slot (snapshot_id, cliente);
+CREATE TABLE IF NOT EXISTS regola_categoria (
+    pos INTEGER PRIMARY KEY,  -- ordine di applicazione delle regex
+    tipo TEXT NOT NULL,
+    modello TEXT NOT NULL,
+    categoria TEXT NOT NULL
+);
+"""
+
+def _nullable(df: pd.DataFrame) -> pd.DataFrame:
+    """NaN -> None, per scrivere NULL in SQLite."""
+    return df.astype(object).where(df.notna(), None)
+
+class BudgetDB:
+    """Archivio Budget su file SQLite. Una connessione per operazione: utilizzabile da più sessioni/thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as con:
+            con.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute("PRAGMA foreign_keys = ON")
+        return con
+
+    # ---- scrittura
+    def save(self, store: BudgetStore, etichetta: str = "") -> int:
+        """Salva lo store come nuovo snapshot; restituisce l'id."""
+        clients, slots = store.clients, store.slots
+        extra = [c for c in clients.columns if c not in ("cliente", "categoria_cliente")]
+        attributi = (
+            [json.dumps(r, default=str) for r in _nullable(clients[extra]).to_dict("records")]
+            if extra else ["{}"] * len(clients)
+        )
+        righe_clienti = zip(clients["cliente"].astype(str), range(len(clients)), clients["categoria_cliente"].fillna("").astype(str), attributi)
+        periodo = slots["anno"].astype(int) * 100 + slots["mese"].astype(int)
+        righe_slot = _nullable(slots[SLOT_FIELDS].apply(pd.to_numeric, errors="coerce")).assign(
+            periodo=periodo, cliente=slots["cliente"].astype(str),
+        )[["periodo", "cliente"] + SLOT_FIELDS]
+
+        with closing(self._connect()) as con, con:
+            cur = con.execute(
+                "INSERT INTO snapshot (creato, etichetta) VALUES (?, ?)",
+                (datetime.now().isoformat(timespec="seconds"), etichetta.strip()),
+            )
+            snap_id = cur.lastrowid
+            con.executemany(
+                "INSERT INTO cliente (snapshot_id, cliente, pos, categoria_cliente, attributi) VALUES (?, ?, ?, ?, ?)",
+                ((snap_id, *r) for r in righe_clienti),
+            )
+            con.executemany(
+                f"INSERT INTO slot (snapshot_id, periodo, cliente, {', '.join(SLOT_FIELDS)}) VALUES ({', '.join('?' * (3 + len(SLOT_FIELDS)))})",
+                ((snap_id, *r) for r in righe_slot.itertuples(index=False, name=None)),
+            )
+        return snap_id
+
+    # ---- lettura
+    def snapshots(self) -> pd.DataFrame:
+        """Snapshot salvati, dal più recente: id, creato, etichetta, clienti."""
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(
+                "SELECT s.id, s.creato, s.etichetta, COUNT(c.cliente) AS clienti "
+                "FROM snapshot s LEFT JOIN cliente c ON c.snapshot_id = s.id "
+                "GROUP BY s.id ORDER BY s.id DESC",
+                con,
+            )
+
+    def latest(self):
+        with closing(self._connect()) as con:
+            return con.execute("SELECT MAX(id) FROM snapshot").fetchone()[0]
+
+    def period_columns(self, snapshot_id: int) -> list:
+        """Colonne ore 'YYYY-MM (1-15)' / 'YYYY-MM (1-fine)' presenti nello snapshot, senza caricare le righe."""
+        with closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT periodo, COUNT(ore_1_15), COUNT(ore_1_fine) FROM slot WHERE snapshot_id = ? GROUP BY periodo ORDER BY periodo",
+                (snapshot_id,),
+            ).fetchall()
+        cols = []
+        for p, n_115, n_fine in rows:
+            base = f"{p // 100}-{p % 100:02d}"
+            cols += ([f"{base} (1-15)"] if n_115 else []) + ([f"{base} (1-fine)"] if n_fine else [])
+        return cols
+
+    def load_store(self, snapshot_id: int = None, periodi=None, clienti=None) -> BudgetStore:
+        """Snapshot (default: il più recente) come BudgetStore.
+        periodi: [(anno, mese)] e clienti: [nome] limitano le righe lette; None = tutto."""
+        if snapshot_id is None:
+            snapshot_id = self.latest()
+            if snapshot_id is None:
+                raise ValueError("Nessuno snapshot Budget nell'archivio.")
+        filtro_clienti, params_clienti = "", []
+        if clienti is not None:
+            filtro_clienti = " AND cliente IN (SELECT value FROM json_each(?))"
+            params_clienti = [json.dumps([str(c) for c in clienti])]
+        filtro_periodi, params_periodi = "", []
+        if periodi is not None:
+            filtro_periodi = " AND periodo IN (SELECT value FROM json_each(?))"
+            params_periodi = [json.dumps([int(y) * 100 + int(m) for y, m in periodi])]
+
+        with closing(self._connect()) as con:
+            clients = pd.read_sql_query(
+                f"SELECT cliente, categoria_cliente, attributi FROM cliente WHERE snapshot_id = ?{filtro_clienti} ORDER BY pos",
+                con, params=[snapshot_id, *params_clienti],
+            )
+            slots = pd.read_sql_query(
+                f"SELECT cliente, periodo, {', '.join(SLOT_FIELDS)} FROM slot WHERE snapshot_id = ?{filtro_periodi}{filtro_clienti}",
+                con, params=[snapshot_id, *params_periodi, *params_clienti],
+            )
+
+        attributi = pd.DataFrame([json.loads(a) for a in clients.pop("attributi")], index=clients.index)
+        clients = pd.concat([clients, attributi], axis=1) if not attributi.empty else clients
+        slots.insert(1, "anno", slots["periodo"] // 100)
+        slots.insert(2, "mese", slots.pop("periodo") % 100)
+        return BudgetStore(clients, slots)
+
+    def load_wide(self, snapshot_id: int = None, periodi=None, clienti=None) -> pd.DataFrame:
+        """Vista larga (come il Budget xlsx) dello snapshot, limitata a periodi/clienti se indicati."""
+        return self.load_store(snapshot_id, periodi, clienti).to_wide()
+
+    # ---- regole categoria
+    def category_rules(self) -> pd.DataFrame:
+        """Regole di categoria salvate (tipo, modello, categoria), nell'ordine di applicazione."""
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(f"SELECT {', '.join(RULE_COLUMNS)} FROM regola_categoria ORDER BY pos", con)
+
+    def save_category_rules(self, rules: pd.DataFrame) -> int:
+        """Sostituisce tutte le regole (validate con clean_rules); restituisce quante ne sono salvate."""
+        rules = clean_rules(rules)
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM regola_categoria")
+            con.executemany(
+                "INSERT INTO regola_categoria (pos, tipo, modello, categoria) VALUES (?, ?, ?, ?)",
+                ((i, *r) for i, r in enumerate(rules[RULE_COLUMNS].itertuples(index=False, name=None))),
+            )
+        return len(rules)
+
+    def add_category_rules(self, rules: pd.DataFrame) -> int:
+        """Aggiunge regole a quelle salvate (stesso tipo e modello: vince la nuova)."""
+        return self.save_category_rules(merge_rules(self.category_rules(), rules))
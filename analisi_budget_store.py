@@ -0,0 +1,173 @@
+# Budget in formato lungo (cliente, anno, mese, coeff, budget, xselling, ore slot)
+# - La vista larga 'YYYY-MM_coeff / _budget_mensile / _xselling / (1-15) / (1-fine)' è derivata su richiesta
+# - Import massivo: ore slot calcolate per migliaia di clienti in un solo passaggio vettoriale
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# campo del formato lungo -> suffisso della colonna larga 'YYYY-MM<suffisso>'
+WIDE_SUFFIX = {
+    "coeff": "_coeff",
+    "budget_mensile": "_budget_mensile",
+    "xselling": "_xselling",
+    "ore_1_15": " (1-15)",
+    "ore_1_fine": " (1-fine)",
+}
+SLOT_FIELDS = list(WIDE_SUFFIX)
+WIDE_PATTERN = re.compile(r"^(?P<y>\d{4})-(?P<m>\d{2})(?P<suffix>_coeff|_budget_mensile|_xselling| \(1-15\)| \(1-fine\))$")
+IMPORT_COLUMNS = ["cliente", "anno", "mese", "coeff", "budget_mensile"]
+_FIELD_OF_SUFFIX = {v: k for k, v in WIDE_SUFFIX.items()}
+
+def slot_hours(coeff, budget_mensile, xselling):
+    """Ore slot vettoriali: (1-fine) = (budget + xselling) / coeff, (1-15) = metà; 0 se coeff <= 0."""
+    coeff = np.asarray(coeff, dtype=float)
+    totale = np.zeros_like(coeff)
+    np.divide(np.asarray(budget_mensile, dtype=float) + np.asarray(xselling, dtype=float), coeff, out=totale, where=coeff > 0)
+    return np.round(totale / 2, 2), np.round(totale, 2)
+
+class BudgetStore:
+    """Budget colonnare: anagrafica clienti + righe (cliente, anno, mese) con i campi slot.
+    Le aggiunte vengono accodate e consolidate solo alla lettura (niente concat quadratico)."""
+
+    def __init__(self, clients: pd.DataFrame = None, slots: pd.DataFrame = None):
+        self._clients = clients if clients is not None else pd.DataFrame({"cliente": pd.Series(dtype=str), "categoria_cliente": pd.Series(dtype=str)})
+        self._slots = slots if slots is not None else pd.DataFrame(columns=["cliente", "anno", "mese"] + SLOT_FIELDS)
+        self._pending_clients = []
+        self._pending_slots = []
+        self._wide = None
+
+    # ---- lettura
+    @property
+    def clients(self) -> pd.DataFrame:
+        if self._pending_clients:
+            parts = [p for p in [self._clients, *self._pending_clients] if not p.empty]
+            if parts:
+                self._clients = pd.concat(parts, ignore_index=True).drop_duplicates("cliente", keep="last")
+            self._pending_clients = []
+        return self._clients
+
+    @property
+    def slots(self) -> pd.DataFrame:
+        if self._pending_slots:
+            parts = [p for p in [self._slots, *self._pending_slots] if not p.empty]
+            if parts:
+                merged = pd.concat(parts, ignore_index=True)
+                self._slots = merged.drop_duplicates(["cliente", "anno", "mese"], keep="last").reset_index(drop=True)
+            self._pending_slots = []
+        return self._slots
+
+    def to_wide(self) -> pd.DataFrame:
+        """Vista larga (una riga per cliente), ricalcolata solo dopo una modifica."""
+        if self._wide is not None:
+            return self._wide
+        clients, slots = self.clients, self.slots
+        if slots.empty:
+            wide = clients.copy()
+        else:
+            base = slots["anno"].astype(int).astype(str) + "-" + slots["mese"].astype(int).map("{:02d}".format)
+            pv = slots.assign(base=base).pivot(index="cliente", columns="base", values=SLOT_FIELDS)
+            pv = pv.dropna(axis=1, how="all")
+            order = [(f, b) for b in sorted(pv.columns.get_level_values("base").unique()) for f in SLOT_FIELDS if (f, b) in pv.columns]
+            pv = pv[order]
+            pv.columns = [f"{b}{WIDE_SUFFIX[f]}" for f, b in order]
+            orphans = pv.index.difference(clients["cliente"])
+            all_clients = pd.concat([clients, pd.DataFrame({"cliente": orphans, "categoria_cliente": ""})], ignore_index=True)
+            wide = all_clients.merge(pv, left_on="cliente", right_index=True, how="left")
+        wide["categoria_cliente"] = wide["categoria_cliente"].fillna("")
+        self._wide = wide.reset_index(drop=True)
+        return self._wide
+
+    # ---- scrittura
+    def _touch(self):
+        self._wide = None
+
+    def upsert_clients(self, clients: pd.DataFrame):
+        """Aggiunge/aggiorna righe di anagrafica (colonna 'cliente' obbligatoria)."""
+        clients = clients.copy()
+        clients["cliente"] = clients["cliente"].astype(str).str.strip()
+        if "categoria_cliente" in clients.columns:
+            clients["categoria_cliente"] = clients["categoria_cliente"].fillna("").astype(str)
+            # una categoria vuota non sovrascrive quella esistente
+            known = self.clients.set_index("cliente")["categoria_cliente"]
+            empty = clients["categoria_cliente"].str.strip() == ""
+            clients.loc[empty, "categoria_cliente"] = clients.loc[empty, "cliente"].map(known).fillna("")
+        else:
+            clients["categoria_cliente"] = clients["cliente"].map(self.clients.set_index("cliente")["categoria_cliente"]).fillna("")
+        self._pending_clients.append(clients.drop_duplicates("cliente", keep="last"))
+        self._touch()
+
+    def add_slots(self, rows: pd.DataFrame):
+        """Accoda righe (cliente, anno, mese, campi slot); a parità di chiave vince l'ultima."""
+        rows = rows.reindex(columns=["cliente", "anno", "mese"] + SLOT_FIELDS)
+        rows["cliente"] = rows["cliente"].astype(str).str.strip()
+        self._pending_slots.append(rows)
+        self._touch()
+
+    def import_table(self, df: pd.DataFrame) -> int:
+        """Import massivo da tabella lunga: cliente, anno, mese, coeff, budget_mensile [, xselling, categoria_cliente].
+        Calcola le ore slot di tutte le righe in un passaggio. Restituisce il numero di righe importate."""
+        df = df.copy()
+        df.columns = df.columns.astype(str).str.strip().str.lower()
+        missing = [c for c in IMPORT_COLUMNS if c not in df.columns]
+        if missing:
+            raise ValueError(f"Nel file di import mancano le colonne: {', '.join(missing)}")
+        if "xselling" not in df.columns:
+            df["xselling"] = 0.0
+        for c in ("anno", "mese", "coeff", "budget_mensile", "xselling"):
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+        df = df.dropna(subset=["cliente", "anno", "mese"])
+        df = df[df["mese"].between(1, 12)].copy()
+        df[["coeff", "budget_mensile", "xselling"]] = df[["coeff", "budget_mensile", "xselling"]].fillna(0.0)
+        df["anno"] = df["anno"].astype(int)
+        df["mese"] = df["mese"].astype(int)
+        df["ore_1_15"], df["ore_1_fine"] = slot_hours(df["coeff"], df["budget_mensile"], df["xselling"])
+
+        client_cols = ["cliente"] + (["categoria_cliente"] if "categoria_cliente" in df.columns else [])
+        self.upsert_clients(df[client_cols])
+        self.add_slots(df)
+        return len(df)
+
+    def add_client(self, cliente: str, categoria: str, anni, mesi, coeff, budget_mensile, xselling) -> int:
+        """Nuovo cliente con gli stessi parametri su tutti gli anni x mesi indicati."""
+        grid = pd.MultiIndex.from_product([list(anni), list(mesi)], names=["anno", "mese"]).to_frame(index=False)
+        grid = grid.assign(cliente=cliente, categoria_cliente=categoria, coeff=coeff, budget_mensile=budget_mensile, xselling=xselling)
+        return self.import_table(grid)
+
+    # ---- conversione dal formato largo
+    @classmethod
+    def from_wide(cls, df: pd.DataFrame) -> "BudgetStore":
+        """Budget largo (Excel o data_editor) -> store. Le colonne non di periodo restano in anagrafica."""
+        df = df.copy()
+        df.columns = df.columns.astype(str).str.strip()
+        cliente_col = next((c for c in df.columns if c.lower()=="cliente"), None)
+        if not cliente_col:
+            raise ValueError("Il file Budget deve contenere la colonna 'cliente'.")
+        df = df.rename(columns={cliente_col: "cliente"})
+        df = df[df["cliente"].notna()]
+        df["cliente"] = df["cliente"].astype(str).str.strip()
+
+        period_cols = [c for c in df.columns if WIDE_PATTERN.match(c)]
+        clients = df[[c for c in df.columns if c not in period_cols]]
+        if "categoria_cliente" not in clients.columns:
+            clients = clients.assign(categoria_cliente="")
+        clients = clients.assign(categoria_cliente=clients["categoria_cliente"].fillna("").astype(str))
+        clients = clients.drop_duplicates("cliente", keep="last").reset_index(drop=True)
+
+        if not period_cols:
+            return cls(clients)
+        meta = pd.Series(period_cols).str.extract(WIDE_PATTERN)
+        meta.index = period_cols
+        long = df[["cliente"] + period_cols].melt(id_vars="cliente", var_name="col", value_name="v")
+        long["v"] = pd.to_numeric(long["v"], errors="coerce")
+        long = long.dropna(subset=["v"])
+        long["anno"] = long["col"].map(meta["y"]).astype(int)
+        long["mese"] = long["col"].map(meta["m"]).astype(int)
+        long["campo"] = long["col"].map(meta["suffix"]).map(_FIELD_OF_SUFFIX)
+        slots = (long.groupby(["cliente", "anno", "mese", "campo"], sort=False)["v"].last()
+                 .unstack("campo")
+                 .reindex(columns=SLOT_FIELDS)
+                 .reset_index())
+        slots.columns.name = None
+        return cls(clients, slots)
@@ -5,13 +5,34 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-import re
+import os
+import math
+import time
+import uuid
 from datetime import datetime
 from io import BytesIO
 
+from analisi_engine import (
+    IngestCache, file_digest, frame_digest, stream_effettivo, merge_pivots, read_budget, prepare_budget, build_cube, CubeSlice,
+    missing_categories, with_categories, category_map, period_axis, fmt_percent_numeric, fmt_hours,
+    style_percent, heatmap_html, variance_frames, detail_table, dashboard_table, monthly_table, summary_table,
+    period_rollup, rollup_totals, cols_of_half, order_clients, page_window,
+    PERC_COLS, SUMMARY_FMT, DASHBOARD_FMT, VIEW_SORTS,
+)
+from analisi_budget_store import BudgetStore, IMPORT_COLUMNS
+from analisi_budget_db import BudgetDB
+from analisi_category_rules import CATEGORIE, RULE_TYPES, assign_categories
+from analisi_effettivo_archive import EffettivoArchive, month_columns
+from analisi_effettivo_merge import effettivo_sheets, merge_effettivo_files, parse_key_columns
+from analisi_scenari import SCENARIO_COLUMNS, SCENARIO_FMT, parse_multipliers, scenario_grid, evaluate_scenarios
+from analisi_snapshot import SnapshotStore, parse_effettivo_snapshot, compare_snapshot, prune_snapshots, what_changed
+from analisi_drilldown import RowIndex, month_bounds, day_table
+from analisi_charts import budget_vs_effettivo_chart, cumulative_burn_chart, category_chart
+from analisi_daily import DailyCube, budget_daily_cube, month_calendar, cutoff_bounds, week_bounds, rolling_bounds
+from analisi_export import write_xlsx, XLSX_MIME
+from analisi_jobs import JobPool, COMPLETATO, ERRORE, ANNULLATO
+from analisi_profile import StageProfiler, output_size, records_frame, runs_json, runs_chrome_trace
+
 st.set_page_config(page_title="Analisi Budget vs Effettivo (v1.12-fix2)", layout="wide")
 st.markdown("### 📊 Analisi Budget vs Effettivo — **v1.12-fix2**")
 
@@ -21,38 +42,6 @@ if "budget_df" not in st.session_state:
 # ------------------------------
 # Helper
 # ------------------------------
-COL_PATTERN = re.compile(r"^(?P<y>\d{4})-(?P<m>\d{2}) \((?P<half>1-15|1-fine)\)$")
-
-def parse_col(col: str):
-    m = COL_PATTERN.match(str(col))
-    if not m:
-        return None
-    return int(m.group("y")), int(m.group("m")), m.group("half")
-
-def fmt_percent_numeric(v: float) -> str:
-    try:
-        if pd.isna(v):
-            return "None"
-    except Exception:
-        pass
-    if v == -9999:
-        return "Extrabudget"
-    try:
-        if abs(float(v)) < 1e-9:
-            return "0%"
-    except Exception:
-        pass
-    try:
-        return f"{float(v):.1f}%"
-    except Exception:
-        return ""
-
-def fmt_hours(v):
-    try:
-        return f"{float(v):.2f}"
-    except Exception:
-        return ""
-
 def safe_rerun():
     if hasattr(st, "rerun"):
         st.rerun()
@@ -69,11 +58,304 @@ def ui_toggle_inline(label: str, value: bool, key: str):
         return st.toggle(label, value=value, key=key)
     return st.checkbox(label, value=value, key=key)
 
+# ------------------------------
+# Cache di ingestione (chiave = hash del contenuto del file)
+# ------------------------------
+# ANALISI_CACHE_MB: budget di memoria della cache condivisa tra sessioni
+# ANALISI_CACHE_DIR: se valorizzata, ogni voce viene salvata anche come Parquet (sopravvive al riavvio)
+CACHE_MAX_MB = float(os.environ.get("ANALISI_CACHE_MB", "512"))
+CACHE_DIR = os.environ.get("ANALISI_CACHE_DIR", "")
+# ANALISI_BUDGET_DB: file SQLite dell'archivio Budget (snapshot versionati)
+BUDGET_DB_PATH = os.environ.get("ANALISI_BUDGET_DB", "analisi_budget.sqlite")
+# ANALISI_ARCHIVE_DIR: cartella dell'archivio storico Effettivo (Parquet, una partizione per mese)
+ARCHIVE_DIR = os.environ.get("ANALISI_ARCHIVE_DIR", "archivio_effettivo")
+# ANALISI_SNAPSHOT_DIR: impronta e pivot dell'ultimo Effettivo caricato, per utente autenticato o per sessione
+SNAPSHOT_DIR = os.environ.get("ANALISI_SNAPSHOT_DIR", "ultimo_effettivo")
+# ANALISI_SNAPSHOT_TTL_H: ore dopo le quali si eliminano gli snapshot delle sessioni senza login
+SNAPSHOT_TTL_S = float(os.environ.get("ANALISI_SNAPSHOT_TTL_H", "168")) * 3600
+# ANALISI_JOB_WORKERS: worker del pool di ingestione in background (condiviso tra sessioni)
+JOB_WORKERS = int(os.environ.get("ANALISI_JOB_WORKERS", "4"))
+JOB_POLL_S = 0.5  # intervallo di aggiornamento della barra di avanzamento (rerun del solo pannello)
+JOB_POLL_MAX_S = 5.0  # senza st.fragment: attesa massima tra due rerun della pagina
+# ANALISI_PARSE_PROCESSES: processi per leggere in parallelo più workbook Effettivo (0/1 = nel worker del job)
+PARSE_PROCESSES = int(os.environ.get("ANALISI_PARSE_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# ANALISI_CHART_SERIES: clienti disegnati nel grafico del consumo cumulato (gli altri confluiscono in 'Altri')
+CHART_MAX_SERIES = int(os.environ.get("ANALISI_CHART_SERIES", "10"))
+CHANGES_MAX_ROWS = 200  # celle mostrate in "Cosa è cambiato" (le maggiori per |Δ Ore|; il totale resta nella didascalia)
+
+_cache_resource = getattr(st, "cache_resource", None) or st.experimental_singleton
+
+@_cache_resource
+def get_ingest_cache() -> IngestCache:
+    return IngestCache(int(CACHE_MAX_MB * 1024 * 1024), CACHE_DIR)
+
+@_cache_resource
+def get_job_pool() -> JobPool:
+    return JobPool(JOB_WORKERS)
+
+def session_id() -> str:
+    """Identificativo della sessione Streamlit corrente (iscrizioni ai job, snapshot senza login)."""
+    return st.session_state.setdefault("sessione_id", uuid.uuid4().hex)
+
+def background_frames(key: str, stage: str, compute, label: str, slot: str = "", persist: bool = True, wait: bool = False):
+    """Frame di `key` dalla cache, altrimenti dal job in background che li calcola (compute(progress=...)).
+    None finché il job non è completato (stato e avanzamento: wait_jobs); con `wait` si attende qui.
+    Il job completato viene ritirato: messo in cache e rimosso dal pool. Il job è condiviso tra le sessioni
+    che caricano lo stesso file: con `slot` un nuovo file per lo stesso slot toglie la sessione dal job del file
+    precedente, che si ferma solo se nessun'altra sessione lo attende. Un job annullato dalla sessione
+    (pulsante Annulla) resta annullato per lei fino a Riprova, salvo `wait`."""
+    cache = get_ingest_cache()
+    pool = get_job_pool()
+    with PROF.stage(stage) as rec:
+        frames = cache.get(key)
+        rec["cache"] = "hit" if frames is not None else "job"
+        if frames is None:
+            sid = session_id()
+            if slot:
+                attivi = st.session_state.setdefault("ingest_jobs", {})
+                if attivi.get(slot) not in (None, key):
+                    pool.cancel(attivi[slot], sid)
+                attivi[slot] = key
+            annullati = st.session_state.setdefault("jobs_annullati", set())
+            if key in annullati and not wait:
+                rec["cache"] = ANNULLATO
+                return None
+            annullati.discard(key)
+            job = pool.submit(key, compute, label=label, subscriber=sid)
+            if wait:
+                job.wait()
+            if job.status == ERRORE and wait:
+                pool.forget(key)
+                raise job.error
+            if job.status != COMPLETATO:
+                rec["cache"] = job.status
+                return None
+            frames = job.result
+            cache.put(key, frames, persist=persist)
+            pool.forget(key)
+            rec["job_s"] = round(job.elapsed, 6)
+        rec.update(output_size(frames))
+    return frames
+
+def jobs_panel(pending: dict) -> tuple:
+    """Avanzamento dei job (etichetta -> chiave) con pulsante Annulla; errori e annullamenti con Riprova.
+    Restituisce (in_corso, pronti): job ancora in esecuzione, job completati da ritirare al prossimo rerun."""
+    pool = get_job_pool()
+    annullati = st.session_state.setdefault("jobs_annullati", set())
+    in_corso = pronti = False
+    for label, key in pending.items():
+        job = pool.get(key)
+        if key in annullati:
+            # annullato da questa sessione (il job può continuare per altre sessioni che lo attendono)
+            st.warning(f"Caricamento {label} annullato.")
+            if st.button("Riprova", key=f"retry-{key}"):
+                annullati.discard(key)
+                safe_rerun()
+        elif job is None or job.status == COMPLETATO:
+            pronti = True  # pronto (o già ritirato da un'altra sessione): al prossimo rerun è in cache
+        elif job.status in (ERRORE, ANNULLATO):
+            if job.status == ERRORE:
+                st.error(f"Errore nel caricamento {label}: {job.error}")
+            else:
+                st.warning(f"Caricamento {label} annullato.")
+            if st.button("Riprova", key=f"retry-{key}"):
+                pool.forget(key)
+                safe_rerun()
+        else:
+            in_corso = True
+            c_bar, c_btn = st.columns([5, 1])
+            c_bar.progress(job.progress)
+            c_bar.caption(f"⏳ {label}: {job.message or job.status} · {job.elapsed:.0f}s")
+            if c_btn.button("Annulla", key=f"cancel-{key}"):
+                pool.cancel(key, session_id())
+                annullati.add(key)
+    return in_corso, pronti
+
+def _poll_jobs(pending: dict):
+    """Pannello dei job rieseguito da solo ogni JOB_POLL_S secondi (solo il frammento, non la pagina);
+    quando non resta nulla in corso e c'è un risultato pronto riesegue l'intera pagina."""
+    in_corso, pronti = jobs_panel(pending)
+    if pronti and not in_corso:
+        safe_rerun()
+
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+poll_jobs = _fragment(run_every=JOB_POLL_S)(_poll_jobs) if _fragment is not None else None
+
+def wait_jobs(pending: dict):
+    """Se c'è almeno un job in sospeso la pagina si ferma qui: il pannello si aggiorna da solo finché i job girano.
+    Senza frammenti (Streamlit vecchio) si riesegue la pagina con attesa crescente, fino a JOB_POLL_MAX_S."""
+    if not pending:
+        return
+    if poll_jobs is not None:
+        poll_jobs(pending)
+    else:
+        in_corso, pronti = jobs_panel(pending)
+        if in_corso or pronti:
+            attesa = max((j.elapsed for j in map(get_job_pool().get, pending.values()) if j is not None), default=0.0)
+            time.sleep(min(JOB_POLL_MAX_S, max(JOB_POLL_S, attesa / 10)))
+            safe_rerun()
+    st.stop()
+
+def load_effettivo(uploaded, streaming: bool = False, chiavi=(), wait: bool = False):
+    """Frame dell'Effettivo (pivot, giornaliero, date_scartate, ...) + chiave di cache, dalla cache se i file sono già stati visti.
+    Un solo workbook con il solo foglio 'Effettivo' segue la lettura classica ("rows" conservate, salvo streaming);
+    più file o fogli sono uniti con deduplica per hash di data/cliente/ore + `chiavi` (niente "rows", in più "parti").
+    Il parsing gira nel pool in background: (None, chiave) finché non è pronto, salvo `wait`.
+    I frame restituiti sono condivisi: non vanno modificati in place."""
+    files = [(u.name, u.getvalue()) for u in uploaded]
+    fogli = []
+    if len(files) == 1:
+        data = files[0][1]
+        fogli = list(memo_stage(f"fogli-{file_digest(data)}", lambda: {"fogli": pd.Series(effettivo_sheets(data), dtype=object)})["fogli"])
+    if fogli == ["Effettivo"] and streaming:
+        key = f"effs-{file_digest(data)}"
+        compute = lambda progress: stream_effettivo(data, progress=progress)
+    elif fogli == ["Effettivo"]:
+        # + impronta delle righe per il confronto con l'ultimo caricamento (compare_upload, fuori dalla cache)
+        firma = "\x1f".join(chiavi).encode()
+        key = f"eff-{file_digest(data)}-{file_digest(firma)[:16]}"
+        compute = lambda progress: parse_effettivo_snapshot(data, chiavi, progress=progress)
+    else:
+        firma = "\x1f".join(sorted(file_digest(d) for _, d in files)) + "\x1e" + "\x1f".join(chiavi)
+        key = f"effm-{file_digest(firma.encode())}"
+        compute = lambda progress: merge_effettivo_files(files, chiavi, processes=PARSE_PROCESSES, progress=progress)
+    frames = background_frames(key, "ingest_effettivo", compute, "Effettivo", slot="effettivo", wait=wait)
+    return frames, key
+
+def snapshot_store() -> SnapshotStore:
+    """Snapshot dell'ultimo Effettivo dell'utente autenticato o, senza login, della sessione corrente."""
+    user = getattr(st, "user", None)
+    try:
+        email = user.email if user is not None and user.is_logged_in else None
+    except Exception:  # autenticazione non configurata
+        email = None
+    if email:
+        return SnapshotStore(os.path.join(SNAPSHOT_DIR, "utenti", file_digest(email.encode())))
+    return SnapshotStore(os.path.join(SNAPSHOT_DIR, "sessioni", session_id()))
+
+def compare_upload(eff_key: str, frames_eff: dict, chiavi=()):
+    """Confronto con lo snapshot (compare_snapshot) una volta per caricamento: i rerun riusano il risultato,
+    un file diverso dal precedente, anche se già in cache, si confronta con lo snapshot corrente."""
+    stato = st.session_state.get("confronto_effettivo")
+    if stato is None or stato[0] != eff_key:
+        store = snapshot_store()
+        stato = (eff_key, PROF.track("confronto", lambda: compare_snapshot(store, frames_eff, chiavi)))
+        st.session_state["confronto_effettivo"] = stato
+        prune_snapshots(os.path.join(SNAPSHOT_DIR, "sessioni"), SNAPSHOT_TTL_S)
+    return stato[1]
+
+def load_budget(uploaded, wait: bool = True):
+    """Budget parsato (colonne ripulite) come copia modificabile + chiave di cache; (None, chiave) se il job
+    in background non ha ancora finito (wait=False) o se è stato annullato mentre lo si attendeva."""
+    data = uploaded.getvalue()
+    key = f"bud-{file_digest(data)}"
+    def _parse(progress):
+        progress(0.0, "Lettura del workbook Budget")
+        return {"rows": read_budget(data)}
+    frames = background_frames(key, "ingest_budget", _parse, "Budget", slot="budget", wait=wait)
+    return (None if frames is None else frames["rows"].copy()), key
+
+def memo_stage(key: str, compute, cache: IngestCache = None) -> dict:
+    """Stadio della pipeline (align → slice → tabelle) memoizzato nella cache condivisa.
+    La chiave deve includere le chiavi degli stadi a monte; i frame sono condivisi e in sola lettura.
+    Il prefisso della chiave ('align', 'slice', ...) è il nome dello stadio nel pannello Performance."""
+    cache = cache or get_ingest_cache()
+    with PROF.stage(key.split("-", 1)[0]) as rec:
+        frames = cache.get(key)
+        rec["cache"] = "hit" if frames is not None else "miss"
+        if frames is None:
+            frames = compute()
+            cache.put(key, frames, persist=False)
+        rec.update(output_size(frames))
+    return frames
+
+def show_table(stage: str, styler):
+    """st.dataframe di una tabella stilizzata: lo stile viene calcolato qui, quindi è lo stadio di render."""
+    with PROF.stage(f"render_{stage}", **output_size(styler)):
+        st.dataframe(styler, use_container_width=True)
+
+def show_heatmap(stage: str, df: pd.DataFrame):
+    """Heatmap percentuale della finestra visibile come tabella HTML (LUT CSS precalcolata, niente Styler)."""
+    with PROF.stage(f"render_{stage}", **output_size(df)):
+        st.markdown(heatmap_html(df), unsafe_allow_html=True)
+
+def download_xlsx(label: str, key: str, build, file_name: str):
+    """Download di un xlsx generato solo al click (build() -> bytes) e memoizzato con `key` (hash dei dati)."""
+    cache = get_ingest_cache()  # risolta qui: il callable gira fuori dal thread dello script
+    st.download_button(
+        label,
+        data=lambda: memo_stage(key, lambda: {"xlsx": build()}, cache)["xlsx"],
+        file_name=file_name,
+        mime=XLSX_MIME,
+    )
+
+def download_budget(label: str, df: pd.DataFrame, file_name: str):
+    download_xlsx(label, f"xlsx-bud-{frame_digest(df)}", lambda: write_xlsx({"Budget": df}, index=False), file_name)
+
+# ------------------------------
+# Archivio Budget (SQLite, condiviso tra sessioni)
+# ------------------------------
+@_cache_resource
+def get_budget_db() -> BudgetDB:
+    return BudgetDB(BUDGET_DB_PATH)
+
+def snapshot_labels(snapshots: pd.DataFrame) -> dict:
+    """id -> etichetta leggibile per le selectbox."""
+    return {
+        int(r.id): f"#{r.id} · {r.creato.replace('T', ' ')} · {r.clienti} clienti" + (f" · {r.etichetta}" if r.etichetta else "")
+        for r in snapshots.itertuples()
+    }
+
+# ------------------------------
+# Archivio storico Effettivo (Parquet per mese)
+# ------------------------------
+def get_effettivo_archive() -> EffettivoArchive:
+    return EffettivoArchive(ARCHIVE_DIR)
+
+def load_archive_months(archive: EffettivoArchive, mesi) -> tuple:
+    """df_eff_tot e totali giornalieri dei soli mesi indicati + chiave di cache; gli aggregati di ogni mese sono
+    memoizzati con la versione della sua partizione, quindi cambiare selezione non rilegge i mesi già visti."""
+    stamps = [(m, archive.stamp(m)) for m in mesi]
+    parts = [memo_stage(f"arcm-{m}-{stamp}", lambda m=m: archive.month_aggregates(m)) for m, stamp in stamps]
+    key = f"arc-{file_digest(repr(stamps).encode())}"
+    daily = pd.concat([p["giornaliero"] for p in parts], ignore_index=True) if parts else None
+    return merge_pivots([p["pivot"] for p in parts]), daily, key
+
+# ------------------------------
+# Budget di sessione (store lungo + vista larga derivata)
+# ------------------------------
+def set_budget_store(store: BudgetStore):
+    wide = store.to_wide()
+    st.session_state["budget_store"] = store
+    st.session_state["budget_df"] = wide
+    st.session_state["budget_store_digest"] = frame_digest(wide)
+
+def get_budget_store() -> BudgetStore:
+    """Store del Budget di sessione; ricostruito solo se il contenuto di budget_df è cambiato altrove
+    (data_editor, gate categorie). data_editor restituisce un frame nuovo a ogni rerun: conta l'hash, non l'identità."""
+    store = st.session_state.get("budget_store")
+    wide = st.session_state["budget_df"]
+    if wide is None:
+        return store if store is not None else BudgetStore()
+    if store is None or (store.to_wide() is not wide and st.session_state.get("budget_store_digest") != frame_digest(wide)):
+        store = BudgetStore.from_wide(wide)
+        set_budget_store(store)
+    return store
+
 # ------------------------------
 # Sidebar Nav
 # ------------------------------
 sezione = st.sidebar.radio("Vai a:", ["📝 Budget Editor", "📈 Analisi Scostamenti"])
 
+# ------------------------------
+# Profilazione per stadio (pannello compilato a fine script)
+# ------------------------------
+PERF_HISTORY = 20  # rerun conservati per l'export
+perf_box = st.sidebar.expander("⏱️ Performance", expanded=False)
+with perf_box:
+    perf_memory = ui_toggle_inline("Picco di memoria per stadio (tracemalloc: rallenta tutte le sessioni)", False, key="perf_memory")
+PROF = StageProfiler(memory=perf_memory)
+
 # ------------------------------
 # BUDGET EDITOR
 # ------------------------------
@@ -83,8 +365,10 @@ if sezione == "📝 Budget Editor":
     uploaded_budget = st.file_uploader("📄 Carica un file Budget esistente (opzionale)", type=["xlsx"])
     if uploaded_budget:
         try:
-            df = pd.read_excel(uploaded_budget)
-            df.columns = df.columns.str.strip()
+            df, upload_key = load_budget(uploaded_budget)
+            if df is None:
+                st.warning("Caricamento del Budget annullato prima del termine: ricarica il file per riprovare.")
+                st.stop()
             cliente_col = next((c for c in df.columns if c.lower()=="cliente"), None)
             if not cliente_col:
                 st.error("Il file Budget deve contenere la colonna 'cliente'.")
@@ -95,7 +379,10 @@ if sezione == "📝 Budget Editor":
                 df["categoria_cliente"] = ""
             elif cat_col != "categoria_cliente":
                 df = df.rename(columns={cat_col: "categoria_cliente"})
-            st.session_state["budget_df"] = df
+            # ricarica solo se il file è cambiato, così le modifiche in sessione non vengono perse
+            if st.session_state.get("budget_upload_key") != upload_key:
+                set_budget_store(BudgetStore.from_wide(df))
+                st.session_state["budget_upload_key"] = upload_key
             st.success("✅ File Budget caricato.")
         except Exception as e:
             st.error(f"Errore nel caricamento Budget: {e}")
@@ -103,7 +390,7 @@ if sezione == "📝 Budget Editor":
     st.subheader("➕ Nuovo Cliente")
     with st.form("aggiungi_cliente"):
         nuovo_cliente = st.text_input("Nome Cliente").strip()
-        categoria_cliente = st.selectbox("Categoria Cliente", ["", "Ricorrente", "Progetto", "Interno", "Altro"])
+        categoria_cliente = st.selectbox("Categoria Cliente", [""] + CATEGORIE)
         anni = st.multiselect("Anni da includere", options=list(range(2024, 2036)), default=[datetime.now().year])
         mesi = st.multiselect("Mesi da includere", options=list(range(1, 13)), default=list(range(1, 13)))
         coeff = st.number_input("Coefficiente", min_value=1, max_value=100, value=50)
@@ -111,165 +398,175 @@ if sezione == "📝 Budget Editor":
         xselling = st.number_input("Beget Xselling (numero)", min_value=0.0, value=0.0, step=1.0)
         submitted = st.form_submit_button("Aggiungi Cliente")
         if submitted and nuovo_cliente and categoria_cliente and anni and mesi:
-            record = {"cliente": nuovo_cliente, "categoria_cliente": categoria_cliente}
-            for anno in anni:
-                for mese in mesi:
-                    base = f"{anno}-{mese:02d}"
-                    totale = (budget_mensile + xselling) / coeff if coeff > 0 else 0
-                    record[f"{base}_coeff"] = coeff
-                    record[f"{base}_budget_mensile"] = budget_mensile
-                    record[f"{base}_xselling"] = xselling
-                    record[f"{base} (1-15)"] = round(totale/2, 2)
-                    record[f"{base} (1-fine)"] = round(totale, 2)
-            nuovo_df = pd.DataFrame([record])
-            if st.session_state["budget_df"] is not None:
-                st.session_state["budget_df"] = pd.concat([st.session_state["budget_df"], nuovo_df], ignore_index=True)
-            else:
-                st.session_state["budget_df"] = nuovo_df
+            store = get_budget_store()
+            store.add_client(nuovo_cliente, categoria_cliente, anni, mesi, coeff, budget_mensile, xselling)
+            set_budget_store(store)
             st.success(f"Cliente '{nuovo_cliente}' aggiunto!")
 
+    st.subheader("📥 Import massivo clienti")
+    st.caption(f"CSV o Excel in formato lungo, una riga per cliente e mese: {', '.join(IMPORT_COLUMNS)} (+ opzionali xselling, categoria_cliente).")
+    uploaded_import = st.file_uploader("Carica file di import", type=["csv", "xlsx"], key="budget_import")
+    if uploaded_import and st.button("Importa clienti"):
+        try:
+            data = uploaded_import.getvalue()
+            if uploaded_import.name.lower().endswith(".csv"):
+                df_import = pd.read_csv(BytesIO(data), sep=None, engine="python")
+            else:
+                df_import = pd.read_excel(BytesIO(data))
+            store = get_budget_store()
+            n = store.import_table(df_import)
+            set_budget_store(store)
+            st.success(f"✅ Importate {n} righe.")
+        except Exception as e:
+            st.error(f"Errore nell'import: {e}")
+
     if st.session_state["budget_df"] is not None:
         st.subheader("✏️ Modifica diretta del Budget")
         edited_df = st.data_editor(st.session_state["budget_df"], use_container_width=True, num_rows="dynamic")
         st.session_state["budget_df"] = edited_df
-        buffer = BytesIO()
-        edited_df.to_excel(buffer, index=False)
-        st.download_button(
-            label="💾 Scarica Budget aggiornato",
-            data=buffer.getvalue(),
-            file_name="budget_generato.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        download_budget("💾 Scarica Budget aggiornato", edited_df, "budget_generato.xlsx")
     else:
         st.info("Carica un file o aggiungi un cliente per iniziare.")
 
+    st.subheader("🗄️ Archivio Budget")
+    db = get_budget_db()
+    c_save, c_load = st.columns(2)
+    with c_save:
+        etichetta = st.text_input("Etichetta snapshot (opzionale)", key="snapshot_label")
+        if st.button("Salva snapshot", disabled=st.session_state["budget_df"] is None):
+            snap_id = db.save(get_budget_store(), etichetta)
+            st.success(f"✅ Salvato snapshot #{snap_id}.")
+    with c_load:
+        snapshots = db.snapshots()
+        if snapshots.empty:
+            st.info("Nessuno snapshot salvato.")
+        else:
+            scelta = st.selectbox("Snapshot", list(snapshots["id"]), format_func=snapshot_labels(snapshots).get)
+            if st.button("Carica snapshot"):
+                set_budget_store(db.load_store(int(scelta)))
+                safe_rerun()
+
+    st.subheader("🏷️ Regole categorie clienti")
+    st.caption("Assegnano la categoria ai clienti che ne sono privi: 'tabella' = nome esatto, 'prefisso' = inizio del nome "
+               "(vince il più lungo), 'regex' = espressione regolare (nell'ordine). Maiuscole e spazi esterni non contano.")
+    regole = st.data_editor(
+        db.category_rules(), use_container_width=True, num_rows="dynamic", hide_index=True, key="category_rules",
+        column_config={
+            "tipo": st.column_config.SelectboxColumn("Tipo", options=list(RULE_TYPES), required=True),
+            "modello": st.column_config.TextColumn("Modello", required=True),
+            "categoria": st.column_config.SelectboxColumn("Categoria", options=CATEGORIE, required=True),
+        },
+    )
+    c_rules, c_apply = st.columns(2)
+    with c_rules:
+        if st.button("Salva regole"):
+            try:
+                st.success(f"✅ Salvate {db.save_category_rules(regole)} regole.")
+            except ValueError as e:
+                st.error(str(e))
+    with c_apply:
+        if st.button("Applica ai clienti senza categoria", disabled=st.session_state["budget_df"] is None):
+            store = get_budget_store()
+            clients = store.clients
+            senza = clients.loc[clients["categoria_cliente"].fillna("").astype(str).str.strip() == "", "cliente"]
+            assegnate = assign_categories(senza, db.category_rules())
+            assegnate = assegnate[assegnate != ""]
+            if len(assegnate):
+                store.upsert_clients(pd.DataFrame({"cliente": assegnate.index, "categoria_cliente": assegnate.to_numpy()}))
+                set_budget_store(store)
+            st.success(f"✅ Categoria assegnata a {len(assegnate)} clienti su {len(senza)} senza categoria.")
+
 # ------------------------------
 # ANALISI SCOSTAMENTI
 # ------------------------------
 elif sezione == "📈 Analisi Scostamenti":
     st.header("📈 Analisi Scostamenti Budget vs Effettivo")
 
-    uploaded_eff = st.file_uploader("📥 Carica file 'Effettivo' (obbligatorio)", type=["xlsx"])
+    st.sidebar.markdown("**Ingestione**")
+    fonte_eff = st.sidebar.radio("Fonte Effettivo", ["File", "Archivio storico"], horizontal=True, key="eff_source")
+    archive = get_effettivo_archive()
+    mesi_archivio = []
+    if fonte_eff == "File":
+        uploaded_eff = st.file_uploader("📥 Carica file 'Effettivo' (obbligatorio; più export o fogli vengono uniti)", type=["xlsx"], accept_multiple_files=True)
+        eff_streaming = ui_toggle_sidebar("Lettura Effettivo in streaming (solo data/cliente/ore)", False, key="eff_streaming")
+        chiavi_dup = parse_key_columns(st.sidebar.text_input(
+            "Colonne chiave dei duplicati tra export (oltre a data, cliente, ore)", "risorsa, attività", key="eff_dedup_keys"))
+    else:
+        uploaded_eff = None
+        mesi_archivio = archive.months()
+        if mesi_archivio:
+            st.info(f"🗄️ Archivio Effettivo: {len(mesi_archivio)} mesi ({mesi_archivio[0]} → {mesi_archivio[-1]}); vengono letti solo i mesi selezionati.")
+        else:
+            st.warning("L'archivio Effettivo è vuoto: carica un file e archivialo.")
+    budget_snapshot = None  # Budget dall'archivio: caricato dopo la scelta dei periodi
+    confronto = None  # differenze rispetto al caricamento precedente dell'Effettivo (compare_upload)
+    ingest_pending = {}  # job di ingestione ancora in corso (etichetta -> chiave): Budget ed Effettivo in parallelo
     if st.session_state["budget_df"] is not None:
         df_budget = st.session_state["budget_df"]
         st.success("✅ Usando il Budget in memoria.")
     else:
         uploaded_budget = st.file_uploader("📄 Carica file 'Budget' (alternativo)", type=["xlsx"])
+        snapshots = get_budget_db().snapshots()
+        df_budget = None
         if uploaded_budget:
-            df_budget = pd.read_excel(uploaded_budget)
-            df_budget.columns = df_budget.columns.str.strip()
-        else:
-            df_budget = None
-
-    if uploaded_eff and df_budget is not None:
+            df_budget, budget_key = load_budget(uploaded_budget, wait=False)
+            if df_budget is None:
+                ingest_pending["Budget"] = budget_key
+        elif not snapshots.empty:
+            budget_snapshot = int(st.sidebar.selectbox("Snapshot Budget (archivio)", list(snapshots["id"]), format_func=snapshot_labels(snapshots).get))
+            st.success(f"✅ Usando il Budget dall'archivio (snapshot #{budget_snapshot}).")
+
+    if (uploaded_eff or mesi_archivio) and (df_budget is not None or budget_snapshot is not None or ingest_pending):
         try:
-            # ---- Effettivo
-            df_eff = pd.read_excel(uploaded_eff, sheet_name="Effettivo")
-            df_eff.columns = df_eff.columns.str.strip().str.lower()
-            df_eff["data"] = pd.to_datetime(df_eff["data"], errors="coerce", dayfirst=True)
-            df_eff["mese"] = df_eff["data"].dt.to_period("M").astype(str)
-            df_eff["giorno"] = df_eff["data"].dt.day
-
-            pivot_1_15 = df_eff[df_eff["giorno"] <= 15].pivot_table(index="cliente", columns="mese", values="ore", aggfunc="sum", fill_value=0)
-            pivot_1_15.columns = [f"{c} (1-15)" for c in pivot_1_15.columns]
-            pivot_1_fine = df_eff.pivot_table(index="cliente", columns="mese", values="ore", aggfunc="sum", fill_value=0)
-            pivot_1_fine.columns = [f"{c} (1-fine)" for c in pivot_1_fine.columns]
-
-            df_eff_tot = pd.concat([pivot_1_15, pivot_1_fine], axis=1).fillna(0)
-            df_eff_tot = df_eff_tot.reindex(sorted(df_eff_tot.columns), axis=1)
-            df_eff_tot.index = df_eff_tot.index.astype(str)
-
-            # ---- Budget
-            df_budget = df_budget.copy()
-            df_budget.columns = df_budget.columns.str.strip()
-            cliente_col = next((c for c in df_budget.columns if c.lower()=="cliente"), None)
-            if not cliente_col:
-                st.error("Nel Budget manca la colonna 'cliente'.")
-                st.stop()
-
-            cat_col = next((c for c in df_budget.columns if c.lower()=="categoria_cliente"), None)
-            if not cat_col:
-                df_budget["categoria_cliente"] = ""
-                cat_col = "categoria_cliente"
-            elif cat_col != "categoria_cliente":
-                df_budget = df_budget.rename(columns={cat_col: "categoria_cliente"})
-                cat_col = "categoria_cliente"
-
-            df_budget = df_budget.set_index(cliente_col)
-
-            pattern = re.compile(r"^\d{4}-\d{2} \((1-15|1-fine)\)$")
-            colonne_valide = [c for c in df_budget.columns if pattern.match(str(c))]
-            colonne_comuni = df_eff_tot.columns.intersection(colonne_valide)
-
-            # indici unione + round(2) su matrici base
-            idx_union = sorted(set(df_budget.index.astype(str)).union(set(df_eff_tot.index.astype(str))))
-            eff = df_eff_tot.reindex(index=idx_union, columns=colonne_comuni, fill_value=0).round(2)
-            budget = df_budget.reindex(index=idx_union, columns=colonne_comuni, fill_value=0).round(2)
-
-            # ---- Gate categorie obbligatorie
-            cat_series = df_budget.reindex(index=idx_union)["categoria_cliente"].fillna("")
-            missing_cat = [c for c in idx_union if (c not in df_budget.index) or (str(cat_series.get(c, "")).strip() == "")]
-            if missing_cat:
-                st.error("⚠ Alcuni clienti non hanno categoria assegnata. Completa per procedere:")
-                nuove_cat = {}
-                for cliente in missing_cat:
-                    nuove_cat[cliente] = st.selectbox(f"Categoria per '{cliente}'", ["", "Ricorrente", "Progetto", "Interno", "Altro"], key=f"cat_{cliente}")
-                if st.button("Conferma categorie e procedi"):
-                    for cliente, cat in nuove_cat.items():
-                        if cat:
-                            if cliente in df_budget.index:
-                                df_budget.loc[cliente, "categoria_cliente"] = cat
-                            else:
-                                new_row = pd.Series({col: 0 for col in df_budget.columns}, name=cliente)
-                                new_row["categoria_cliente"] = cat
-                                df_budget = pd.concat([df_budget, new_row.to_frame().T])
-                    st.session_state["budget_df"] = df_budget.reset_index().rename(columns={"index": "cliente"})
-                    safe_rerun()
-                st.stop()
+            # ---- Stadio ingest (cache per hash del file, job in background); con l'archivio si parte dai soli nomi dei mesi
+            if uploaded_eff:
+                frames_eff, eff_key = load_effettivo(uploaded_eff, streaming=eff_streaming, chiavi=chiavi_dup)
+                if frames_eff is None:
+                    ingest_pending["Effettivo"] = eff_key
+            wait_jobs(ingest_pending)  # entrambi i job sono già partiti: si prosegue quando sono pronti
+            if uploaded_eff:
+                df_eff_tot, df_daily, date_scartate = frames_eff["pivot"], frames_eff.get("giornaliero"), frames_eff.get("date_scartate")
+                eff_rows = frames_eff.get("rows")  # assenti in streaming e con più export
+                eff_cols = list(df_eff_tot.columns)
+                if "impronta" in frames_eff:
+                    confronto = compare_upload(eff_key, frames_eff, chiavi_dup)
+                if date_scartate is not None and not date_scartate.empty:
+                    st.warning(f"⚠ {int(date_scartate['righe'].sum())} righe dell'Effettivo hanno una data non interpretabile e sono escluse dall'analisi.")
+                    with st.expander("Date non interpretabili (valore → righe)"):
+                        st.dataframe(date_scartate.rename(columns={"valore": "Valore", "righe": "Righe"}), use_container_width=True, hide_index=True)
+                if "parti" in frames_eff:
+                    parti = frames_eff["parti"]
+                    st.info(f"📚 Uniti {len(parti)} fogli da {parti['file'].nunique()} file: {int(parti['duplicate'].sum())} righe duplicate escluse.")
+                    with st.expander("File e fogli uniti (righe, duplicate di export già letti)"):
+                        st.dataframe(parti.rename(columns=str.capitalize), use_container_width=True, hide_index=True)
+                    st.caption("L'archiviazione è disponibile caricando un solo workbook con il foglio 'Effettivo'.")
+                elif st.button("🗄️ Archivia questo Effettivo (aggiunge o sostituisce i mesi che contiene)"):
+                    rows = frames_eff["rows"] if "rows" in frames_eff else load_effettivo(uploaded_eff, wait=True)[0]["rows"]
+                    mesi_scritti = archive.ingest(rows)
+                    st.success(f"✅ Archiviati {len(mesi_scritti)} mesi: {', '.join(mesi_scritti)}")
+            else:
+                eff_cols = month_columns(mesi_archivio)
+                eff_rows = None  # righe lette dalla partizione del mese solo quando servono (drill-down)
 
-            # ---- Scostamenti % (numeric-backed)
-            diff_percent_num = pd.DataFrame(index=eff.index, columns=colonne_comuni, dtype=float)
-            diff_mask_zero = pd.DataFrame(False, index=eff.index, columns=colonne_comuni)
-            for col in colonne_comuni:
-                num = (budget[col].astype(float) - eff[col].astype(float))
-                den = budget[col].astype(float)
-                perc = np.zeros_like(num, dtype=float)
-                np.divide(num, den, out=perc, where=den!=0)
-                perc = np.round(perc * 100, 1)
-                mask_extrabudget = (den == 0) & (eff[col] > 0)
-                mask_zero = (den == 0) & (eff[col] == 0)
-                diff_mask_zero[col] = mask_zero
-                perc = pd.Series(perc, index=eff.index)
-                perc.loc[mask_zero] = np.nan
-                perc.loc[mask_extrabudget] = -9999
-                diff_percent_num[col] = perc.astype(float)
+            # ---- Periodi comuni Effettivo ∩ Budget (per l'archivio bastano gli indici, senza leggere le righe)
+            budget_cols = get_budget_db().period_columns(budget_snapshot) if budget_snapshot is not None else [str(c).strip() for c in df_budget.columns]
+            budget_cols = set(period_axis(budget_cols).index)
+            colonne_comuni = [c for c in eff_cols if c in budget_cols]
+            asse = period_axis(colonne_comuni)
 
             # ------------------------------
-            # FILTRI (sidebar)
+            # FILTRI PERIODO (sidebar)
             # ------------------------------
-            clienti_opzioni = ["Tutti i clienti"] + list(eff.index.astype(str))
-            selezione_cliente = st.sidebar.selectbox("Filtro cliente", clienti_opzioni, index=0)
-
-            st.sidebar.markdown("**Categorie**")
-            cat_map = df_budget["categoria_cliente"].astype(str).fillna("")
-            cat_map_norm = cat_map.str.strip().str.title()
-            categorie_disponibili = sorted([c for c in cat_map_norm.unique() if c])
-            categorie_scelte = []
-            for c in categorie_disponibili:
-                if ui_toggle_sidebar(f"• {c}", True, key=f"cat_{c}"):
-                    categorie_scelte.append(c)
-
             st.sidebar.markdown("**Colonne**")
             include_115 = ui_toggle_sidebar("Includi 1-15", True, key="inc_115")
             include_1fine = ui_toggle_sidebar("Includi 1-fine", True, key="inc_1fine")
 
-            
             st.sidebar.markdown("**Anni e Mesi**")
-            years_available = sorted({parse_col(c)[0] for c in colonne_comuni if parse_col(c)})
+            years_available = sorted(asse["anno"].unique().tolist())
             selected_year_months = {}
             month_names_it = {1:"Gennaio",2:"Febbraio",3:"Marzo",4:"Aprile",5:"Maggio",6:"Giugno",7:"Luglio",8:"Agosto",9:"Settembre",10:"Ottobre",11:"Novembre",12:"Dicembre"}
             for y in years_available:
-                months_y = sorted({parse_col(c)[1] for c in colonne_comuni if parse_col(c) and parse_col(c)[0]==y})
+                months_y = sorted(asse.loc[asse["anno"] == y, "mese"].unique().tolist())
                 with st.sidebar.expander(f"Anno {y}", expanded=True):
                     include_year = ui_toggle_inline("Tutti i mesi", True, key=f"year_{y}")
                     if include_year:
@@ -280,322 +577,429 @@ elif sezione == "📈 Analisi Scostamenti":
                                 selected_months.add(m)
                         if selected_months:
                             selected_year_months[y] = selected_months
-            def col_selected(c):
-                p = parse_col(c)
-                if not p:
-                    return False
-                y, m, half = p
-                if y not in selected_year_months or m not in selected_year_months[y]:
-                    return False
-                if half == "1-15" and not include_115:
-                    return False
-                if half == "1-fine" and not include_1fine:
-                    return False
-                return True
-
-            selected_cols = [c for c in colonne_comuni if col_selected(c)]
+            # selezione vettoriale sull'asse periodi: (anno, mese) scelti e metà incluse
+            mesi_scelti = [(y, m) for y, ms in selected_year_months.items() for m in ms]
+            meta_incluse = [h for h, on in (("1-15", include_115), ("1-fine", include_1fine)) if on]
+            mask = pd.MultiIndex.from_arrays([asse["anno"], asse["mese"]]).isin(mesi_scelti) & asse["meta"].isin(meta_incluse).to_numpy()
+            selected_cols = list(asse.index[mask])
             if not selected_cols:
                 selected_cols = list(colonne_comuni)
 
+            # ---- Effettivo dall'archivio: solo le partizioni dei mesi selezionati
+            if not uploaded_eff:
+                df_eff_tot, df_daily, eff_key = load_archive_months(archive, sorted({c[:7] for c in selected_cols}))
+
+            # ---- Budget dall'archivio: solo i mesi selezionati (snapshot immutabile → chiave stabile).
+            #      Tutti i clienti: filtro cliente, categorie in sidebar e gate delle categorie mancanti nascono dal
+            #      Budget allineato, quindi la selezione dei clienti si fa dopo, per posizione sul cubo (stadio slice)
+            if budget_snapshot is not None:
+                sel = period_axis(selected_cols)
+                periodi = sorted(set(zip(sel["anno"].tolist(), sel["mese"].tolist())))
+                df_budget = memo_stage(
+                    f"dbbud-{budget_snapshot}-{file_digest(repr(periodi).encode())}",
+                    lambda: {"wide": get_budget_db().load_wide(budget_snapshot, periodi=periodi)},
+                )["wide"]
+
+            # ---- Stadio align: Budget preparato + cubo compatto clienti x periodi (float32, round(2) in lettura)
+            align_key = f"align-{eff_key}-{frame_digest(df_budget)}"
+            def _stage_align(progress):
+                progress(0.0, "Preparazione Budget")
+                df_prep = prepare_budget(df_budget)
+                progress(0.5, "Cubo clienti x periodi")
+                return {"budget_prep": df_prep, "cube": build_cube(df_prep, df_eff_tot)}
+            stage_align = background_frames(align_key, "align", _stage_align, "Allineamento Budget/Effettivo", persist=False)
+
+            # ---- Indici del drill-down: una volta per Effettivo, in parallelo all'allineamento
+            indice_key = f"indice-{eff_key}"
+            def _stage_indice(progress):
+                progress(0.0, "Indice per cliente e data")
+                out = {"giorni": RowIndex.build(df_daily)} if df_daily is not None else {}
+                if eff_rows is not None:
+                    out["righe"] = RowIndex.build(eff_rows)
+                return out
+            indici = background_frames(indice_key, "indice", _stage_indice, "Indice drill-down", persist=False)
+            wait_jobs({label: key for label, key, frames in (
+                ("Allineamento Budget/Effettivo", align_key, stage_align), ("Indice drill-down", indice_key, indici),
+            ) if frames is None})
+            df_budget = stage_align["budget_prep"]
+            cube = stage_align["cube"]
+            idx_union = list(cube.clients)
+
+            # ---- Gate categorie obbligatorie: prima le regole (un passaggio vettoriale), poi una sola tabella per i residui
+            regole_cat = get_budget_db().category_rules()
+            missing_cat = missing_categories(df_budget, idx_union)
+            cat_key = "nocat"  # categorie assegnate al volo dalle regole: entrano nella chiave dello slice
+            if missing_cat:
+                auto_cat = assign_categories(missing_cat, regole_cat)
+                trovate = auto_cat[auto_cat != ""]
+                if len(trovate):
+                    df_budget = with_categories(df_budget, trovate)
+                    cat_key = frame_digest(trovate.to_frame())
+                    st.info(f"🏷️ Categoria assegnata dalle regole a {len(trovate)} clienti.")
+                residui = list(auto_cat.index[auto_cat == ""])
+                if residui:
+                    st.error(f"⚠ {len(residui)} clienti non hanno categoria e nessuna regola li copre. Completa la tabella per procedere:")
+                    tabella_cat = st.data_editor(
+                        pd.DataFrame({"cliente": residui, "categoria_cliente": [""] * len(residui)}),
+                        use_container_width=True, hide_index=True, disabled=["cliente"], key="cat_gate",
+                        column_config={"categoria_cliente": st.column_config.SelectboxColumn("Categoria", options=CATEGORIE)},
+                    )
+                    ricorda = ui_toggle_inline("Ricorda le scelte come regole (tabella cliente → categoria)", True, key="cat_remember")
+                    if st.button("Conferma categorie e procedi"):
+                        scelte = tabella_cat.set_index("cliente")["categoria_cliente"].fillna("").astype(str).str.strip()
+                        scelte = scelte[scelte != ""]
+                        if ricorda and len(scelte):
+                            get_budget_db().add_category_rules(pd.DataFrame({"tipo": "tabella", "modello": scelte.index, "categoria": scelte.to_numpy()}))
+                        nuove_cat = pd.concat([trovate, scelte])
+                        if budget_snapshot is not None:
+                            # l'archivio non si modifica: le categorie finiscono in un nuovo snapshot (diventa il più recente)
+                            store = get_budget_db().load_store(budget_snapshot)
+                            store.upsert_clients(pd.DataFrame({"cliente": nuove_cat.index, "categoria_cliente": nuove_cat.to_numpy()}))
+                            get_budget_db().save(store, f"Categorie da snapshot #{budget_snapshot}")
+                            safe_rerun()
+                        df_budget = with_categories(stage_align["budget_prep"], nuove_cat)
+                        st.session_state["budget_df"] = df_budget.reset_index().rename(columns={"index": "cliente"})
+                        safe_rerun()
+                    st.stop()
+
+            # ------------------------------
+            # FILTRI CLIENTE (sidebar)
+            # ------------------------------
+            clienti_opzioni = ["Tutti i clienti"] + idx_union
+            selezione_cliente = st.sidebar.selectbox("Filtro cliente", clienti_opzioni, index=0)
+
+            st.sidebar.markdown("**Categorie**")
+            cat_map_norm = category_map(df_budget)
+            categorie_disponibili = sorted([c for c in cat_map_norm.unique() if c])
+            categorie_scelte = []
+            for c in categorie_disponibili:
+                if ui_toggle_sidebar(f"• {c}", True, key=f"cat_{c}"):
+                    categorie_scelte.append(c)
+
             if selezione_cliente != "Tutti i clienti":
                 idx = [selezione_cliente]
             else:
-                idx = [c for c in eff.index if cat_map_norm.get(c, "") in categorie_scelte]
+                idx = [c for c in idx_union if cat_map_norm.get(c, "") in categorie_scelte]
+
+            # ---- Stadio slice: selezione per posizione sul cubo + riepiloghi; in cache solo posizioni e tabelle ridotte,
+            #      le matrici float64 si costruiscono al momento (finestra visibile, rollup, grafici, export)
+            sel_key = file_digest("\x1f".join(idx).encode() + b"\x1e" + "\x1f".join(selected_cols).encode())
+            slice_key = f"slice-{align_key}-{cat_key}-{sel_key}"
+            def _stage_slice():
+                sel = CubeSlice(cube, *cube.locate(idx, selected_cols))
+                f = sel.frames()
+                out = {"sel": sel}
+                out["dashboard"] = dashboard_table(f["budget"], f["eff_in"], f["eff_extra"], cat_map_norm)
+                out["mensile"] = monthly_table(f["budget"], f["eff_in"], f["eff_extra"])
+                cols_fine = cols_of_half(selected_cols, "1-fine")
+                out["trimestrale"] = period_rollup(f["budget"], f["eff_in"], f["eff_extra"], cols_fine, "trimestre") if cols_fine else pd.DataFrame()
+                return out
+            stage_slice = memo_stage(slice_key, _stage_slice)
+            sel = stage_slice["sel"]
+
+            # ------------------------------
+            # RENDER
+            # ------------------------------
+            # ---- COSA È CAMBIATO rispetto al caricamento precedente dell'Effettivo
+            if confronto is not None:
+                mod = confronto["modifiche"].iloc[0]
+                st.subheader("🆕 Cosa è cambiato rispetto al caricamento precedente")
+                st.caption(f"Caricamento precedente: {str(mod['precedente']).replace('T', ' ')} · {int(mod['righe_precedenti'])} → {int(mod['righe'])} righe")
+                c_add, c_rem, c_mod = st.columns(3)
+                c_add.metric("Righe aggiunte", int(mod["aggiunte"]))
+                c_rem.metric("Righe rimosse", int(mod["rimosse"]))
+                c_mod.metric("Righe modificate", int(mod["modificate"]))
+                modifiche = memo_stage(f"modifiche-{align_key}-{frame_digest(confronto['delta'])}", lambda: {"t": what_changed(confronto["delta"], cube)})["t"]
+                if modifiche.empty:
+                    st.info("Nessuna cella cliente x periodo è cambiata.")
+                else:
+                    # già ordinate per |Δ Ore|: lo stile si calcola solo sulle prime righe, anche dopo un ricaricamento esteso
+                    mostrate = modifiche.iloc[:CHANGES_MAX_ROWS]
+                    st.caption(f"{len(modifiche)} celle cliente x periodo con ore cambiate (tutti i clienti e periodi in comune col Budget)"
+                               + (f"; mostrate le {len(mostrate)} con |Δ Ore| maggiore" if len(mostrate) < len(modifiche) else ""))
+                    show_table("modifiche", style_percent(mostrate.set_index(["Cliente", "Periodo"]), subset=["Scostamento % prima", "Scostamento % ora"]).format({
+                        "Budget": fmt_hours, "Ore prima": fmt_hours, "Ore ora": fmt_hours, "Δ Ore": fmt_hours,
+                        "Scostamento % prima": fmt_percent_numeric, "Scostamento % ora": fmt_percent_numeric,
+                    }))
+
+            # ---- FINESTRA RIGHE (heatmap + dettaglio): ordinamento lato server, stile solo sulle righe visibili
+            st.subheader("📉 Scostamento percentuale tra Budget e Ore Effettive")
+            n_clienti = len(sel)
+            c_mode, c_sort, c_size, c_page = st.columns(4)
+            modo_vista = c_mode.radio("Righe", ["Pagine", "Top-N outlier"], horizontal=True, key="view_mode")
+            if modo_vista == "Pagine":
+                ordina = c_sort.selectbox("Ordina per", list(VIEW_SORTS), format_func=VIEW_SORTS.get, key="view_sort")
+                page_size = c_size.selectbox("Righe per pagina", [25, 50, 100, 250], index=1, key="view_page_size")
+                n_pagine = max(1, math.ceil(n_clienti / page_size))
+                pagina = int(c_page.number_input(f"Pagina (di {n_pagine})", min_value=1, max_value=n_pagine, value=1, step=1))
+                righe_vis = page_window(order_clients(stage_slice["dashboard"], ordina), pagina, page_size)
+                inizio = (pagina - 1) * page_size
+            else:
+                top_n = int(c_size.number_input("N clienti", min_value=1, max_value=max(1, n_clienti), value=min(20, max(1, n_clienti)), step=5, key="view_top_n"))
+                righe_vis = order_clients(stage_slice["dashboard"], "peggiore")[:top_n]
+                inizio = 0
+            st.caption(f"Clienti {inizio + 1 if len(righe_vis) else 0}–{inizio + len(righe_vis)} di {n_clienti} (la stessa finestra vale per le tabelle per cliente; i totali restano su tutti i clienti)")
+
+            def in_window(per_client: pd.DataFrame) -> pd.DataFrame:
+                return per_client[per_client.index.get_level_values("Cliente").isin(righe_vis)]
 
-            # cast robusto e round(2)
-            eff_f = eff.loc[idx, selected_cols].apply(pd.to_numeric, errors='coerce').fillna(0).astype(float).round(2)
-            budget_f = budget.loc[idx, selected_cols].apply(pd.to_numeric, errors='coerce').fillna(0).astype(float).round(2)
-            diff_num_f = diff_percent_num.loc[idx, selected_cols]
-            zero_mask_f = diff_mask_zero.loc[idx, selected_cols]
+            # matrici della sola finestra visibile, lette dal cubo
+            finestra = PROF.track("finestra", lambda: sel.frames(righe_vis))
 
             # ---- HEATMAP
-            st.subheader("📉 Scostamento percentuale tra Budget e Ore Effettive")
-            def _style_heatmap(_df):
-                styles = pd.DataFrame("", index=_df.index, columns=_df.columns)
-                for c in _df.columns:
-                    for r in _df.index:
-                        v = _df.loc[r, c]
-                        if pd.isna(v):
-                            styles.loc[r, c] = 'background-color: black; color: black;'
-                        elif v == -9999:
-                            styles.loc[r, c] = 'background-color: violet; color: white;'
-                        else:
-                            try:
-                                norm = (float(v) + 50) / 150
-                                norm = max(0.0, min(1.0, norm))
-                                color = plt.cm.RdYlGn(norm)
-                                styles.loc[r, c] = f'background-color: {matplotlib.colors.rgb2hex(color)}'
-                            except Exception:
-                                styles.loc[r, c] = ""
-                return styles
-            st.dataframe(diff_num_f.style.apply(_style_heatmap, axis=None).format(fmt_percent_numeric), use_container_width=True)
+            show_heatmap("heatmap", finestra["perc"])
 
             # ---- DETTAGLIO COMPLETO
             st.subheader("📋 Dati Dettagliati (Effettivo / Budget / Scostamento %)")
-            df_view = pd.concat([eff_f, budget_f, diff_num_f], keys=["Effettivo", "Budget", "Scostamento %"], axis=1)
+            df_view = detail_table(finestra["eff"], finestra["budget"], finestra["perc"])
             scostamento_cols = [col for col in df_view.columns if isinstance(col, tuple) and col[0] == "Scostamento %"]
 
-            def _cell_style_percent(v):
-                try:
-                    if pd.isna(v):
-                        return 'background-color: black; color: black;'
-                    if float(v) == -9999:
-                        return 'background-color: violet; color: white;'
-                    norm = (float(v) + 50) / 150
-                    norm = max(0.0, min(1.0, norm))
-                    color = plt.cm.RdYlGn(norm)
-                    return f'background-color: {matplotlib.colors.rgb2hex(color)}'
-                except Exception:
-                    return ""
             fmt_dict = {("Scostamento %", c): fmt_percent_numeric for c in selected_cols}
             for c in selected_cols:
                 fmt_dict[("Effettivo", c)] = fmt_hours
                 fmt_dict[("Budget", c)] = fmt_hours
 
-            styled_view = df_view.style.applymap(_cell_style_percent, subset=pd.IndexSlice[:, scostamento_cols]).format(fmt_dict)
-            st.dataframe(styled_view, use_container_width=True)
+            styled_view = style_percent(df_view, subset=pd.IndexSlice[:, scostamento_cols]).format(fmt_dict)
+            show_table("dettaglio", styled_view)
+
+            # ---- DRILL-DOWN: cliente → mese → giorno → righe, per fette dell'indice (costo proporzionale al cliente)
+            st.subheader("🔎 Drill-down cliente → mese → giorno → righe")
+            mesi_sel = sorted({f"{y}-{m:02d}" for y, m in zip(asse.loc[selected_cols, "anno"], asse.loc[selected_cols, "mese"])})
+            clienti_dd = list(sel.clients)
+            if not clienti_dd or not mesi_sel:
+                st.info("Nessun cliente o mese selezionato.")
+            else:
+                c_cli, c_mese, c_giorno = st.columns(3)
+                cliente_dd = c_cli.selectbox("Cliente", clienti_dd, index=clienti_dd.index(selezione_cliente) if selezione_cliente in clienti_dd else 0, key="dd_cliente")
+                mese_dd = c_mese.selectbox("Mese", mesi_sel, index=len(mesi_sel) - 1, key="dd_mese")
+                inizio_dd, fine_dd = month_bounds(mese_dd)
+                celle = [c for c in (f"{mese_dd} (1-15)", f"{mese_dd} (1-fine)") if c in sel.columns]
+                cella = sel.frames([cliente_dd])
+                show_table("drill_cella", style_percent(pd.DataFrame({
+                    "Effettivo": cella["eff"].loc[cliente_dd, celle], "Budget": cella["budget"].loc[cliente_dd, celle], "Scostamento %": cella["perc"].loc[cliente_dd, celle],
+                }).rename_axis("Periodo"), subset=["Scostamento %"]).format({"Effettivo": fmt_hours, "Budget": fmt_hours, "Scostamento %": fmt_percent_numeric}))
+
+                if "giorni" not in indici:
+                    st.info("Totali giornalieri non disponibili per questo Effettivo: ricaricare il file.")
+                else:
+                    with PROF.stage("drill_giorni") as rec:
+                        giorni_dd = day_table(indici["giorni"].rows(cliente_dd, inizio_dd, fine_dd), inizio_dd, fine_dd)
+                        rec.update(output_size(giorni_dd))
+                    st.bar_chart(giorni_dd.set_index("Giorno")["Ore"], height=180)
+                    opzioni_giorno = ["Tutto il mese"] + [d.strftime("%Y-%m-%d") for d in giorni_dd.loc[giorni_dd["Ore"] != 0, "Giorno"]]
+                    giorno_dd = c_giorno.selectbox("Giorno", opzioni_giorno, key="dd_giorno")
+                    da, a = (inizio_dd, fine_dd) if giorno_dd == "Tutto il mese" else (giorno_dd, giorno_dd)
+                    with PROF.stage("drill_righe") as rec:
+                        if "righe" in indici:
+                            righe_dd = indici["righe"].rows(cliente_dd, da, a).drop(columns=["mese", "giorno"], errors="ignore")
+                        elif not uploaded_eff:
+                            righe_dd = archive.read([mese_dd], clienti=[cliente_dd])
+                            righe_dd = righe_dd[righe_dd["data"].between(pd.Timestamp(da), pd.Timestamp(a))].sort_values("data", kind="stable")
+                        else:
+                            righe_dd = None
+                        rec.update(output_size(righe_dd) if righe_dd is not None else {})
+                    if righe_dd is None:
+                        st.caption("Righe di dettaglio non disponibili (lettura in streaming o più export): solo totali giornalieri.")
+                    else:
+                        st.caption(f"{len(righe_dd)} righe · {righe_dd['ore'].sum():.2f} ore")
+                        st.dataframe(righe_dd, use_container_width=True, hide_index=True)
 
             # ---- DASHBOARD PER CLIENTE (ultra-robusta)
             st.subheader("📊 Dashboard riepilogativa per cliente")
-            cols_fine = [c for c in eff_f.columns if parse_col(c) and parse_col(c)[2] == "1-fine"]
-            if not cols_fine:
-                cols_fine = [c for c in eff_f.columns if parse_col(c) and parse_col(c)[2] == "1-15"]
-
-            eff_sum = (eff_f[cols_fine].apply(pd.to_numeric, errors='coerce').fillna(0).astype(float).sum(axis=1)
-                       if len(cols_fine)>0 else eff_f.apply(pd.to_numeric, errors='coerce').fillna(0).astype(float).sum(axis=1))
-            bud_sum = (budget_f[cols_fine].apply(pd.to_numeric, errors='coerce').fillna(0).astype(float).sum(axis=1)
-                       if len(cols_fine)>0 else budget_f.apply(pd.to_numeric, errors='coerce').fillna(0).astype(float).sum(axis=1))
-
-            ore_eff = eff_sum.astype(float).round(2)
-            ore_bud = bud_sum.astype(float).round(2)
-
-            dashboard = pd.DataFrame({
-                "Ore Effettive": ore_eff,
-                "Ore a Budget": ore_bud,
-                "Categoria": [cat_map_norm.get(c, "") for c in eff_f.index]
-            }, index=eff_f.index)
-
-            dashboard["Scostamento Valore (ore)"] = (dashboard["Ore a Budget"].astype(float) - dashboard["Ore Effettive"].astype(float)).round(2)
-
-            den_dash = dashboard["Ore a Budget"].astype(float)
-            num_dash = (dashboard["Ore a Budget"].astype(float) - dashboard["Ore Effettive"].astype(float))
-
-            sc_perc = pd.Series(np.nan, index=dashboard.index, dtype=float)
-            mask_pos = den_dash > 0
-            sc_perc.loc[mask_pos] = (num_dash.loc[mask_pos] / den_dash.loc[mask_pos]) * 100.0
-            sc_perc = sc_perc.round(1)
-            sc_perc.loc[(den_dash == 0) & (dashboard["Ore Effettive"].astype(float) > 0)] = -9999
-            dashboard["Scostamento %"] = sc_perc
-
-            def _style_dash(v):
-                if pd.isna(v):
-                    return 'background-color: black; color: black;'
-                if v == -9999:
-                    return 'background-color: violet; color: white;'
-                try:
-                    norm = (float(v) + 50) / 150
-                    norm = max(0.0, min(1.0, norm))
-                    color = plt.cm.RdYlGn(norm)
-                    return f'background-color: {matplotlib.colors.rgb2hex(color)}'
-                except Exception:
-                    return ''
-            fmt_dash = {
-                "Scostamento %": fmt_percent_numeric,
-                "Ore Effettive": fmt_hours,
-                "Ore a Budget": fmt_hours,
-                "Scostamento Valore (ore)": fmt_hours,
-            }
-            st.dataframe(dashboard.style.applymap(_style_dash, subset=["Scostamento %"]).format(fmt_dash), use_container_width=True)
-
-            # ---- RIEPILOGO MENSILE (solo 1-fine)
+            dashboard = stage_slice["dashboard"].loc[righe_vis]
+            show_table("dashboard", style_percent(dashboard, subset=["Scostamento %"]).format(DASHBOARD_FMT))
 
             # ---- RIEPILOGO MENSILE (solo 1-fine)
             st.subheader("🗂️ Riepilogo mensile (solo 1-fine)")
-            base_months = sorted({(parse_col(c)[0], parse_col(c)[1]) for c in budget_f.columns if parse_col(c) and parse_col(c)[2]=="1-fine"})
-            rows = []
-            for y,m in base_months:
-                col = f"{y}-{m:02d} (1-fine)"
-                b_col = budget_f[col].astype(float)
-                e_col = eff_f[col].astype(float)
-
-                be = round(float(b_col.sum()), 2)  # Ore a Budget
-                mask_extrab = (b_col == 0) & (e_col > 0)
-                ee_extra = round(float(e_col[mask_extrab].sum()), 2)  # Ore Extrabudget
-                ee_in = round(float(e_col[~mask_extrab].sum()), 2)    # Ore Effettive senza Extrabudget
-                ee_tot = round(ee_in + ee_extra, 2)
-
-                if be > 0:
-                    s_in = round(((be - ee_in) / be) * 100, 1)
-                else:
-                    s_in = np.nan
-
-                if be > 0:
-                    s_tot = round(((be - ee_tot) / be) * 100, 1)
-                else:
-                    s_tot = -9999 if ee_tot > 0 else np.nan
-
-                rows.append({
-                    "Anno-Mese": f"{y}-{m:02d}",
-                    "Ore a Budget": be,
-                    "Ore Effettive (senza Extrabudget)": ee_in,
-                    "Ore Extrabudget": ee_extra,
-                    "Scostamento % (solo eff. a budget)": s_in,
-                    "Scostamento % (incl. Extrabudget)": s_tot,
-                })
-
-            riepilogo_mensile = pd.DataFrame(rows).set_index("Anno-Mese")
+            riepilogo_mensile = stage_slice["mensile"]
+            show_table("mensile", style_percent(riepilogo_mensile, subset=PERC_COLS).format(SUMMARY_FMT))
 
-            def _style_riep(v):
-                if pd.isna(v):
-                    return 'background-color: black; color: black;'
-                if v == -9999:
-                    return 'background-color: violet; color: white;'
-                try:
-                    norm = (float(v) + 50) / 150
-                    norm = max(0.0, min(1.0, norm))
-                    color = plt.cm.RdYlGn(norm)
-                    return f'background-color: {matplotlib.colors.rgb2hex(color)}'
-                except Exception:
-                    return ''
-            perc_cols = ["Scostamento % (solo eff. a budget)", "Scostamento % (incl. Extrabudget)"]
-            fmt_riep = {c: fmt_percent_numeric for c in perc_cols}
-            fmt_riep.update({
-                "Ore a Budget": fmt_hours,
-                "Ore Effettive (senza Extrabudget)": fmt_hours,
-                "Ore Extrabudget": fmt_hours,
-            })
-            st.dataframe(riepilogo_mensile.style.applymap(_style_riep, subset=perc_cols).format(fmt_riep), use_container_width=True)
             # ---- RIEPILOGO TRIMESTRALE (solo 1-fine)
             st.subheader("🧩 Riepilogo trimestrale per cliente (solo 1-fine)")
-            cols_fine_all = [c for c in budget_f.columns if parse_col(c) and parse_col(c)[2] == "1-fine"]
+            cols_fine_all = cols_of_half(sel.columns, "1-fine")
             if not cols_fine_all:
                 st.info("Nessuna colonna '1-fine' selezionata → il riepilogo trimestrale non è disponibile.")
             else:
-                # Mappa (anno, trimestre) -> lista colonne di quel trimestre
-                by_quarter = {}
-                for c in cols_fine_all:
-                    y, m, half = parse_col(c)
-                    q = (m - 1) // 3 + 1
-                    by_quarter.setdefault((y, q), []).append(c)
-
-                rows_q = []
-                for (y, q), cols in sorted(by_quarter.items()):
-                    # casting robusto
-                    bq = budget_f[cols].apply(pd.to_numeric, errors='coerce').fillna(0).astype(float)
-                    eq = eff_f[cols].apply(pd.to_numeric, errors='coerce').fillna(0).astype(float)
-                    mask_extrab = (bq == 0) & (eq > 0)
-
-                    for idx_r in bq.index:
-                        be_r = round(float(bq.loc[idx_r].sum()), 2)
-                        ee_extra_r = round(float(eq.loc[idx_r].where(mask_extrab.loc[idx_r], 0).sum()), 2)
-                        ee_in_r = round(float(eq.loc[idx_r].where(~mask_extrab.loc[idx_r], 0).sum()), 2)
-                        ee_tot_r = round(ee_in_r + ee_extra_r, 2)
-
-                        if be_r > 0:
-                            s_in_r = round(((be_r - ee_in_r) / be_r) * 100, 1)
-                            s_tot_r = round(((be_r - ee_tot_r) / be_r) * 100, 1)
-                        else:
-                            s_in_r = np.nan
-                            s_tot_r = -9999 if ee_tot_r > 0 else np.nan
-
-                        rows_q.append({
-                            "Cliente": idx_r,
-                            "Anno-Trimestre": f"{y}-Q{q}",
-                            "Ore a Budget": be_r,
-                            "Ore Effettive (senza Extrabudget)": ee_in_r,
-                            "Ore Extrabudget": ee_extra_r,
-                            "Scostamento % (solo eff. a budget)": s_in_r,
-                            "Scostamento % (incl. Extrabudget)": s_tot_r,
-                        })
-
-                df_quarter = pd.DataFrame(rows_q)
+                df_quarter = stage_slice["trimestrale"]
                 if df_quarter.empty:
                     st.info("Nessun dato trimestrale dopo i filtri correnti.")
                 else:
-                    df_quarter = df_quarter.set_index(["Cliente", "Anno-Trimestre"])
-
-                    def _style_q(v):
-                        if pd.isna(v):
-                            return 'background-color: black; color: black;'
-                        if v == -9999:
-                            return 'background-color: violet; color: white;'
-                        try:
-                            norm = (float(v) + 50) / 150
-                            norm = max(0.0, min(1.0, norm))
-                            color = plt.cm.RdYlGn(norm)
-                            return f'background-color: {matplotlib.colors.rgb2hex(color)}'
-                        except Exception:
-                            return ''
-
-                    perc_cols_q = ["Scostamento % (solo eff. a budget)", "Scostamento % (incl. Extrabudget)"]
-                    fmt_q = {c: fmt_percent_numeric for c in perc_cols_q}
-                    fmt_q.update({
-                        "Ore a Budget": fmt_hours,
-                        "Ore Effettive (senza Extrabudget)": fmt_hours,
-                        "Ore Extrabudget": fmt_hours,
-                    })
-                    st.dataframe(df_quarter.style.applymap(_style_q, subset=perc_cols_q).format(fmt_q), use_container_width=True)
+                    show_table("trimestrale", style_percent(in_window(df_quarter), subset=PERC_COLS).format(SUMMARY_FMT))
 
                 # ---- Totale complessivo per trimestre
                 st.subheader("🧮 Riepilogo trimestrale complessivo (solo 1-fine)")
-                if 'df_quarter' in locals() and not df_quarter.empty:
-                    agg = (df_quarter
-                           .reset_index()
-                           .groupby("Anno-Trimestre", as_index=True)[["Ore a Budget",
-                                                                     "Ore Effettive (senza Extrabudget)",
-                                                                     "Ore Extrabudget"]]
-                           .sum())
-                    # Round ore totali
-                    agg["Ore a Budget"] = agg["Ore a Budget"].round(2)
-                    agg["Ore Effettive (senza Extrabudget)"] = agg["Ore Effettive (senza Extrabudget)"].round(2)
-                    agg["Ore Extrabudget"] = agg["Ore Extrabudget"].round(2)
-
-                    be = agg["Ore a Budget"].astype(float)
-                    ee_in = agg["Ore Effettive (senza Extrabudget)"].astype(float)
-                    ee_tot = (ee_in + agg["Ore Extrabudget"].astype(float)).astype(float)
-
-                    s_in = pd.Series(np.nan, index=agg.index, dtype=float)
-                    mask_pos = be > 0
-                    s_in.loc[mask_pos] = ((be.loc[mask_pos] - ee_in.loc[mask_pos]) / be.loc[mask_pos]) * 100.0
-                    s_in = s_in.round(1)
-
-                    s_tot = pd.Series(np.nan, index=agg.index, dtype=float)
-                    s_tot.loc[mask_pos] = ((be.loc[mask_pos] - ee_tot.loc[mask_pos]) / be.loc[mask_pos]) * 100.0
-                    s_tot = s_tot.round(1)
-                    s_tot.loc[(be == 0) & (ee_tot > 0)] = -9999
-
-                    agg["Scostamento % (solo eff. a budget)"] = s_in
-                    agg["Scostamento % (incl. Extrabudget)"] = s_tot
-
-                    def _style_qtot(v):
-                        if pd.isna(v):
-                            return 'background-color: black; color: black;'
-                        if v == -9999:
-                            return 'background-color: violet; color: white;'
-                        try:
-                            norm = (float(v) + 50) / 150
-                            norm = max(0.0, min(1.0, norm))
-                            color = plt.cm.RdYlGn(norm)
-                            return f'background-color: {matplotlib.colors.rgb2hex(color)}'
-                        except Exception:
-                            return ''
-
-                    perc_cols_qt = ["Scostamento % (solo eff. a budget)", "Scostamento % (incl. Extrabudget)"]
-                    fmt_qt = {c: fmt_percent_numeric for c in perc_cols_qt}
-                    fmt_qt.update({
-                        "Ore a Budget": fmt_hours,
-                        "Ore Effettive (senza Extrabudget)": fmt_hours,
-                        "Ore Extrabudget": fmt_hours,
-                    })
-                    st.dataframe(agg.style.applymap(_style_qtot, subset=perc_cols_qt).format(fmt_qt), use_container_width=True)
+                if not df_quarter.empty:
+                    agg = rollup_totals(df_quarter)
+                    show_table("trimestrale_totale", style_percent(agg, subset=PERC_COLS).format(SUMMARY_FMT))
+
+                # ---- Rollup annuali / progressivi
+                st.subheader("📆 Riepilogo annuale e progressivo per cliente (solo 1-fine)")
+                vista_rollup = st.radio(
+                    "Vista", ["anno", "ytd", "r12"], horizontal=True, key="rollup_kind",
+                    format_func={"anno": "Anno", "ytd": "Da inizio anno (YTD)", "r12": "Ultimi 12 mesi"}.get,
+                )
+                def _stage_rollup():
+                    f = sel.frames()
+                    return {"t": period_rollup(f["budget"], f["eff_in"], f["eff_extra"], cols_fine_all, vista_rollup)}
+                df_rollup = memo_stage(f"rollup-{vista_rollup}-{slice_key}", _stage_rollup)["t"]
+                if df_rollup.empty:
+                    st.info("Nessun dato dopo i filtri correnti.")
+                else:
+                    show_table("rollup", style_percent(in_window(df_rollup), subset=PERC_COLS).format(SUMMARY_FMT))
+                    st.caption("Totale complessivo")
+                    show_table("rollup_totale", style_percent(rollup_totals(df_rollup), subset=PERC_COLS).format(SUMMARY_FMT))
 
+            # ---- GRAFICI: disegnati dagli aggregati della selezione, PNG in cache per dati + filtri
+            st.subheader("📈 Grafici di andamento")
+            if not cols_fine_all:
+                st.info("Nessuna colonna '1-fine' selezionata → i grafici non sono disponibili.")
+            else:
+                tipo_grafico = st.radio(
+                    "Grafico", ["mensile", "trimestrale", "consumo", "categorie"], horizontal=True, key="chart_kind",
+                    format_func={"mensile": "Budget vs Effettivo per mese", "trimestrale": "Budget vs Effettivo per trimestre",
+                                 "consumo": "Consumo cumulato per cliente", "categorie": "Effettivo per categoria"}.get,
+                )
+                def _draw_chart():
+                    if tipo_grafico == "mensile":
+                        return budget_vs_effettivo_chart(stage_slice["mensile"], "Budget vs Effettivo per mese (1-fine)")
+                    if tipo_grafico == "trimestrale":
+                        return budget_vs_effettivo_chart(rollup_totals(stage_slice["trimestrale"]), "Budget vs Effettivo per trimestre (1-fine)")
+                    budget_fine, eff_fine = sel.frame("budget")[cols_fine_all], sel.frame("eff")[cols_fine_all]
+                    if tipo_grafico == "consumo":
+                        return cumulative_burn_chart(budget_fine, eff_fine, CHART_MAX_SERIES)
+                    return category_chart(budget_fine, eff_fine, cat_map_norm)
+                if tipo_grafico == "trimestrale" and stage_slice["trimestrale"].empty:
+                    st.info("Nessun dato trimestrale dopo i filtri correnti.")
+                else:
+                    png = memo_stage(f"grafico-{tipo_grafico}-{CHART_MAX_SERIES}-{slice_key}", lambda: {"png": _draw_chart()})["png"]
+                    with PROF.stage("render_grafico", **output_size(png)):
+                        st.image(png, use_container_width=True)
+                    if tipo_grafico == "consumo" and len(idx) > CHART_MAX_SERIES:
+                        st.caption(f"{len(idx)} clienti selezionati: disegnati i {CHART_MAX_SERIES} con più Budget, gli altri sommati in 'Altri'.")
+
+            # ---- PERIODI PERSONALIZZATI: bucket qualsiasi come differenze sul cubo giornaliero cumulativo
+            st.subheader("📅 Periodi personalizzati (settimane, cutoff, finestre mobili)")
+            if df_daily is None or not mesi_sel:
+                st.info("Totali giornalieri non disponibili per questo Effettivo: ricaricare il file.")
+            else:
+                c_tipo, c_par = st.columns(2)
+                tipo_bucket = c_tipo.radio(
+                    "Bucket", ["settimana", "cutoff", "mobile"], horizontal=True, key="bucket_kind",
+                    format_func={"settimana": "Settimane ISO", "cutoff": "Cutoff mensile", "mobile": "Finestra mobile"}.get,
+                )
+                if tipo_bucket == "cutoff":
+                    param_bucket = int(c_par.number_input("Giorno di cutoff", min_value=1, max_value=31, value=20, step=1, key="bucket_cutoff"))
+                elif tipo_bucket == "mobile":
+                    param_bucket = int(c_par.number_input("Ampiezza (giorni, una finestra a settimana)", min_value=7, max_value=366, value=30, step=1, key="bucket_window"))
+                else:
+                    param_bucket = 0
+                lavorativi = ui_toggle_inline("Budget ripartito sui soli giorni lavorativi", False, key="bucket_busdays")
+                st.caption("Budget mensile (slot 1-fine) ripartito per giorno; i mesi selezionati definiscono il calendario.")
+
+                # cubi cumulativi costruiti una volta per selezione: cambiare tipo di bucket costa solo le differenze
+                inizio, fine = month_calendar(mesi_sel)
+                giorni_key = f"giorni-{align_key}-{int(lavorativi)}-{sel_key}"
+                giorni = memo_stage(giorni_key, lambda: {
+                    "eff": DailyCube.from_daily(df_daily, idx, inizio, fine),
+                    "budget": budget_daily_cube(df_budget, idx, inizio, fine, lavorativi=lavorativi),
+                })
+                def _stage_bucket():
+                    if tipo_bucket == "cutoff":
+                        bounds = cutoff_bounds(mesi_sel, param_bucket)
+                    elif tipo_bucket == "mobile":
+                        bounds = rolling_bounds(inizio, fine, param_bucket)
+                    else:
+                        bounds = week_bounds(inizio, fine)
+                    eff_b, budget_b = giorni["eff"].buckets(bounds), giorni["budget"].buckets(bounds)
+                    out = {"eff": eff_b, "budget": budget_b, **variance_frames(budget_b, eff_b)}
+                    out["totale"] = summary_table(
+                        budget_b.sum(axis=0), out["eff_in"].sum(axis=0), out["eff_extra"].sum(axis=0),
+                        index=pd.Index(bounds["etichetta"], name="Periodo"),
+                    )
+                    return out
+                stage_bucket = memo_stage(f"bucket-{tipo_bucket}-{param_bucket}-{giorni_key}", _stage_bucket)
+                show_heatmap("bucket", stage_bucket["perc"].loc[righe_vis])
+                st.caption("Totale per periodo (tutti i clienti filtrati)")
+                show_table("bucket_totale", style_percent(stage_bucket["totale"], subset=PERC_COLS).format(SUMMARY_FMT))
+
+            # ---- SCENARI WHAT-IF: tutti gli scenari in un solo calcolo vettoriale sul Budget preparato
+            st.subheader("🧪 Scenari what-if (solo 1-fine)")
+            cols_fine_sel = cols_of_half(selected_cols, "1-fine")
+            if not cols_fine_sel:
+                st.info("Nessuna colonna '1-fine' selezionata → gli scenari non sono disponibili.")
+            else:
+                c_coeff, c_budget = st.columns(2)
+                testo_coeff = c_coeff.text_input("Moltiplicatori coeff", "0.9, 1, 1.1", key="scen_coeff")
+                testo_budget = c_budget.text_input("Moltiplicatori budget (e xselling)", "0.9, 1, 1.1", key="scen_budget")
+                st.caption("Scenari aggiuntivi (facoltativi): categoria vuota = tutti i clienti, moltiplicatore vuoto = 1.")
+                scenari_extra = st.data_editor(
+                    pd.DataFrame({c: pd.Series(dtype=float if c in ("coeff", "budget_mensile", "xselling") else object) for c in SCENARIO_COLUMNS}),
+                    use_container_width=True, hide_index=True, num_rows="dynamic", key="scenari_extra",
+                    column_config={"categoria": st.column_config.SelectboxColumn("categoria", options=[""] + CATEGORIE)},
+                )
+                try:
+                    scenari = pd.concat([
+                        scenario_grid(parse_multipliers(testo_coeff), parse_multipliers(testo_budget)),
+                        scenari_extra.dropna(how="all"),
+                    ], ignore_index=True)
+                    stage_scen = memo_stage(
+                        f"scen-{slice_key}-{frame_digest(scenari)}",
+                        lambda: {"t": evaluate_scenarios(df_budget, sel.frame("budget")[cols_fine_sel], sel.frame("eff")[cols_fine_sel], scenari, cat_map_norm)},
+                    )
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    show_table("scenari", style_percent(stage_scen["t"], subset=PERC_COLS).format(SCENARIO_FMT))
+                    st.caption("Ore scenario = (budget × m_budget + xselling × m_xselling) / (coeff × m_coeff) per cliente e mese; "
+                               "'Attuale' è il Budget caricato, Δ è rispetto ad esso.")
 
-            # ---- EXPORT BUDGET aggiornato (con categorie)
+
+            # ---- EXPORT REPORT (tutti i clienti filtrati, non solo la finestra visibile)
             st.divider()
+            st.caption("Esporta l'analisi filtrata: Heatmap, Dettaglio, Dashboard, Mensile, Trimestrale (file generato al click)")
+            def _build_report_xlsx():
+                f = sel.frames()
+                sheets = {
+                    "Heatmap": f["perc"],
+                    "Dettaglio": detail_table(f["eff"], f["budget"], f["perc"]),
+                    "Dashboard": stage_slice["dashboard"],
+                    "Mensile": stage_slice["mensile"],
+                }
+                if not stage_slice["trimestrale"].empty:
+                    sheets["Trimestrale"] = stage_slice["trimestrale"]
+                    sheets["Trimestrale totale"] = rollup_totals(stage_slice["trimestrale"])
+                return write_xlsx(sheets, percent_sheets=["Heatmap"])
+            download_xlsx("⬇️ Scarica report Excel", f"xlsx-{slice_key}", _build_report_xlsx, "analisi_budget_vs_effettivo.xlsx")
+
+            # ---- EXPORT BUDGET aggiornato (con categorie)
             st.caption("Esporta Budget aggiornato (inclusa 'categoria_cliente')")
-            buf = BytesIO()
-            st.session_state["budget_df"].to_excel(buf, index=False)
-            st.download_button("⬇️ Scarica Budget aggiornato", data=buf.getvalue(), file_name="budget_aggiornato_categorie.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            if budget_snapshot is not None:
+                # snapshot completo, non solo i mesi caricati per l'analisi
+                db = get_budget_db()
+                download_xlsx(
+                    "⬇️ Scarica Budget aggiornato", f"xlsx-dbbud-{budget_snapshot}",
+                    lambda: write_xlsx({"Budget": db.load_wide(budget_snapshot)}, index=False),
+                    "budget_aggiornato_categorie.xlsx",
+                )
+            else:
+                budget_export = st.session_state["budget_df"]
+                if budget_export is None:
+                    budget_export = df_budget.reset_index().rename(columns={"index": "cliente"})
+                download_budget("⬇️ Scarica Budget aggiornato", budget_export, "budget_aggiornato_categorie.xlsx")
 
         except Exception as e:
             st.error(f"Errore durante l'elaborazione: {e}")
+
+# ------------------------------
+# PANNELLO PERFORMANCE
+# ------------------------------
+perf_runs = st.session_state.setdefault("perf_runs", [])
+perf_runs.append(PROF.run_record(sezione=sezione))
+del perf_runs[:-PERF_HISTORY]
+PROF.close()
+with perf_box:
+    st.caption(f"Ultimo rerun: {perf_runs[-1]['total_s']:.2f} s · stadi in ordine di esecuzione")
+    st.dataframe(records_frame(perf_runs[-1]["stages"]), use_container_width=True, hide_index=True)
+    st.caption("Rerun precedenti (s): " + ", ".join(f"{r['total_s']:.2f}" for r in perf_runs[-6:-1][::-1]))
+    st.download_button("JSON", data=runs_json(perf_runs), file_name="performance.json", mime="application/json")
+    st.download_button("Chrome trace", data=runs_chrome_trace(perf_runs), file_name="performance_trace.json", mime="application/json")
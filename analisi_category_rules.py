@@ -0,0 +1,81 @@
+# Regole di assegnazione della categoria cliente (senza UI)
+# - Tre tipi: 'tabella' (nome esatto), 'prefisso' (il più lungo vince), 'regex' (in ordine di inserimento)
+# - Un solo passaggio vettoriale su tutti i clienti da categorizzare, anche per migliaia di nuovi clienti
+# - Confronti senza distinzione di maiuscole e spazi esterni; persistenza nel database del Budget
+
+import re
+
+import numpy as np
+import pandas as pd
+
+CATEGORIE = ["Ricorrente", "Progetto", "Interno", "Altro"]
+RULE_TYPES = ("tabella", "prefisso", "regex")
+RULE_COLUMNS = ["tipo", "modello", "categoria"]
+
+def _key(values) -> pd.Series:
+    return pd.Series(values, dtype=object).astype(str).str.strip().str.casefold()
+
+def empty_rules() -> pd.DataFrame:
+    return pd.DataFrame({c: pd.Series(dtype=object) for c in RULE_COLUMNS})
+
+def clean_rules(rules: pd.DataFrame) -> pd.DataFrame:
+    """Regole valide (righe incomplete scartate, categoria in Title case).
+    ValueError su tipo sconosciuto o regex non compilabile."""
+    if rules is None or rules.empty:
+        return empty_rules()
+    df = rules.reindex(columns=RULE_COLUMNS).fillna("").astype(str)
+    df = df.apply(lambda s: s.str.strip())
+    df = df[(df["modello"] != "") & (df["categoria"] != "")].copy()
+    df["tipo"] = df["tipo"].str.lower()
+    unknown = sorted(set(df["tipo"]) - set(RULE_TYPES))
+    if unknown:
+        raise ValueError(f"Tipo di regola non valido: {', '.join(unknown)} (ammessi: {', '.join(RULE_TYPES)})")
+    for pattern in df.loc[df["tipo"] == "regex", "modello"]:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"Regex non valida '{pattern}': {e}")
+    df["categoria"] = df["categoria"].str.title()
+    # a parità di tipo e modello vale l'ultima
+    df = df.assign(_k=_key(df["modello"]).to_numpy()).drop_duplicates(["tipo", "_k"], keep="last")
+    return df.drop(columns="_k").reset_index(drop=True)
+
+def merge_rules(rules: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Regole esistenti + nuove (le nuove sostituiscono quelle con lo stesso tipo e modello)."""
+    return clean_rules(pd.concat([rules, new], ignore_index=True))
+
+def assign_categories(clienti, rules: pd.DataFrame) -> pd.Series:
+    """cliente -> categoria secondo le regole ('' se nessuna regola lo copre).
+    Precedenza: tabella, poi prefisso più lungo, poi regex nell'ordine delle regole."""
+    names = pd.Index(clienti).astype(str)
+    key = _key(names).to_numpy()
+    out = np.full(len(names), "", dtype=object)
+    rules = clean_rules(rules)
+    pending = np.ones(len(names), dtype=bool)
+
+    tabella = rules[rules["tipo"] == "tabella"]
+    if not tabella.empty and pending.any():
+        hit = pd.Series(key).map(dict(zip(_key(tabella["modello"]), tabella["categoria"]))).to_numpy()
+        found = pd.notna(hit)
+        out[found] = hit[found]
+        pending &= ~found
+
+    prefissi = rules[rules["tipo"] == "prefisso"]
+    if not prefissi.empty and pending.any():
+        pk = _key(prefissi["modello"]).to_numpy()
+        # un passaggio per lunghezza di prefisso, dal più lungo: map esatto sul troncamento del nome
+        for n in sorted({len(p) for p in pk}, reverse=True):
+            lookup = {p: c for p, c in zip(pk, prefissi["categoria"]) if len(p) == n}
+            hit = pd.Series(key).str[:n].map(lookup).to_numpy()
+            found = pending & pd.notna(hit)
+            out[found] = hit[found]
+            pending &= ~found
+
+    for pattern, categoria in rules.loc[rules["tipo"] == "regex", ["modello", "categoria"]].itertuples(index=False):
+        if not pending.any():
+            break
+        pos = np.flatnonzero(pending)  # solo i clienti ancora scoperti
+        found = pos[np.asarray(names[pos].str.contains(pattern, case=False, regex=True), dtype=bool)]
+        out[found] = categoria
+        pending[found] = False
+    return pd.Series(out, index=names, name="categoria_cliente")
@@ -0,0 +1,112 @@
+# Grafici di andamento (senza UI)
+# - Disegnati dagli aggregati già calcolati (riepiloghi mensili/trimestrali, matrici cliente x mese 1-fine), mai dalle righe
+# - matplotlib senza pyplot (Figure + canvas Agg): sicuro fuori dal thread principale, restituisce PNG da tenere in cache
+# - Con molti clienti le serie si riducono ai principali + 'Altri', così il costo del disegno non cresce con la selezione
+
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from analisi_engine import period_axis, PERC_COLS
+
+MAX_SERIES = 10
+CHART_SIZE = (10, 3.8)
+CHART_DPI = 110
+COLOR_BUDGET = "#4c72b0"
+COLOR_EFF = "#55a868"
+COLOR_EXTRA = "#c44e52"
+
+def _png(fig: Figure) -> bytes:
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=CHART_DPI, bbox_inches="tight")
+    return buf.getvalue()
+
+def _figure():
+    fig = Figure(figsize=CHART_SIZE)
+    ax = fig.add_subplot()
+    ax.grid(axis="y", alpha=0.3)
+    ax.set_axisbelow(True)
+    ax.margins(y=0.1)  # spazio per le etichette sopra le barre
+    return fig, ax
+
+def _month_labels(cols) -> tuple:
+    """(colonne '1-fine' in ordine cronologico, etichette 'YYYY-MM')."""
+    ax = period_axis(cols)
+    fine = ax[ax["meta"] == "1-fine"].sort_values(["anno", "mese"], kind="stable")
+    return list(fine.index), [f"{y}-{m:02d}" for y, m in zip(fine["anno"], fine["mese"])]
+
+def top_series(matrix: pd.DataFrame, weights: pd.Series, max_series: int = MAX_SERIES) -> pd.DataFrame:
+    """Righe del grafico: le `max_series` con peso maggiore + 'Altri (N)' come somma delle restanti."""
+    if len(matrix) <= max_series:
+        return matrix
+    top = weights.reindex(matrix.index).fillna(0).sort_values(ascending=False, kind="stable").index[:max_series]
+    resto = matrix.drop(index=top)
+    return pd.concat([matrix.loc[top], resto.sum(axis=0).to_frame(f"Altri ({len(resto)})").T])
+
+def budget_vs_effettivo_chart(summary: pd.DataFrame, titolo: str) -> bytes:
+    """Per periodo: barra Budget e barra Effettivo (a budget + Extrabudget impilati), con lo scostamento % in etichetta.
+    `summary` nel formato di summary_table (riepilogo mensile, totale trimestrale, ...)."""
+    fig, ax = _figure()
+    x = np.arange(len(summary))
+    w = 0.38
+    ax.bar(x - w / 2, summary["Ore a Budget"], w, color=COLOR_BUDGET, label="Budget")
+    ax.bar(x + w / 2, summary["Ore Effettive (senza Extrabudget)"], w, color=COLOR_EFF, label="Effettivo a budget")
+    ax.bar(x + w / 2, summary["Ore Extrabudget"], w, bottom=summary["Ore Effettive (senza Extrabudget)"], color=COLOR_EXTRA, label="Extrabudget")
+    top = np.maximum(summary["Ore a Budget"], summary["Ore Effettive (senza Extrabudget)"] + summary["Ore Extrabudget"]).to_numpy()
+    for xi, yi, p in zip(x, top, summary[PERC_COLS[1]]):
+        if pd.notna(p) and p != -9999:
+            ax.annotate(f"{p:.0f}%", (xi, yi), ha="center", va="bottom", fontsize=7, xytext=(0, 2), textcoords="offset points")
+    step = max(1, len(x) // 24)  # etichette diradate sugli assi lunghi
+    ax.set_xticks(x[::step], [str(i) for i in summary.index[::step]], rotation=45, ha="right", fontsize=8)
+    ax.set_ylabel("Ore")
+    ax.set_title(titolo, fontsize=10)
+    ax.legend(fontsize=8, loc="upper left", bbox_to_anchor=(1.01, 1))
+    return _png(fig)
+
+def cumulative_burn_chart(budget_f: pd.DataFrame, eff_f: pd.DataFrame, max_series: int = MAX_SERIES) -> bytes:
+    """Consumo cumulato per cliente sulle colonne 1-fine: Effettivo cumulato / Budget totale del periodo (%).
+    Con più di `max_series` clienti restano i maggiori per Budget e il resto confluisce in 'Altri'."""
+    cols, labels = _month_labels(budget_f.columns)
+    fig, ax = _figure()
+    budget, eff = budget_f[cols], eff_f[cols]
+    totale = budget.sum(axis=1)
+    con_budget = totale > 0  # senza Budget il consumo % non è definito
+    budget, eff = budget[con_budget], eff[con_budget]
+    eff_s = top_series(eff, totale[con_budget], max_series)
+    bud_s = top_series(budget, totale[con_budget], max_series)
+    burn = eff_s.cumsum(axis=1).div(bud_s.sum(axis=1), axis=0) * 100
+    x = np.arange(len(cols))
+    for nome, riga in burn.iterrows():
+        ax.plot(x, riga.to_numpy(), marker="o", markersize=3, linewidth=1.4 if not str(nome).startswith("Altri") else 2.2,
+                linestyle="--" if str(nome).startswith("Altri") else "-", label=str(nome))
+    if len(totale):
+        atteso = np.arange(1, len(cols) + 1) / max(1, len(cols)) * 100
+        ax.plot(x, atteso, color="grey", linewidth=1, linestyle=":", label="Consumo lineare")
+    ax.axhline(100, color="black", linewidth=0.8)
+    step = max(1, len(x) // 24)
+    ax.set_xticks(x[::step], labels[::step], rotation=45, ha="right", fontsize=8)
+    ax.set_ylabel("% del Budget del periodo")
+    ax.set_title(f"Consumo cumulato del Budget ({int(con_budget.sum())} clienti con Budget)", fontsize=10)
+    ax.legend(fontsize=7, ncols=2, loc="upper left", bbox_to_anchor=(1.01, 1))
+    return _png(fig)
+
+def category_chart(budget_f: pd.DataFrame, eff_f: pd.DataFrame, cat_map: pd.Series) -> bytes:
+    """Effettivo per categoria cliente impilato mese per mese (colonne 1-fine), con il Budget totale come linea."""
+    cols, labels = _month_labels(budget_f.columns)
+    fig, ax = _figure()
+    categorie = cat_map.reindex(eff_f.index).fillna("").replace("", "(senza categoria)").to_numpy()
+    per_cat = eff_f[cols].groupby(categorie).sum()
+    x = np.arange(len(cols))
+    base = np.zeros(len(cols))
+    for nome, riga in per_cat.iterrows():
+        ax.bar(x, riga.to_numpy(), 0.7, bottom=base, label=str(nome))
+        base += riga.to_numpy()
+    ax.plot(x, budget_f[cols].sum(axis=0).to_numpy(), color="black", marker="o", markersize=3, linewidth=1.2, label="Budget")
+    step = max(1, len(x) // 24)
+    ax.set_xticks(x[::step], labels[::step], rotation=45, ha="right", fontsize=8)
+    ax.set_ylabel("Ore")
+    ax.set_title("Effettivo per categoria cliente", fontsize=10)
+    ax.legend(fontsize=8, loc="upper left", bbox_to_anchor=(1.01, 1))
+    return _png(fig)
@@ -0,0 +1,146 @@
+# Cubo giornaliero cumulativo clienti x giorni (senza UI)
+# - Somme prefisse per cliente su un calendario continuo: le ore di qualsiasi intervallo di date
+#   sono la differenza di due colonne (O(1) per cliente), qualunque sia il tipo di bucket
+# - Bucket: metà mese (1-15 / 1-fine), cutoff a un giorno N, settimane ISO, finestre mobili
+# - Budget mensile ripartito per giorno (di calendario o lavorativi) nello stesso formato
+
+import numpy as np
+import pandas as pd
+
+from analisi_engine import period_axis
+
+class DailyCube:
+    """Somme cumulative per cliente: cum[i, k] = ore del cliente i nei primi k giorni da `start`."""
+
+    def __init__(self, clients: pd.Index, start: pd.Timestamp, cum: np.ndarray):
+        self.clients = clients
+        self.start = pd.Timestamp(start).normalize()
+        self.cum = cum
+
+    @property
+    def n_days(self) -> int:
+        return self.cum.shape[1] - 1
+
+    @property
+    def days(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start, periods=self.n_days, freq="D")
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.cum.nbytes)
+
+    @classmethod
+    def from_daily_matrix(cls, clients, start, values: np.ndarray) -> "DailyCube":
+        cum = np.zeros((values.shape[0], values.shape[1] + 1))
+        np.cumsum(values, axis=1, out=cum[:, 1:])
+        return cls(pd.Index(clients), start, cum)
+
+    @classmethod
+    def from_daily(cls, daily: pd.DataFrame, clients, start, end) -> "DailyCube":
+        """Cubo dai totali giornalieri (cliente, data, ore) sui clienti e sul calendario [start, end] indicati.
+        Righe fuori calendario o di altri clienti sono ignorate."""
+        clients = pd.Index(clients).astype(str)
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        n_days = (end - start).days + 1
+        rows = clients.get_indexer(daily["cliente"].astype(str))
+        cols = ((daily["data"] - start).dt.days).to_numpy()
+        ok = (rows >= 0) & (cols >= 0) & (cols < n_days)
+        flat = np.bincount(rows[ok] * n_days + cols[ok], weights=daily["ore"].to_numpy(dtype=float)[ok],
+                           minlength=len(clients) * n_days)
+        return cls.from_daily_matrix(clients, start, flat.reshape(len(clients), n_days))
+
+    def _pos(self, dates) -> np.ndarray:
+        """Giorni da `start`, limitati al calendario del cubo."""
+        offset = (pd.DatetimeIndex(dates).normalize() - self.start).days.to_numpy()
+        return np.clip(offset, 0, self.n_days)
+
+    def range_sums(self, inizio, fine) -> np.ndarray:
+        """Ore per cliente su ciascun intervallo [inizio_j, fine_j] (date incluse): matrice clienti x intervalli."""
+        a = self._pos(inizio)
+        b = self._pos(pd.DatetimeIndex(fine) + pd.Timedelta(days=1))
+        return self.cum[:, b] - self.cum[:, a]
+
+    def hours(self, inizio, fine) -> pd.Series:
+        """Ore per cliente nell'intervallo [inizio, fine]."""
+        return pd.Series(self.range_sums([inizio], [fine])[:, 0].round(2), index=self.clients)
+
+    def buckets(self, bounds: pd.DataFrame) -> pd.DataFrame:
+        """Matrice clienti x bucket (round(2)) da un frame etichetta/inizio/fine."""
+        vals = self.range_sums(bounds["inizio"], bounds["fine"]).round(2)
+        return pd.DataFrame(vals, index=self.clients, columns=pd.Index(bounds["etichetta"], name=None))
+
+# ------------------------------
+# Bucket
+# ------------------------------
+def _bounds(etichette, inizio, fine) -> pd.DataFrame:
+    """Frame dei bucket: etichetta, inizio, fine (date incluse)."""
+    return pd.DataFrame({"etichetta": list(etichette), "inizio": pd.DatetimeIndex(inizio), "fine": pd.DatetimeIndex(fine)})
+
+def month_calendar(mesi) -> tuple:
+    """(primo giorno, ultimo giorno) dei mesi 'YYYY-MM' indicati."""
+    periodi = pd.PeriodIndex(sorted(mesi), freq="M")
+    return periodi[0].start_time, periodi[-1].end_time.normalize()
+
+def half_month_bounds(mesi) -> pd.DataFrame:
+    """Le colonne classiche 'YYYY-MM (1-15)' / 'YYYY-MM (1-fine)'."""
+    periodi = pd.PeriodIndex(sorted(mesi), freq="M")
+    inizio = periodi.start_time
+    etichette = [f"{p} ({h})" for p in periodi.astype(str) for h in ("1-15", "1-fine")]
+    fine = [d for s, e in zip(inizio, periodi.end_time.normalize()) for d in (s + pd.Timedelta(days=14), e)]
+    return _bounds(etichette, np.repeat(inizio, 2), fine)
+
+def cutoff_bounds(mesi, giorno: int) -> pd.DataFrame:
+    """Dal primo del mese al giorno `giorno` (o a fine mese se più corto): 'YYYY-MM (1-N)'."""
+    periodi = pd.PeriodIndex(sorted(mesi), freq="M")
+    inizio = periodi.start_time
+    fine = np.minimum(inizio + pd.Timedelta(days=giorno - 1), periodi.end_time.normalize())
+    return _bounds([f"{p} (1-{giorno})" for p in periodi.astype(str)], inizio, fine)
+
+def week_bounds(start, end) -> pd.DataFrame:
+    """Settimane ISO (lunedì-domenica) che toccano [start, end], etichetta 'YYYY-Www'."""
+    lunedi = pd.date_range(pd.Timestamp(start) - pd.Timedelta(days=pd.Timestamp(start).weekday()), end, freq="7D")
+    iso = lunedi.isocalendar()
+    etichette = [f"{y}-W{w:02d}" for y, w in zip(iso["year"], iso["week"])]
+    return _bounds(etichette, lunedi, lunedi + pd.Timedelta(days=6))
+
+def rolling_bounds(start, end, giorni: int, passo: int = 7) -> pd.DataFrame:
+    """Finestre mobili di `giorni` giorni che terminano ogni `passo` giorni fino a `end` (incluso)."""
+    fine = pd.date_range(end=end, start=pd.Timestamp(start) + pd.Timedelta(days=giorni - 1), freq=f"{passo}D")
+    if fine.empty:
+        fine = pd.DatetimeIndex([pd.Timestamp(end)])
+    etichette = [f"{d:%Y-%m-%d} (ultimi {giorni} gg)" for d in fine]
+    return _bounds(etichette, fine - pd.Timedelta(days=giorni - 1), fine)
+
+# ------------------------------
+# Budget ripartito per giorno
+# ------------------------------
+def budget_daily_cube(df_budget: pd.DataFrame, clients, start, end, lavorativi: bool = False) -> DailyCube:
+    """Ore budget mensili (colonne 'YYYY-MM (1-fine)') ripartite sui giorni del mese, come DailyCube.
+    Con `lavorativi` il budget va solo sui giorni lun-ven; la ripartizione usa sempre il mese intero,
+    quindi un mese completo somma esattamente al suo slot."""
+    clients = pd.Index(clients).astype(str)
+    days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="D")
+    ax = period_axis(df_budget.columns)
+    fine = ax[ax["meta"] == "1-fine"]
+    mesi = pd.PeriodIndex([f"{y}-{m:02d}" for y, m in zip(fine["anno"], fine["mese"])], freq="M")
+    monthly = (df_budget.reindex(index=clients, columns=fine.index).apply(pd.to_numeric, errors="coerce")
+               .fillna(0.0).to_numpy(dtype=float))
+
+    giorno_mese = days.to_period("M")
+    code = mesi.get_indexer(giorno_mese)  # -1: mese senza budget
+    # peso del giorno / peso del mese intero (anche per i mesi tagliati dal calendario)
+    mesi_cal = giorno_mese.unique()
+    if lavorativi:
+        peso = np.is_busday(days.values.astype("datetime64[D]")).astype(float)
+        totale = np.busday_count(mesi_cal.start_time.values.astype("datetime64[D]"),
+                                 (mesi_cal.end_time.normalize() + pd.Timedelta(days=1)).values.astype("datetime64[D]"))
+    else:
+        peso = np.ones(len(days))
+        totale = mesi_cal.days_in_month
+    totale = pd.Series(np.asarray(totale, dtype=float), index=mesi_cal).reindex(giorno_mese).to_numpy()
+    quota = np.divide(peso, totale, out=np.zeros(len(days)), where=totale > 0)
+
+    values = np.zeros((len(clients), len(days)))
+    has = code >= 0
+    values[:, has] = monthly[:, code[has]] * quota[has]
+    return DailyCube.from_daily_matrix(clients, days[0] if len(days) else pd.Timestamp(start), values)
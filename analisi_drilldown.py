@@ -0,0 +1,62 @@
+# Drill-down cliente → mese → giorno → righe (senza UI)
+# - Indice costruito una volta per Effettivo: posizioni delle righe ordinate per (cliente, data)
+#   e offset per cliente, senza copiare le righe
+# - Le righe di un cliente sono una fetta contigua dell'ordinamento, quelle di un periodo una sotto-fetta
+#   trovata per bisezione: aprire un cliente o una cella costa O(righe del cliente), non una scansione di df_eff
+
+import numpy as np
+import pandas as pd
+
+class RowIndex:
+    """Indice di un frame con colonne cliente/data (righe timesheet o totali giornalieri).
+    order[offsets[i]:offsets[i+1]] sono le posizioni delle righe del cliente clients[i], in ordine di data."""
+
+    def __init__(self, frame: pd.DataFrame, order: np.ndarray, clients: pd.Index, offsets: np.ndarray, dates: np.ndarray):
+        self.frame = frame
+        self.order = order
+        self.clients = clients
+        self.offsets = offsets
+        self.dates = dates
+
+    @property
+    def nbytes(self) -> int:
+        """Solo l'indice: il frame è condiviso con la voce di cache da cui proviene."""
+        return int(self.order.nbytes + self.offsets.nbytes + self.dates.nbytes)
+
+    @classmethod
+    def build(cls, frame: pd.DataFrame) -> "RowIndex":
+        """Un ordinamento stabile per (cliente, data); righe senza cliente o data valida escluse."""
+        ok = (frame["cliente"].notna() & frame["data"].notna()).to_numpy()
+        pos = np.flatnonzero(ok)
+        codes, clients = pd.factorize(frame["cliente"].to_numpy()[pos].astype(str), sort=True)
+        dates = frame["data"].to_numpy()[pos].astype("datetime64[ns]")
+        perm = np.lexsort((dates, codes))
+        offsets = np.searchsorted(codes[perm], np.arange(len(clients) + 1))
+        return cls(frame, pos[perm], pd.Index(clients), offsets, dates[perm])
+
+    def span(self, cliente: str, inizio=None, fine=None) -> slice:
+        """Fetta dell'ordinamento per il cliente, limitata ai giorni [inizio, fine] se indicati."""
+        i = self.clients.get_indexer([str(cliente)])[0]
+        if i < 0:
+            return slice(0, 0)
+        a, b = int(self.offsets[i]), int(self.offsets[i + 1])
+        dates = self.dates[a:b]
+        lo = a + int(np.searchsorted(dates, np.datetime64(pd.Timestamp(inizio).normalize(), "ns"))) if inizio is not None else a
+        if fine is not None:
+            b = a + int(np.searchsorted(dates, np.datetime64(pd.Timestamp(fine).normalize() + pd.Timedelta(days=1), "ns")))
+        return slice(lo, max(lo, b))
+
+    def rows(self, cliente: str, inizio=None, fine=None) -> pd.DataFrame:
+        """Righe del cliente (nei giorni [inizio, fine]) in ordine di data."""
+        return self.frame.iloc[self.order[self.span(cliente, inizio, fine)]]
+
+def month_bounds(mese: str) -> tuple:
+    """(primo giorno, ultimo giorno) del mese 'YYYY-MM'."""
+    p = pd.Period(mese, freq="M")
+    return p.start_time, p.end_time.normalize()
+
+def day_table(giorni: pd.DataFrame, inizio, fine) -> pd.DataFrame:
+    """Ore per giorno (calendario completo [inizio, fine], 0 nei giorni senza ore) dai totali giornalieri di un cliente."""
+    ore = giorni.groupby(giorni["data"].dt.normalize())["ore"].sum()
+    calendario = pd.date_range(pd.Timestamp(inizio).normalize(), pd.Timestamp(fine).normalize(), freq="D")
+    return pd.DataFrame({"Giorno": calendario, "Ore": ore.reindex(calendario, fill_value=0.0).round(2).to_numpy()})
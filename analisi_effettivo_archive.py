@@ -0,0 +1,83 @@
+# Archivio storico Effettivo (Parquet partizionato per mese)
+# - {root}/mese=YYYY-MM/righe.parquet: un caricamento aggiunge o sostituisce solo i mesi che contiene
+# - Lettura per partizione: il costo dell'analisi dipende dai mesi selezionati, non dalla storia totale
+
+import os
+
+import pandas as pd
+
+from analisi_engine import EFF_COLUMNS, daily_totals, normalize_dates, pivot_from_daily
+
+PART_FILE = "righe.parquet"
+
+class EffettivoArchive:
+    """Righe Effettivo (data, cliente, ore + eventuali colonne descrittive) partizionate per mese."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, mese: str) -> str:
+        return os.path.join(self.root, f"mese={mese}", PART_FILE)
+
+    def months(self) -> list:
+        """Mesi presenti ('YYYY-MM'), in ordine."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            d[len("mese="):] for d in os.listdir(self.root)
+            if d.startswith("mese=") and os.path.exists(os.path.join(self.root, d, PART_FILE))
+        )
+
+    def stamp(self, mese: str) -> str:
+        """Versione della partizione (mtime + dimensione): cambia quando il mese viene sostituito."""
+        st = os.stat(self._path(mese))
+        return f"{st.st_mtime_ns}-{st.st_size}"
+
+    def ingest(self, rows: pd.DataFrame) -> list:
+        """Scrive le righe (colonne data/cliente/ore obbligatorie) sostituendo per intero i mesi presenti.
+        Righe senza data o cliente validi vengono scartate. Restituisce i mesi scritti."""
+        df = rows.copy()
+        df.columns = df.columns.astype(str).str.strip().str.lower()
+        missing = [c for c in EFF_COLUMNS if c not in df.columns]
+        if missing:
+            raise ValueError(f"Nell'Effettivo mancano le colonne: {', '.join(missing)}")
+        df = df.drop(columns=[c for c in ("mese", "giorno") if c in df.columns])  # derivate, ricalcolate in lettura
+        df["data"] = normalize_dates(df["data"])[0]
+        df["ore"] = pd.to_numeric(df["ore"], errors="coerce").fillna(0.0)
+        df = df[df["data"].notna() & df["cliente"].notna()]
+        df["cliente"] = df["cliente"].astype(str)
+        # colonne descrittive miste (numeri/testo) -> stringa, per uno schema Parquet stabile
+        for c in df.columns.difference(list(EFF_COLUMNS)):
+            if df[c].dtype == object:
+                df[c] = df[c].astype("string")
+
+        mesi = df["data"].dt.strftime("%Y-%m")
+        written = []
+        for mese, part in df.groupby(mesi, sort=True):
+            path = self._path(mese)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            part.reset_index(drop=True).to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            written.append(mese)
+        return written
+
+    def read(self, mesi, columns=None, clienti=None) -> pd.DataFrame:
+        """Righe dei soli mesi indicati (partizioni assenti ignorate); con `clienti` solo le loro righe (filtro in lettura)."""
+        filters = [("cliente", "in", [str(c) for c in clienti])] if clienti is not None else None
+        parts = [pd.read_parquet(self._path(m), columns=columns, filters=filters) for m in mesi if os.path.exists(self._path(m))]
+        if not parts:
+            return pd.DataFrame(columns=list(columns or EFF_COLUMNS))
+        return pd.concat(parts, ignore_index=True)
+
+    def month_aggregates(self, mese: str) -> dict:
+        """Aggregati di un solo mese in una lettura: {"pivot": df_eff_tot, "giornaliero": ore per cliente e giorno}.
+        Il pivot ha sempre entrambe le colonne di month_columns([mese]) (0 se il mese non ha righe nei giorni 1-15):
+        l'app sceglie i periodi da month_columns prima di leggere le partizioni."""
+        daily = daily_totals(self.read([mese], columns=list(EFF_COLUMNS)))
+        pivot = pivot_from_daily(daily).reindex(columns=month_columns([mese]), fill_value=0.0)
+        return {"pivot": pivot, "giornaliero": daily}
+
+def month_columns(mesi) -> list:
+    """Colonne periodo ottenibili dai mesi dell'archivio, senza leggere le partizioni."""
+    return [f"{m} ({half})" for m in sorted(mesi) for half in ("1-15", "1-fine")]
@@ -0,0 +1,124 @@
+# Unione di più export Effettivo (senza UI)
+# - Un workbook per team e mese, anche con più fogli: ogni file è letto in un processo del pool
+# - Righe deduplicate per hash di (data, cliente, ore + colonne chiave aggiuntive): gli export che si
+#   sovrappongono non contano due volte le stesse ore
+# - Ogni foglio restituisce solo le righe distinte con la loro molteplicità; l'unione accumula i totali
+#   (cliente, giorno) dei soli contributi nuovi, senza mai concatenare le righe grezze dei file
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from analisi_engine import (
+    EFF_COLUMNS, report_progress, normalize_dates, no_date_rejects, merge_date_rejects, pivot_from_daily,
+)
+
+def parse_key_columns(text: str) -> tuple:
+    """'risorsa, attività' -> ('risorsa', 'attività') (minuscolo, senza le colonne già in chiave)."""
+    cols = [c.strip().lower() for c in text.split(",")]
+    return tuple(dict.fromkeys(c for c in cols if c and c not in EFF_COLUMNS))
+
+def effettivo_sheets(data: bytes) -> list:
+    """Fogli del workbook con le colonne data, cliente, ore nella prima riga (openpyxl read-only, solo intestazioni)."""
+    wb = openpyxl.load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        fogli = []
+        for ws in wb.worksheets:
+            header = next(ws.iter_rows(max_row=1, values_only=True), ())
+            if set(EFF_COLUMNS) <= {str(h).strip().lower() for h in header if h is not None}:
+                fogli.append(ws.title)
+        return fogli
+    finally:
+        wb.close()
+
+def distinct_rows(df: pd.DataFrame, chiavi=()) -> tuple:
+    """Righe distinte di un foglio: frame indicizzato per hash con cliente, data, ore e molteplicità n
+    + report delle date non interpretabili. Le colonne chiave assenti nel foglio valgono ''."""
+    cliente = df["cliente"]
+    data, scartate = normalize_dates(df["data"], cliente.notna())
+    ok = cliente.notna().to_numpy() & data.notna().to_numpy()
+    key = pd.DataFrame({
+        "data": data[ok].to_numpy(),
+        "cliente": cliente[ok].astype(str).to_numpy(),
+        "ore": pd.to_numeric(df["ore"][ok], errors="coerce").fillna(0.0).astype(float).round(4).to_numpy(),
+    })
+    for c in chiavi:
+        key[c] = df[c][ok].fillna("").astype(str).str.strip().to_numpy() if c in df.columns else ""
+    key.index = pd.Index(pd.util.hash_pandas_object(key, index=False).to_numpy(), name="hash")
+    n = key.groupby(level=0, sort=False).size()
+    righe = key.loc[~key.index.duplicated(), ["cliente", "data", "ore"]]
+    righe["n"] = n.reindex(righe.index).to_numpy()
+    return righe, scartate
+
+def parse_effettivo_file(data: bytes, nome: str, chiavi=()) -> list:
+    """Job del pool: tutti i fogli Effettivo di un workbook -> [{"file", "foglio", "righe", "date_scartate"}].
+    ValueError se nessun foglio ha le colonne data, cliente, ore."""
+    fogli = effettivo_sheets(data)
+    if not fogli:
+        raise ValueError(f"{nome}: nessun foglio con le colonne {', '.join(EFF_COLUMNS)}")
+    parti = []
+    for foglio, df in pd.read_excel(BytesIO(data), sheet_name=fogli).items():
+        df.columns = df.columns.astype(str).str.strip().str.lower()
+        righe, scartate = distinct_rows(df, chiavi)
+        parti.append({"file": nome, "foglio": foglio, "righe": righe, "date_scartate": scartate})
+    return parti
+
+class EffettivoMerge:
+    """Unione incrementale dei fogli: per ogni hash conta la molteplicità massima vista in un singolo foglio
+    (una riga ripetuta nello stesso export resta ripetuta, la stessa riga in due export conta una volta).
+    Il risultato non dipende dall'ordine dei fogli; le 'duplicate' per foglio sì (vince il primo letto)."""
+
+    def __init__(self):
+        self.counts = pd.Series(dtype=np.int64, index=pd.Index([], dtype=np.uint64, name="hash"))
+        self.acc = pd.Series(dtype=float, index=pd.MultiIndex.from_arrays(
+            [pd.Index([], dtype=object), pd.DatetimeIndex([])], names=["cliente", "data"]))
+        self.scartate = no_date_rejects()
+        self.parti = []
+
+    def add(self, parte: dict):
+        righe = parte["righe"]
+        prima = self.counts.reindex(righe.index, fill_value=0).to_numpy()
+        nuove = np.maximum(righe["n"].to_numpy() - prima, 0)
+        sel = nuove > 0
+        if sel.any():
+            ore = pd.Series(righe["ore"].to_numpy()[sel] * nuove[sel])
+            giorni = ore.groupby([righe["cliente"].to_numpy()[sel], righe["data"].to_numpy()[sel]]).sum()
+            self.acc = self.acc.add(giorni.rename_axis(["cliente", "data"]), fill_value=0)
+        self.counts = pd.concat([self.counts, righe["n"]]).groupby(level=0).max()
+        totale = int(righe["n"].sum())
+        self.parti.append({"file": parte["file"], "foglio": parte["foglio"], "righe": totale, "duplicate": totale - int(nuove.sum())})
+        self.scartate = merge_date_rejects(self.scartate, parte["date_scartate"])
+
+    def frames(self) -> dict:
+        """{"pivot": df_eff_tot, "giornaliero", "date_scartate", "parti": righe e duplicate per file/foglio}."""
+        daily = self.acc.rename("ore").reset_index()
+        return {"pivot": pivot_from_daily(daily), "giornaliero": daily, "date_scartate": self.scartate,
+                "parti": pd.DataFrame(self.parti, columns=["file", "foglio", "righe", "duplicate"])}
+
+def merge_effettivo_files(files, chiavi=(), processes: int = 0, progress=None) -> dict:
+    """Unisce i workbook [(nome, bytes)]: con `processes` > 1 ogni file è letto in un processo separato
+    (spawn: il chiamante può essere un server con thread attivi). I risultati sono uniti man mano che arrivano."""
+    files = list(files)
+    merge = EffettivoMerge()
+    report_progress(progress, 0.0, f"Lettura di {len(files)} file Effettivo")
+    if processes > 1 and len(files) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(processes, len(files)), mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = {pool.submit(parse_effettivo_file, data, nome, chiavi): nome for nome, data in files}
+            for i, fut in enumerate(as_completed(futures), start=1):
+                for parte in fut.result():
+                    merge.add(parte)
+                report_progress(progress, 0.95 * i / len(files), f"{futures[fut]} ({i} di {len(files)} file)")
+        finally:
+            # annullamento o errore: i file non ancora avviati non partono
+            pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        for i, (nome, data) in enumerate(files, start=1):
+            for parte in parse_effettivo_file(data, nome, chiavi):
+                merge.add(parte)
+            report_progress(progress, 0.95 * i / len(files), f"{nome} ({i} di {len(files)} file)")
+    return merge.frames()
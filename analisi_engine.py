@@ -0,0 +1,807 @@
+# Motore di calcolo Budget vs Effettivo (senza UI)
+# - Ingestione Effettivo/Budget, pivot 1-15 / 1-fine, allineamento
+# - Kernel scostamenti vettoriale + tabelle riepilogo e rollup per periodo
+# - Usato dall'app Streamlit (analisi_budget_vs_effettivo.py) e dal batch (analisi_batch.py)
+
+import os
+import re
+import hashlib
+import threading
+from datetime import date
+from functools import lru_cache
+from collections import OrderedDict
+from io import BytesIO
+from html import escape
+
+import numpy as np
+import pandas as pd
+import matplotlib
+import openpyxl
+
+# ------------------------------
+# Helper
+# ------------------------------
+COL_PATTERN = re.compile(r"^(?P<y>\d{4})-(?P<m>\d{2}) \((?P<half>1-15|1-fine)\)$")
+
+@lru_cache(maxsize=128)
+def _period_axis(cols: tuple) -> pd.DataFrame:
+    ext = pd.Series(cols, index=cols, dtype=object).astype(str).str.extract(COL_PATTERN).dropna()
+    ax = pd.DataFrame({"anno": ext["y"].astype(np.int16), "mese": ext["m"].astype(np.int8), "meta": ext["half"]}, index=ext.index)
+    ax["trimestre"] = ((ax["mese"] - 1) // 3 + 1).astype(np.int8)
+    return ax
+
+def period_axis(cols) -> pd.DataFrame:
+    """Asse periodi precalcolato (una sola passata della regex, memoizzato per insieme di colonne).
+    Indice = etichetta colonna, solo colonne periodo, nell'ordine dato; anno/mese/trimestre interi, meta '1-15'/'1-fine'.
+    Il frame è condiviso: in sola lettura."""
+    return _period_axis(tuple(cols))
+
+def fmt_percent_numeric(v: float) -> str:
+    try:
+        if pd.isna(v):
+            return "None"
+    except Exception:
+        pass
+    if v == -9999:
+        return "Extrabudget"
+    try:
+        if abs(float(v)) < 1e-9:
+            return "0%"
+    except Exception:
+        pass
+    try:
+        return f"{float(v):.1f}%"
+    except Exception:
+        return ""
+
+def fmt_hours(v):
+    try:
+        return f"{float(v):.2f}"
+    except Exception:
+        return ""
+
+# ------------------------------
+# Cache di ingestione (chiave = hash del contenuto del file)
+# ------------------------------
+def file_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Impronta del contenuto di un DataFrame (valori, indice e nomi colonna)."""
+    h = hashlib.sha256(repr(list(df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+def frame_nbytes(df) -> int:
+    if isinstance(df, (bytes, bytearray)):  # file già generati (export xlsx)
+        return len(df)
+    if not isinstance(df, (pd.DataFrame, pd.Series)) and hasattr(df, "nbytes"):  # cubi (ClientPeriodCube, DailyCube)
+        return int(df.nbytes)
+    try:
+        return int(df.memory_usage(deep=True).sum())
+    except Exception:
+        return 0
+
+class IngestCache:
+    """Cache LRU con budget di memoria: chiave -> dict {nome: DataFrame}.
+    Con `sidecar_dir` ogni voce è scritta anche su disco in Parquet (best effort)."""
+
+    def __init__(self, max_bytes: int, sidecar_dir: str = ""):
+        self.max_bytes = max_bytes
+        self.sidecar_dir = sidecar_dir
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        frames = self._read_sidecar(key)
+        if frames is not None:
+            self._store(key, frames)
+        return frames
+
+    def put(self, key: str, frames: dict, persist: bool = True):
+        self._store(key, frames)
+        if persist:
+            self._write_sidecar(key, frames)
+
+    def _store(self, key: str, frames: dict):
+        size = sum(frame_nbytes(f) for f in frames.values())
+        with self._lock:
+            self._items[key] = frames
+            self._items.move_to_end(key)
+            self._sizes[key] = size
+            # eviction LRU: si tiene sempre almeno la voce appena inserita
+            while len(self._items) > 1 and sum(self._sizes.values()) > self.max_bytes:
+                old_key, _ = self._items.popitem(last=False)
+                self._sizes.pop(old_key, None)
+
+    def _sidecar_path(self, key: str, name: str) -> str:
+        return os.path.join(self.sidecar_dir, f"{key}.{name}.parquet")
+
+    def _read_sidecar(self, key: str):
+        if not self.sidecar_dir or not os.path.isdir(self.sidecar_dir):
+            return None
+        prefix = f"{key}."
+        names = [f[len(prefix):-len(".parquet")] for f in os.listdir(self.sidecar_dir)
+                 if f.startswith(prefix) and f.endswith(".parquet")]
+        if not names:
+            return None
+        try:
+            return {n: pd.read_parquet(self._sidecar_path(key, n)) for n in names}
+        except Exception:
+            return None
+
+    def _write_sidecar(self, key: str, frames: dict):
+        if not self.sidecar_dir:
+            return
+        try:
+            os.makedirs(self.sidecar_dir, exist_ok=True)
+            for name, df in frames.items():
+                path = self._sidecar_path(key, name)
+                tmp = path + ".tmp"
+                df.to_parquet(tmp)
+                os.replace(tmp, path)
+        except Exception:
+            # Parquet non disponibile o colonne non serializzabili: resta solo la cache in memoria
+            for name in frames:
+                for path in (self._sidecar_path(key, name), self._sidecar_path(key, name) + ".tmp"):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+# ------------------------------
+# Ingestione
+# ------------------------------
+def _as_excel_source(source):
+    return BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+def report_progress(progress, frac: float, message: str):
+    """Avanzamento verso il chiamante (job in background); progress può sollevare per annullare."""
+    if progress is not None:
+        progress(frac, message)
+
+def pivot_effettivo(df_eff: pd.DataFrame) -> pd.DataFrame:
+    """Pivot cliente x 'YYYY-MM (1-15)' / 'YYYY-MM (1-fine)' da righe con data/mese/giorno già calcolati.
+    Le righe senza data valida sono escluse (vedi il report di normalize_dates)."""
+    df_eff = df_eff[df_eff["giorno"].notna()]
+    pivot_1_15 = df_eff[df_eff["giorno"] <= 15].pivot_table(index="cliente", columns="mese", values="ore", aggfunc="sum", fill_value=0)
+    pivot_1_15.columns = [f"{c} (1-15)" for c in pivot_1_15.columns]
+    pivot_1_fine = df_eff.pivot_table(index="cliente", columns="mese", values="ore", aggfunc="sum", fill_value=0)
+    pivot_1_fine.columns = [f"{c} (1-fine)" for c in pivot_1_fine.columns]
+
+    df_eff_tot = pd.concat([pivot_1_15, pivot_1_fine], axis=1).fillna(0)
+    df_eff_tot = df_eff_tot.reindex(sorted(df_eff_tot.columns), axis=1)
+    df_eff_tot.index = df_eff_tot.index.astype(str)
+    return df_eff_tot
+
+def merge_pivots(pivots) -> pd.DataFrame:
+    """Somma di pivot parziali nel formato df_eff_tot (unione di clienti e colonne, 0 dove assenti)."""
+    pivots = [p for p in pivots if not p.empty]
+    if not pivots:
+        return pd.DataFrame(dtype=float)
+    if len(pivots) == 1:
+        return pivots[0]
+    long = pd.concat([p.stack() for p in pivots])
+    df_eff_tot = long.groupby(level=[0, 1], sort=False).sum().unstack(fill_value=0)
+    df_eff_tot = df_eff_tot.reindex(sorted(df_eff_tot.columns), axis=1)
+    df_eff_tot.index = df_eff_tot.index.astype(str)
+    return df_eff_tot
+
+def read_effettivo_sheet(source) -> pd.DataFrame:
+    """Foglio 'Effettivo' così com'è, con i nomi colonna ripuliti e in minuscolo."""
+    df_eff = pd.read_excel(_as_excel_source(source), sheet_name="Effettivo")
+    df_eff.columns = df_eff.columns.str.strip().str.lower()
+    return df_eff
+
+# ------------------------------
+# Normalizzazione date
+# ------------------------------
+# formati espliciti provati in ordine sulle stringhe (giorno prima del mese, come negli export)
+DATE_FORMATS = (
+    "%d/%m/%Y", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%y",
+    "%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%d-%m-%Y", "%d.%m.%Y",
+)
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+EXCEL_SERIAL_MAX = 2_958_465  # 31/12/9999
+EMPTY_DATE = "(vuota)"
+
+def _parse_date_values(u: pd.Series) -> pd.Series:
+    """Valori distinti (object) -> datetime64, gruppo per gruppo: date/datetime, seriali Excel, stringhe."""
+    out = pd.Series(pd.NaT, index=u.index, dtype="datetime64[ns]")
+    is_dt = u.map(lambda v: isinstance(v, (date, np.datetime64))).astype(bool)
+    if is_dt.any():
+        out[is_dt] = pd.to_datetime(u[is_dt], errors="coerce")
+
+    is_str = u.map(lambda v: isinstance(v, str)).astype(bool)
+    text = u[is_str].str.strip()
+    # numeri e stringhe numeriche -> seriale Excel (giorni dal 30/12/1899, frazione = ora)
+    num = pd.to_numeric(u.where(~is_dt & ~is_str), errors="coerce")
+    num = num.fillna(pd.to_numeric(text, errors="coerce").reindex(u.index))
+    serial = num.between(1, EXCEL_SERIAL_MAX)
+    if serial.any():
+        out[serial] = EXCEL_EPOCH + pd.to_timedelta(num[serial], unit="D")
+
+    pending = text[~serial[is_str] & (text != "")]
+    for fmt in DATE_FORMATS:
+        if pending.empty:
+            break
+        parsed = pd.to_datetime(pending, format=fmt, errors="coerce")
+        ok = parsed.notna()
+        out[pending.index[ok]] = parsed[ok]
+        pending = pending[~ok]
+    if not pending.empty:  # formati residui: parsing per elemento, solo sui pochi valori rimasti
+        out[pending.index] = pd.to_datetime(pending, format="mixed", dayfirst=True, errors="coerce")
+    return out
+
+def normalize_dates(values, count_mask=None):
+    """Colonna date eterogenea (datetime, seriali Excel, stringhe gg/mm/aaaa...) -> datetime64[ns].
+    Ogni valore distinto è interpretato una sola volta, poi riportato sulle righe.
+    Restituisce (date, scartate): scartate = DataFrame valore/righe dei valori non interpretabili;
+    le date vuote contano solo sulle righe di `count_mask` (es. righe con cliente)."""
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(s) and getattr(s.dt, "tz", None) is None:
+        dates = s.astype("datetime64[ns]")
+        codes, uniques = np.where(dates.isna(), 0, -1), pd.Series([None], dtype=object)
+        bad = pd.Series([True])
+    else:
+        codes, uniques = pd.factorize(s.to_numpy(dtype=object), use_na_sentinel=False)
+        uniques = pd.Series(uniques, dtype=object)
+        parsed = _parse_date_values(uniques)
+        dates = pd.Series(parsed.to_numpy()[codes], index=s.index, dtype="datetime64[ns]")
+        bad = parsed.isna()
+
+    # conteggio degli scarti sui valori distinti (bincount dei codici)
+    empty = uniques.isna() | uniques.map(lambda v: isinstance(v, str) and not v.strip()).astype(bool)
+    if count_mask is not None:
+        counted = np.asarray(count_mask, dtype=bool)
+        righe = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        righe_vuote = np.bincount(codes[(codes >= 0) & counted], minlength=len(uniques))
+        righe = np.where(empty, righe_vuote, righe)
+    else:
+        righe = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    keep = bad.to_numpy() & (righe > 0)
+    scartate = pd.DataFrame({
+        "valore": [EMPTY_DATE if e else str(v) for v, e in zip(uniques[keep], empty[keep])],
+        "righe": righe[keep].astype(np.int64),
+    })
+    scartate = scartate.groupby("valore", as_index=False, sort=False)["righe"].sum()
+    return dates, scartate.sort_values("righe", ascending=False, kind="stable").reset_index(drop=True)
+
+def no_date_rejects() -> pd.DataFrame:
+    return pd.DataFrame({"valore": pd.Series(dtype=object), "righe": pd.Series(dtype=np.int64)})
+
+def merge_date_rejects(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Somma di due report date scartate (valore/righe)."""
+    if a.empty or b.empty:
+        return b if a.empty else a
+    out = pd.concat([a, b]).groupby("valore", as_index=False, sort=False)["righe"].sum()
+    return out.sort_values("righe", ascending=False, kind="stable").reset_index(drop=True)
+
+def add_periods(df_eff: pd.DataFrame) -> pd.DataFrame:
+    """Parsing di 'data' + colonne derivate 'mese' (YYYY-MM) e 'giorno' (in place, restituisce df_eff)."""
+    df_eff["data"] = normalize_dates(df_eff["data"])[0]
+    df_eff["mese"] = df_eff["data"].dt.to_period("M").astype(str)
+    df_eff["giorno"] = df_eff["data"].dt.day
+    return df_eff
+
+def daily_totals(df_eff: pd.DataFrame) -> pd.DataFrame:
+    """Ore per (cliente, giorno) dalle righe con data valida: base compatta del cubo giornaliero (analisi_daily)."""
+    df = df_eff[df_eff["data"].notna() & df_eff["cliente"].notna()]
+    ore = pd.to_numeric(df["ore"], errors="coerce").fillna(0.0).astype(float)
+    daily = ore.groupby([df["cliente"].astype(str).rename("cliente"), df["data"].dt.normalize().rename("data")]).sum()
+    return daily.rename("ore").reset_index()
+
+def pivot_from_daily(daily: pd.DataFrame) -> pd.DataFrame:
+    """df_eff_tot (1-15 / 1-fine) dai totali giornalieri, senza ripassare sulle righe."""
+    mese = daily["data"].dt.to_period("M").astype(str).rename("mese")
+    fine = daily.groupby([daily["cliente"], mese])["ore"].sum()
+    q115 = daily[daily["data"].dt.day <= 15].groupby([daily["cliente"], mese])["ore"].sum()
+    pivot_1_15 = q115.unstack("mese", fill_value=0)
+    pivot_1_15.columns = [f"{c} (1-15)" for c in pivot_1_15.columns]
+    pivot_1_fine = fine.unstack("mese", fill_value=0)
+    pivot_1_fine.columns = [f"{c} (1-fine)" for c in pivot_1_fine.columns]
+
+    df_eff_tot = pd.concat([pivot_1_15, pivot_1_fine], axis=1).fillna(0)
+    df_eff_tot = df_eff_tot.reindex(sorted(df_eff_tot.columns), axis=1)
+    df_eff_tot.index = df_eff_tot.index.astype(str)
+    return df_eff_tot
+
+def read_effettivo_rows(source, progress=None) -> tuple:
+    """Righe del foglio 'Effettivo' con date normalizzate e colonne 'mese'/'giorno' + report delle date scartate."""
+    report_progress(progress, 0.0, "Lettura del foglio 'Effettivo'")
+    df_eff = read_effettivo_sheet(source)
+    report_progress(progress, 0.6, f"Normalizzazione date ({len(df_eff)} righe)")
+    scartate = no_date_rejects()
+    if "data" in df_eff.columns:
+        count_mask = df_eff["cliente"].notna() if "cliente" in df_eff.columns else None
+        df_eff["data"], scartate = normalize_dates(df_eff["data"], count_mask)
+    return add_periods(df_eff), scartate
+
+def parse_effettivo(source, progress=None) -> dict:
+    """Legge il foglio 'Effettivo' (bytes, path o file-like) -> {"rows": righe tipizzate, "pivot": df_eff_tot,
+    "giornaliero": ore per cliente e giorno, "date_scartate": valori data non interpretabili}.
+    `progress(frazione, messaggio)` è chiamato tra un passo e l'altro."""
+    df_eff, scartate = read_effettivo_rows(source, progress)
+    report_progress(progress, 0.8, "Pivot per cliente e periodo")
+    pivot = pivot_effettivo(df_eff)
+    report_progress(progress, 0.9, "Totali giornalieri")
+    return {"rows": df_eff, "pivot": pivot, "giornaliero": daily_totals(df_eff), "date_scartate": scartate}
+
+EFF_COLUMNS = ("data", "cliente", "ore")
+
+def _fold_chunk(chunk: list, acc, scartate):
+    df = pd.DataFrame(chunk, columns=list(EFF_COLUMNS))
+    df["data"], rej = normalize_dates(df["data"], df["cliente"].notna())
+    daily = daily_totals(df).set_index(["cliente", "data"])["ore"]
+    return acc.add(daily, fill_value=0), merge_date_rejects(scartate, rej)
+
+def stream_effettivo(source, chunk_rows: int = 50_000, progress=None) -> dict:
+    """Lettura in streaming del foglio 'Effettivo' (openpyxl read-only, solo data/cliente/ore).
+    Le righe sono accumulate a blocchi di `chunk_rows` nelle somme (cliente, giorno):
+    la memoria dipende da clienti x giorni, non dal numero di righe.
+    Restituisce {"pivot": df_eff_tot, "giornaliero", "date_scartate"}; `progress` è chiamato a ogni blocco."""
+    wb = openpyxl.load_workbook(_as_excel_source(source), read_only=True, data_only=True)
+    try:
+        ws = wb["Effettivo"]
+        totale = ws.max_row or 0  # dalle dimensioni dichiarate nel file (può mancare)
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip().lower() if h is not None else "" for h in next(rows, ())]
+        missing = [c for c in EFF_COLUMNS if c not in header]
+        if missing:
+            raise ValueError(f"Nel foglio 'Effettivo' mancano le colonne: {', '.join(missing)}")
+        pos = [header.index(c) for c in EFF_COLUMNS]
+
+        acc = pd.Series(dtype=float, index=pd.MultiIndex.from_arrays(
+            [pd.Index([], dtype=object), pd.DatetimeIndex([])], names=["cliente", "data"]))
+        scartate = no_date_rejects()
+        chunk = []
+        lette = 0
+        report_progress(progress, 0.0, "Lettura in streaming del foglio 'Effettivo'")
+        for row in rows:
+            chunk.append(tuple(row[i] if i < len(row) else None for i in pos))
+            if len(chunk) >= chunk_rows:
+                acc, scartate = _fold_chunk(chunk, acc, scartate)
+                lette += len(chunk)
+                chunk = []
+                report_progress(progress, 0.9 * lette / totale if totale > lette else 0.5, f"{lette} righe lette")
+        if chunk:
+            acc, scartate = _fold_chunk(chunk, acc, scartate)
+    finally:
+        wb.close()
+
+    report_progress(progress, 0.9, "Pivot per cliente e periodo")
+    daily = acc.rename("ore").reset_index()
+    return {"pivot": pivot_from_daily(daily), "giornaliero": daily, "date_scartate": scartate}
+
+def read_budget(source) -> pd.DataFrame:
+    """Legge il primo foglio del Budget (bytes, path o file-like) con i nomi colonna ripuliti.
+    Una categoria vuota è salvata in Excel come cella vuota e torna NaN: qui ridiventa ''."""
+    df = pd.read_excel(_as_excel_source(source))
+    df.columns = df.columns.str.strip()
+    for c in df.columns:
+        if c.lower() == "categoria_cliente":
+            df[c] = df[c].fillna("").astype(str)
+    return df
+
+def prepare_budget(df_budget: pd.DataFrame) -> pd.DataFrame:
+    """Budget indicizzato per cliente, con colonna 'categoria_cliente' garantita.
+    Solleva ValueError se manca la colonna 'cliente'."""
+    df_budget = df_budget.copy()
+    df_budget.columns = df_budget.columns.str.strip()
+    cliente_col = next((c for c in df_budget.columns if c.lower()=="cliente"), None)
+    if not cliente_col:
+        raise ValueError("Nel Budget manca la colonna 'cliente'.")
+
+    cat_col = next((c for c in df_budget.columns if c.lower()=="categoria_cliente"), None)
+    if not cat_col:
+        df_budget["categoria_cliente"] = ""
+    elif cat_col != "categoria_cliente":
+        df_budget = df_budget.rename(columns={cat_col: "categoria_cliente"})
+
+    return df_budget.set_index(cliente_col)
+
+# ------------------------------
+# Cubo clienti x periodi
+# ------------------------------
+CUBE_F32_MAX = 2 ** 17  # sotto questa soglia float32 conserva esattamente i valori a 2 decimali
+
+class ClientPeriodCube:
+    """Budget ed Effettivo allineati in un unico array denso (piano, cliente, periodo).
+    - clienti: CategoricalIndex ordinato, il codice del cliente è la riga del cubo
+    - periodi: asse precalcolato (anno, mese, meta, trimestre), niente regex per colonna
+    - valori float32 (float64 se troppo grandi per restare esatti a 2 decimali); le selezioni sono
+      posizioni (CubeSlice) e i DataFrame float64 si materializzano solo quando servono, con gli stessi
+      valori round(2) dei frame originali."""
+
+    PLANES = ("budget", "eff")
+
+    def __init__(self, clients: pd.Index, axis: pd.DataFrame, values: np.ndarray):
+        self.clients = clients if isinstance(clients, pd.CategoricalIndex) else pd.CategoricalIndex(clients, categories=clients, ordered=True)
+        self.axis = axis
+        self.values = values
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.axis.index
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.values.nbytes + self.clients.codes.nbytes)
+
+    def locate(self, clients=None, cols=None):
+        """Posizioni (codici) di clienti e colonne; None = tutto. Posizioni contigue e crescenti diventano
+        una slice, così le letture sono viste NumPy senza copia. KeyError se un'etichetta non esiste."""
+        def _pos(index, labels):
+            if labels is None:
+                return None
+            pos = index.get_indexer(labels)
+            if (pos < 0).any():
+                raise KeyError(f"Etichette non presenti nel cubo: {list(pd.Index(labels)[pos < 0][:5])}")
+            if len(pos) and (np.diff(pos) == 1).all():
+                return slice(int(pos[0]), int(pos[-1]) + 1)
+            return pos.astype(np.int32)
+        return _pos(self.clients, clients), _pos(self.columns, cols)
+
+    def plane(self, plane: str, rows=None, cols=None) -> np.ndarray:
+        """Valori grezzi di un piano sulle posizioni: vista per slice/None, copia solo con array di codici."""
+        v = self.values[self.PLANES.index(plane)]
+        if isinstance(rows, np.ndarray) and isinstance(cols, np.ndarray):
+            return v[np.ix_(rows, cols)]
+        if rows is not None:
+            v = v[rows]
+        if cols is not None:
+            v = v[:, cols]
+        return v
+
+    def frame(self, plane: str, rows=None, cols=None) -> pd.DataFrame:
+        """DataFrame float64 di un piano sulle posizioni indicate (None = tutte)."""
+        out = self.plane(plane, rows, cols).astype(np.float64)
+        if self.values.dtype != np.float64:
+            out = out.round(2)
+        return pd.DataFrame(
+            out,
+            index=self.clients if rows is None else self.clients[rows],
+            columns=self.columns if cols is None else self.columns[cols],
+        )
+
+class CubeSlice:
+    """Selezione clienti x periodi di un cubo per posizione (slice o codici): i valori restano nel cubo.
+    Ore e scostamenti come DataFrame float64 si costruiscono su richiesta, per tutta la selezione
+    o per una finestra di clienti (la pagina visibile), e non vanno tenuti in cache."""
+
+    def __init__(self, cube: ClientPeriodCube, rows=None, cols=None):
+        self.cube = cube
+        self.rows = rows
+        self.cols = cols
+
+    @property
+    def clients(self) -> pd.Index:
+        return self.cube.clients if self.rows is None else self.cube.clients[self.rows]
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.cube.columns if self.cols is None else self.cube.columns[self.cols]
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    @property
+    def nbytes(self) -> int:
+        """Solo le posizioni: il cubo è condiviso con la voce di cache dello stadio align."""
+        return sum(int(p.nbytes) for p in (self.rows, self.cols) if isinstance(p, np.ndarray))
+
+    def _rows(self, clients):
+        return self.rows if clients is None else self.cube.locate(clients)[0]
+
+    def frame(self, plane: str, clients=None) -> pd.DataFrame:
+        """Piano `plane` della selezione, o dei soli `clients` (nell'ordine dato)."""
+        return self.cube.frame(plane, self._rows(clients), self.cols)
+
+    def frames(self, clients=None) -> dict:
+        """eff, budget e scostamenti (perc, eff_in, eff_extra) della selezione o dei soli `clients`."""
+        rows = self._rows(clients)
+        out = {"eff": self.cube.frame("eff", rows, self.cols), "budget": self.cube.frame("budget", rows, self.cols)}
+        out.update(variance_frames(out["budget"], out["eff"]))
+        return out
+
+def build_cube(df_budget: pd.DataFrame, df_eff_tot: pd.DataFrame) -> ClientPeriodCube:
+    """Allinea Budget (già preparato) ed Effettivo su unione clienti x colonne periodo comuni, con round(2)."""
+    colonne_valide = [c for c in df_budget.columns if COL_PATTERN.match(str(c))]
+    colonne_comuni = df_eff_tot.columns.intersection(colonne_valide)
+    idx_union = sorted(set(df_budget.index.astype(str)).union(set(df_eff_tot.index.astype(str))))
+
+    def _plane(df):
+        df = df.reindex(index=idx_union, columns=colonne_comuni, fill_value=0)
+        return df.apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.float64).round(2)
+
+    values = np.stack([_plane(df_budget), _plane(df_eff_tot)])
+    if values.size == 0 or np.abs(values).max() < CUBE_F32_MAX:
+        values = values.astype(np.float32)
+    return ClientPeriodCube(pd.Index(idx_union, dtype=object), period_axis(colonne_comuni), values)
+
+def align(df_budget: pd.DataFrame, df_eff_tot: pd.DataFrame) -> dict:
+    """Allinea Budget (già preparato) ed Effettivo su unione clienti x colonne comuni, in float con round(2)."""
+    cube = build_cube(df_budget, df_eff_tot)
+    return {"eff": cube.frame("eff"), "budget": cube.frame("budget"), "colonne": cube.columns, "clienti": list(cube.clients), "cube": cube}
+
+def missing_categories(df_budget: pd.DataFrame, clienti) -> list:
+    cat_series = df_budget["categoria_cliente"].reindex(index=clienti).fillna("").astype(str).str.strip()
+    return list(cat_series.index[cat_series == ""])
+
+def with_categories(df_budget: pd.DataFrame, categorie: pd.Series) -> pd.DataFrame:
+    """Copia del Budget preparato con le categorie assegnate (cliente -> categoria).
+    I clienti assenti dal Budget sono aggiunti in blocco con valori 0."""
+    df_budget = df_budget.copy()
+    categorie = categorie[categorie.astype(str).str.strip() != ""]
+    present = categorie.index.isin(df_budget.index)
+    df_budget.loc[categorie.index[present], "categoria_cliente"] = categorie[present].to_numpy()
+    if (~present).any():
+        nuovi = pd.DataFrame(0, index=categorie.index[~present], columns=df_budget.columns)
+        nuovi["categoria_cliente"] = categorie[~present].to_numpy()
+        df_budget = pd.concat([df_budget, nuovi])
+    return df_budget
+
+def category_map(df_budget: pd.DataFrame) -> pd.Series:
+    """cliente -> categoria normalizzata (strip + Title case)."""
+    return df_budget["categoria_cliente"].fillna("").astype(str).str.strip().str.title()
+
+# ------------------------------
+# Stile heatmap (vettoriale, con LUT precalcolata)
+# ------------------------------
+# La colormap ha N colori: quantizzare (v+50)/150 su N livelli dà gli stessi colori di plt.cm.RdYlGn(norm)
+HEAT_CMAP = matplotlib.colormaps["RdYlGn"]
+HEAT_CSS_LUT = np.array([f"background-color: {matplotlib.colors.rgb2hex(c)}" for c in HEAT_CMAP(np.arange(HEAT_CMAP.N))], dtype=object)
+CSS_NONE = "background-color: black; color: black;"
+CSS_EXTRABUDGET = "background-color: violet; color: white;"
+
+def percent_css(values) -> np.ndarray:
+    """Matrice CSS per valori percentuali: NaN -> 'None', -9999 -> 'Extrabudget', altrimenti RdYlGn."""
+    v = pd.DataFrame(values).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    nan = np.isnan(v)
+    norm = np.clip((np.where(nan, 0.0, v) + 50) / 150, 0.0, 1.0)
+    lut_idx = np.minimum((norm * HEAT_CMAP.N).astype(int), HEAT_CMAP.N - 1)
+    css = HEAT_CSS_LUT[lut_idx]
+    css[v == -9999] = CSS_EXTRABUDGET
+    css[nan] = CSS_NONE
+    return css
+
+def _style_percent_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(percent_css(df), index=df.index, columns=df.columns)
+
+def style_percent(df: pd.DataFrame, subset=None):
+    """Styler con la heatmap applicata (in un solo passaggio) alle colonne `subset`."""
+    return df.style.apply(_style_percent_frame, axis=None, subset=subset)
+
+def percent_labels(values) -> np.ndarray:
+    """Testo delle celle percentuali, come fmt_percent_numeric ma su tutta la matrice in una volta."""
+    v = pd.DataFrame(values).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    nan = np.isnan(v)
+    out = np.char.mod("%.1f%%", np.where(nan, 0.0, v)).astype(object)
+    out[np.abs(v) < 1e-9] = "0%"
+    out[v == -9999] = "Extrabudget"
+    out[nan] = "None"
+    return out
+
+HEAT_TABLE_CSS = (
+    "<style>.heat-wrap{overflow-x:auto}"
+    ".heat{border-collapse:collapse;font-size:0.8rem;white-space:nowrap}"
+    ".heat td,.heat th{padding:2px 6px;border:1px solid rgba(128,128,128,.25);text-align:right}"
+    ".heat tbody th{text-align:left}</style>"
+)
+
+def heatmap_html(df: pd.DataFrame) -> str:
+    """Heatmap come tabella HTML semplice: CSS dalla LUT e testo da percent_labels, senza la pipeline dello Styler.
+    Il costo è una concatenazione di stringhe per cella: da usare sulla finestra visibile."""
+    css, txt = percent_css(df), percent_labels(df)
+    celle = '<td style="' + css + '">' + txt + "</td>"
+    testa = "".join(f"<th>{escape(str(c))}</th>" for c in df.columns)
+    corpo = "".join(
+        f"<tr><th>{escape(str(i))}</th>{''.join(riga)}</tr>" for i, riga in zip(df.index, celle.tolist())
+    )
+    nome = escape(str(df.index.name or ""))
+    return (f'{HEAT_TABLE_CSS}<div class="heat-wrap"><table class="heat"><thead><tr><th>{nome}</th>{testa}</tr></thead>'
+            f"<tbody>{corpo}</tbody></table></div>")
+
+# ------------------------------
+# Kernel scostamenti (vettoriale su matrice intera)
+# ------------------------------
+EXTRABUDGET = -9999
+PERC_COLS = ["Scostamento % (solo eff. a budget)", "Scostamento % (incl. Extrabudget)"]
+SUMMARY_FMT = {
+    "Ore a Budget": fmt_hours,
+    "Ore Effettive (senza Extrabudget)": fmt_hours,
+    "Ore Extrabudget": fmt_hours,
+    **{c: fmt_percent_numeric for c in PERC_COLS},
+}
+DASHBOARD_FMT = {
+    "Scostamento %": fmt_percent_numeric,
+    "Ore Effettive": fmt_hours,
+    "Ore a Budget": fmt_hours,
+    "Scostamento Valore (ore)": fmt_hours,
+}
+
+def variance_kernel(budget, eff) -> dict:
+    """Un passaggio NumPy su matrici allineate (clienti x colonne).
+    perc: NaN su budget=0 & eff=0, -9999 su budget=0 & eff>0; eff_in/eff_extra: ore a budget / extrabudget."""
+    b = np.asarray(budget, dtype=float)
+    e = np.asarray(eff, dtype=float)
+    den_zero = b == 0
+    mask_zero = den_zero & (e == 0)
+    mask_extra = den_zero & (e > 0)
+    perc = np.zeros_like(b)
+    np.divide(b - e, b, out=perc, where=~den_zero)
+    perc = np.round(perc * 100, 1)
+    perc[mask_zero] = np.nan
+    perc[mask_extra] = EXTRABUDGET
+    return {
+        "perc": perc,
+        "eff_in": np.where(mask_extra, 0.0, e),
+        "eff_extra": np.where(mask_extra, e, 0.0),
+    }
+
+def variance_frames(budget: pd.DataFrame, eff: pd.DataFrame) -> dict:
+    """variance_kernel con gli output rietichettati come DataFrame (stessi indici di `eff`)."""
+    var = variance_kernel(budget.to_numpy(), eff.to_numpy())
+    return {k: pd.DataFrame(v, index=eff.index, columns=eff.columns) for k, v in var.items()}
+
+def summary_percent(be, ee, extrabudget: bool = True) -> np.ndarray:
+    """Scostamento % su ore aggregate: NaN se budget<=0 (o -9999 se c'è effettivo e `extrabudget`)."""
+    be = np.asarray(be, dtype=float)
+    ee = np.asarray(ee, dtype=float)
+    pos = be > 0
+    perc = np.full(be.shape, np.nan)
+    np.divide(be - ee, be, out=perc, where=pos)
+    perc = np.round(perc * 100, 1)
+    if extrabudget:
+        perc[~pos & (ee > 0)] = EXTRABUDGET
+    return perc
+
+def summary_table(be, ee_in, ee_extra, index) -> pd.DataFrame:
+    """Tabella riepilogo standard (ore + due scostamenti %) da somme già ridotte."""
+    be = np.round(np.asarray(be, dtype=float), 2)
+    ee_in = np.round(np.asarray(ee_in, dtype=float), 2)
+    ee_extra = np.round(np.asarray(ee_extra, dtype=float), 2)
+    ee_tot = np.round(ee_in + ee_extra, 2)
+    return pd.DataFrame({
+        "Ore a Budget": be,
+        "Ore Effettive (senza Extrabudget)": ee_in,
+        "Ore Extrabudget": ee_extra,
+        PERC_COLS[0]: summary_percent(be, ee_in, extrabudget=False),
+        PERC_COLS[1]: summary_percent(be, ee_tot),
+    }, index=index)
+
+# ------------------------------
+# Tabelle di output
+# ------------------------------
+def cols_of_half(cols, half: str) -> list:
+    ax = period_axis(cols)
+    return list(ax.index[ax["meta"] == half])
+
+def detail_table(eff_f, budget_f, diff_num_f) -> pd.DataFrame:
+    return pd.concat([eff_f, budget_f, diff_num_f], keys=["Effettivo", "Budget", "Scostamento %"], axis=1)
+
+def dashboard_table(budget_f, eff_in_f, eff_extra_f, cat_map_norm) -> pd.DataFrame:
+    """Riepilogo per cliente sulle colonne '1-fine' (o '1-15' se non selezionate)."""
+    cols_fine = cols_of_half(budget_f.columns, "1-fine") or cols_of_half(budget_f.columns, "1-15") or list(budget_f.columns)
+
+    # riduzione per riga degli output del kernel
+    ore_eff = (eff_in_f[cols_fine].sum(axis=1) + eff_extra_f[cols_fine].sum(axis=1)).round(2)
+    ore_bud = budget_f[cols_fine].sum(axis=1).round(2)
+
+    dashboard = pd.DataFrame({
+        "Ore Effettive": ore_eff,
+        "Ore a Budget": ore_bud,
+        "Categoria": [cat_map_norm.get(c, "") for c in budget_f.index]
+    }, index=budget_f.index)
+    dashboard["Scostamento Valore (ore)"] = (ore_bud - ore_eff).round(2)
+    dashboard["Scostamento %"] = summary_percent(ore_bud, ore_eff)
+    return dashboard
+
+def monthly_table(budget_f, eff_in_f, eff_extra_f) -> pd.DataFrame:
+    """Riepilogo mensile (solo 1-fine), riduzione per colonna degli output del kernel."""
+    ax = period_axis(budget_f.columns)
+    fine = ax[ax["meta"] == "1-fine"].sort_values(["anno", "mese"], kind="stable")
+    cols_mese = list(fine.index)
+    return summary_table(
+        budget_f[cols_mese].sum(axis=0),
+        eff_in_f[cols_mese].sum(axis=0),
+        eff_extra_f[cols_mese].sum(axis=0),
+        index=pd.Index([f"{y}-{m:02d}" for y, m in zip(fine["anno"], fine["mese"])], name="Anno-Mese"),
+    )
+
+# ------------------------------
+# Finestra di righe (ordinamento lato server + paginazione)
+# ------------------------------
+VIEW_SORTS = {
+    "peggiore": "Scostamento peggiore",
+    "ore": "Ore effettive (decrescente)",
+    "cliente": "Cliente (A-Z)",
+}
+
+def order_clients(dashboard: pd.DataFrame, sort: str) -> pd.Index:
+    """Ordine dei clienti per la vista a finestra, calcolato sul riepilogo dashboard.
+    'peggiore': prima gli Extrabudget, poi Scostamento % crescente, 'None' in fondo."""
+    if sort == "peggiore":
+        perc = dashboard["Scostamento %"]
+        key = perc.where(perc != EXTRABUDGET, -np.inf)
+        return key.sort_values(na_position="last", kind="stable").index
+    if sort == "ore":
+        return dashboard["Ore Effettive"].sort_values(ascending=False, kind="stable").index
+    return dashboard.index.sort_values()
+
+def page_window(ordered: pd.Index, page: int, page_size: int) -> pd.Index:
+    """Righe della pagina `page` (1-based) di dimensione `page_size`."""
+    start = max(page - 1, 0) * page_size
+    return ordered[start:start + page_size]
+
+# ------------------------------
+# Rollup per periodo (groupby sull'asse colonne)
+# ------------------------------
+ROLLUP_LEVELS = {
+    "trimestre": "Anno-Trimestre",
+    "anno": "Anno",
+    "ytd": "Anno-Mese (YTD)",
+    "r12": "Anno-Mese (ultimi 12 mesi)",
+}
+
+def period_rollup(budget_f, eff_in_f, eff_extra_f, cols, kind: str) -> pd.DataFrame:
+    """Riepilogo per (cliente, periodo) sulle colonne `cols` (tipicamente le '1-fine').
+    kind: 'trimestre' | 'anno' | 'ytd' (progressivo da inizio anno) | 'r12' (ultimi 12 mesi)."""
+    level = ROLLUP_LEVELS[kind]
+    ax = period_axis(cols)
+    if kind == "trimestre":
+        labels = [f"{y}-Q{q}" for y, q in zip(ax["anno"], ax["trimestre"])]
+    elif kind == "anno":
+        labels = [str(y) for y in ax["anno"]]
+    else:
+        labels = [f"{y}-{m:02d}" for y, m in zip(ax["anno"], ax["mese"])]
+
+    # (periodo x cliente): un solo groupby per matrice, niente loop sui clienti
+    sums = [mat[cols].T.groupby(labels, sort=True).sum() for mat in (budget_f, eff_in_f, eff_extra_f)]
+    if kind in ("ytd", "r12") and len(cols) > 0:
+        months = pd.PeriodIndex(sums[0].index, freq="M")
+        full = pd.period_range(months.min(), months.max(), freq="M")
+        dense = [s.set_axis(months).reindex(full, fill_value=0.0) for s in sums]
+        if kind == "ytd":
+            dense = [d.groupby(d.index.year).cumsum() for d in dense]
+        else:
+            dense = [d.rolling(12, min_periods=1).sum() for d in dense]
+        sums = [d.loc[months].set_axis(sums[0].index) for d in dense]
+
+    index = pd.MultiIndex.from_product([sums[0].index, budget_f.index], names=[level, "Cliente"]).swaplevel()
+    return summary_table(*(s.to_numpy().ravel() for s in sums), index=index)
+
+def rollup_totals(per_client: pd.DataFrame) -> pd.DataFrame:
+    """Totale complessivo per periodo a partire da un riepilogo per cliente."""
+    level = per_client.index.names[1]
+    agg = per_client.groupby(level=level)[["Ore a Budget", "Ore Effettive (senza Extrabudget)", "Ore Extrabudget"]].sum()
+    return summary_table(agg["Ore a Budget"], agg["Ore Effettive (senza Extrabudget)"], agg["Ore Extrabudget"], index=agg.index)
+
+# ------------------------------
+# Report completo (uso headless)
+# ------------------------------
+def build_report(df_budget: pd.DataFrame, df_eff_tot: pd.DataFrame, cols=None) -> dict:
+    """Tutte le tabelle dell'analisi, senza filtri cliente/categoria.
+    df_budget: Budget grezzo (come letto dall'xlsx); cols: sottoinsieme opzionale delle colonne periodo."""
+    df_budget = prepare_budget(df_budget)
+    al = align(df_budget, df_eff_tot)
+    eff, budget = al["eff"], al["budget"]
+    if cols is not None:
+        cols = [c for c in al["colonne"] if c in set(cols)]
+        eff, budget = eff[cols], budget[cols]
+    var = variance_frames(budget, eff)
+
+    report = {
+        "Dettaglio": detail_table(eff, budget, var["perc"]),
+        "Dashboard": dashboard_table(budget, var["eff_in"], var["eff_extra"], category_map(df_budget)),
+        "Mensile": monthly_table(budget, var["eff_in"], var["eff_extra"]),
+    }
+    cols_fine = cols_of_half(budget.columns, "1-fine")
+    quarter = period_rollup(budget, var["eff_in"], var["eff_extra"], cols_fine, "trimestre")
+    report["Trimestrale"] = quarter
+    report["Trimestrale totale"] = rollup_totals(quarter)
+    report["Annuale"] = period_rollup(budget, var["eff_in"], var["eff_extra"], cols_fine, "anno")
+    return report
@@ -0,0 +1,206 @@
+# Export Excel dei report (senza UI)
+# - Scrittura in streaming riga per riga: xlsxwriter in constant_memory se installato, altrimenti openpyxl write-only
+# - Heatmap come formattazione condizionale nativa (scala RdYlGn + regole 'None' / 'Extrabudget'),
+#   niente stile per cella: file piccoli e scrittura veloce anche con migliaia di clienti
+
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import matplotlib
+
+from analisi_engine import EXTRABUDGET, HEAT_CMAP, PERC_COLS
+
+try:
+    import xlsxwriter
+except ImportError:  # fallback su openpyxl (già tra i requisiti)
+    xlsxwriter = None
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+FMT_PERCENT = '0.0"%"'
+FMT_HOURS = "0.00"
+FMT_DATE = "dd/mm/yyyy"
+PERC_LABELS = {"Scostamento %", *PERC_COLS}
+# stessa resa di percent_css: (v + 50) / 150 su RdYlGn, estremi saturati
+HEAT_SCALE = [(-50, matplotlib.colors.rgb2hex(HEAT_CMAP(0.0))),
+              (25, matplotlib.colors.rgb2hex(HEAT_CMAP(0.5))),
+              (100, matplotlib.colors.rgb2hex(HEAT_CMAP(1.0)))]
+CHUNK_ROWS = 5_000
+
+# ------------------------------
+# Layout del foglio
+# ------------------------------
+def percent_columns(df: pd.DataFrame) -> list:
+    """Posizioni delle colonne scostamento % (etichetta semplice o primo livello di una MultiIndex)."""
+    return [j for j, c in enumerate(df.columns) if (c[0] if isinstance(c, tuple) else c) in PERC_LABELS]
+
+def _runs(positions) -> list:
+    """[(inizio, fine)] dei tratti contigui di `positions` (ordinate)."""
+    runs = []
+    for p in positions:
+        if runs and runs[-1][1] == p - 1:
+            runs[-1][1] = p
+        else:
+            runs.append([p, p])
+    return [tuple(r) for r in runs]
+
+def _header_rows(df: pd.DataFrame, index: bool) -> list:
+    """Righe di intestazione: un livello colonne per riga; nomi indice sull'ultima, etichette ripetute lasciate vuote."""
+    n_idx = df.index.nlevels if index else 0
+    n_lev = df.columns.nlevels
+    cols = [c if isinstance(c, tuple) else (c,) for c in df.columns]
+    rows = []
+    for l in range(n_lev):
+        last = l == n_lev - 1
+        head = [("" if n is None or not last else str(n)) for n in df.index.names][:n_idx]
+        vals = [str(c[l]) if last or j == 0 or cols[j - 1][:l + 1] != c[:l + 1] else ""
+                for j, c in enumerate(cols)]
+        rows.append(head + vals)
+    return rows
+
+def _column_kind(dtype) -> str:
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "data"
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        return "ore"
+    return None
+
+def _column_kinds(df: pd.DataFrame, heat_cols) -> list:
+    """Tipo di ogni colonna dati: 'perc', 'ore' (numeriche), 'data' o None (testo)."""
+    heat = set(heat_cols)
+    return ["perc" if j in heat else _column_kind(df.dtypes.iloc[j]) for j in range(df.shape[1])]
+
+def _value_chunks(df: pd.DataFrame, index: bool):
+    """Blocchi di righe come matrici object (indice espanso in testa, NaN -> None = cella vuota)."""
+    for start in range(0, len(df), CHUNK_ROWS):
+        part = df.iloc[start:start + CHUNK_ROWS]
+        vals = part.to_numpy(dtype=object)
+        vals[pd.isna(part).to_numpy()] = None
+        if index:
+            idx = np.empty((len(part), part.index.nlevels), dtype=object)
+            idx[:] = [t if isinstance(t, tuple) else (t,) for t in part.index]
+            vals = np.hstack([idx, vals])
+        yield vals
+
+def _width(labels) -> int:
+    n = max((len(str(v)) for v in labels), default=8)
+    return min(max(n + 2, 8), 40)
+
+# ------------------------------
+# Writer
+# ------------------------------
+def _write_xlsxwriter(sheets: dict, percent_sheets, index: bool) -> bytes:
+    buf = BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+    fmt = {
+        "perc": wb.add_format({"num_format": FMT_PERCENT}),
+        "ore": wb.add_format({"num_format": FMT_HOURS}),
+        "data": wb.add_format({"num_format": FMT_DATE}),
+        None: None,
+    }
+    fmt_none = wb.add_format({"bg_color": "#000000", "font_color": "#000000"})
+    fmt_extra = wb.add_format({"bg_color": "#EE82EE", "font_color": "#FFFFFF", "num_format": '"Extrabudget"'})
+    for name, df in sheets.items():
+        ws = wb.add_worksheet(name[:31])
+        n_idx = df.index.nlevels if index else 0
+        n_head = df.columns.nlevels
+        heat = list(range(df.shape[1])) if name in percent_sheets else percent_columns(df)
+        kinds = [None] * n_idx + _column_kinds(df, heat)
+
+        for l in range(n_idx):
+            ws.set_column(l, l, _width(df.index.get_level_values(l)[:CHUNK_ROWS]))
+        for j, c in enumerate(df.columns):
+            ws.set_column(n_idx + j, n_idx + j, _width(c if isinstance(c, tuple) else [c]))
+        ws.freeze_panes(n_head, n_idx)
+
+        for r, row in enumerate(_header_rows(df, index)):
+            ws.write_row(r, 0, row)
+        # una write_row per tratto di colonne con lo stesso formato
+        segments = []
+        for j, k in enumerate(kinds):
+            if segments and segments[-1][2] == k:
+                segments[-1][1] = j + 1
+            else:
+                segments.append([j, j + 1, k])
+        r = n_head
+        for vals in _value_chunks(df, index):
+            for row in vals:
+                for c0, c1, k in segments:
+                    ws.write_row(r, c0, row[c0:c1], fmt[k])
+                r += 1
+
+        if heat and len(df):
+            first, last = n_head, n_head + len(df) - 1
+            ranges = " ".join(
+                xlsxwriter.utility.xl_range(first, n_idx + a, last, n_idx + b) for a, b in _runs(heat)
+            )
+            top = ranges.split(" ")[0]
+            ws.conditional_format(top, {"type": "blanks", "format": fmt_none, "stop_if_true": True, "multi_range": ranges})
+            ws.conditional_format(top, {"type": "cell", "criteria": "==", "value": EXTRABUDGET, "format": fmt_extra,
+                                        "stop_if_true": True, "multi_range": ranges})
+            (lo, c_lo), (mid, c_mid), (hi, c_hi) = HEAT_SCALE
+            ws.conditional_format(top, {"type": "3_color_scale", "multi_range": ranges,
+                                        "min_type": "num", "min_value": lo, "min_color": c_lo,
+                                        "mid_type": "num", "mid_value": mid, "mid_color": c_mid,
+                                        "max_type": "num", "max_value": hi, "max_color": c_hi})
+    wb.close()
+    return buf.getvalue()
+
+def _write_openpyxl(sheets: dict, percent_sheets, index: bool) -> bytes:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import CellIsRule, ColorScaleRule, FormulaRule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    for name, df in sheets.items():
+        ws = wb.create_sheet(name[:31])
+        n_idx = df.index.nlevels if index else 0
+        n_head = df.columns.nlevels
+        heat = list(range(df.shape[1])) if name in percent_sheets else percent_columns(df)
+        kinds = [None] * n_idx + _column_kinds(df, heat)
+        num_fmt = {"perc": FMT_PERCENT, "ore": FMT_HOURS, "data": FMT_DATE}
+        ws.freeze_panes = f"{get_column_letter(n_idx + 1)}{n_head + 1}"
+
+        for row in _header_rows(df, index):
+            ws.append(row)
+        for vals in _value_chunks(df, index):
+            for row in vals:
+                out = []
+                for v, k in zip(row, kinds):
+                    if k is None or v is None:
+                        out.append(v)
+                    else:
+                        cell = WriteOnlyCell(ws, value=v)
+                        cell.number_format = num_fmt[k]
+                        out.append(cell)
+                ws.append(out)
+
+        if heat and len(df):
+            first, last = n_head + 1, n_head + len(df)
+            (lo, c_lo), (mid, c_mid), (hi, c_hi) = HEAT_SCALE
+            for a, b in _runs(heat):
+                col_a, col_b = get_column_letter(n_idx + a + 1), get_column_letter(n_idx + b + 1)
+                ref = f"{col_a}{first}:{col_b}{last}"
+                ws.conditional_formatting.add(ref, FormulaRule(
+                    formula=[f"LEN(TRIM({col_a}{first}))=0"], stopIfTrue=True,
+                    fill=PatternFill("solid", bgColor="000000"), font=Font(color="000000")))
+                # senza xlsxwriter l'Extrabudget resta numerico (-9999), solo colorato
+                ws.conditional_formatting.add(ref, CellIsRule(
+                    operator="equal", formula=[str(EXTRABUDGET)], stopIfTrue=True,
+                    fill=PatternFill("solid", bgColor="EE82EE"), font=Font(color="FFFFFF")))
+                ws.conditional_formatting.add(ref, ColorScaleRule(
+                    start_type="num", start_value=lo, start_color=c_lo[1:],
+                    mid_type="num", mid_value=mid, mid_color=c_mid[1:],
+                    end_type="num", end_value=hi, end_color=c_hi[1:]))
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def write_xlsx(sheets: dict, percent_sheets=(), index: bool = True) -> bytes:
+    """Workbook multi-foglio {nome: DataFrame} in streaming.
+    Heatmap nativa sulle colonne scostamento % e su tutti i fogli in `percent_sheets`."""
+    if xlsxwriter is not None:
+        return _write_xlsxwriter(sheets, set(percent_sheets), index)
+    return _write_openpyxl(sheets, set(percent_sheets), index)
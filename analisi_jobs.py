@@ -0,0 +1,136 @@
+# Job di ingestione in background (senza UI)
+# - Pool di thread condiviso tra sessioni: lettura dei workbook, date, pivot e allineamento girano fuori
+#   dallo script Streamlit, che a ogni rerun legge solo stato e avanzamento dei job
+# - Un job per chiave (hash del contenuto): un rerun o un widget cambiato non ripartono da capo
+# - Più sessioni possono attendere lo stesso job (stesso file): ognuna è un iscritto, e annullare toglie solo
+#   la propria iscrizione; il job si ferma quando non resta nessuno ad attenderlo
+# - Annullamento cooperativo: il job si interrompe al primo avanzamento riportato dopo la richiesta
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IN_CODA, IN_CORSO, COMPLETATO, ERRORE, ANNULLATO = "in coda", "in corso", "completato", "errore", "annullato"
+
+class JobCancelled(Exception):
+    """Sollevata dentro il job quando è stato chiesto l'annullamento."""
+
+class Job:
+    """Stato di un job: avanzamento 0..1 con messaggio, risultato o errore. Letto dallo script, scritto dal worker."""
+
+    def __init__(self, key: str, label: str = ""):
+        self.key = key
+        self.label = label or key
+        self.status = IN_CODA
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = self.finished = None
+        self.subscribers = set()  # sessioni che attendono il risultato (JobPool.submit / cancel)
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (COMPLETATO, ERRORE, ANNULLATO)
+
+    @property
+    def cancelled(self) -> bool:
+        """Annullamento richiesto e nessun risultato: annullato o in via di interruzione al prossimo avanzamento."""
+        return self._cancel.is_set() and self.status != COMPLETATO
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def report(self, frac: float, message: str = ""):
+        """Callback di avanzamento passato al calcolo; solleva JobCancelled se l'annullamento è stato richiesto."""
+        if self._cancel.is_set():
+            raise JobCancelled(self.key)
+        self.progress = min(1.0, max(self.progress, float(frac)))
+        if message:
+            self.message = message
+
+    def cancel(self):
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():  # ancora in coda: non partirà mai
+            self.status, self.finished = ANNULLATO, time.time()
+
+    def wait(self, timeout: float = None):
+        """Attende la fine del job (per i chiamanti che non possono proseguire senza il risultato)."""
+        if self._future is not None and not self._future.cancelled():
+            try:
+                self._future.result(timeout)
+            except Exception:
+                pass  # lo stato del job riporta già l'esito
+
+    def _run(self, fn, args):
+        if self._cancel.is_set():
+            self.status, self.finished = ANNULLATO, time.time()
+            return
+        self.status, self.started = IN_CORSO, time.time()
+        try:
+            self.result = fn(*args, progress=self.report)
+            self.progress, self.status = 1.0, COMPLETATO
+        except JobCancelled:
+            self.status = ANNULLATO
+        except Exception as e:
+            self.error, self.status = e, ERRORE
+        finally:
+            self.finished = time.time()
+
+class JobPool:
+    """Pool di worker con registro dei job per chiave. fn(*args, progress=callback) gira in un thread del pool.
+    I job terminati restano nel registro finché lo script non li ritira (forget) o finché scadono (prune).
+    Un job annullato non blocca la chiave: il submit successivo ne accoda uno nuovo."""
+
+    def __init__(self, workers: int = 4, keep_s: float = 900):
+        self.keep_s = keep_s
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn, *args, label: str = "", subscriber: str = None) -> Job:
+        """Job per `key`: quello già registrato (in corso o terminato) oppure uno nuovo appena accodato
+        (anche al posto di un job annullato). `subscriber` (id di sessione) si iscrive al job."""
+        self.prune()
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.cancelled:
+                job = self._jobs[key] = Job(key, label)
+                job._future = self._executor.submit(job._run, fn, args)
+            if subscriber is not None:
+                job.subscribers.add(subscriber)
+        return job
+
+    def get(self, key: str):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def cancel(self, key: str, subscriber: str = None) -> bool:
+        """Toglie l'iscrizione di `subscriber` e annulla il job solo se nessun altro lo attende
+        (senza `subscriber` lo annulla comunque). True se il job è stato annullato."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.done:
+                return False
+            job.subscribers.discard(subscriber)
+            if subscriber is not None and job.subscribers:
+                return False
+            job.cancel()
+            return True
+
+    def forget(self, key: str):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def prune(self):
+        """Rimuove i job terminati da più di `keep_s` secondi (risultati mai ritirati, sessioni chiuse)."""
+        limite = time.time() - self.keep_s
+        with self._lock:
+            for key in [k for k, j in self._jobs.items() if j.done and (j.finished or 0) < limite]:
+                del self._jobs[key]
@@ -0,0 +1,136 @@
+# Profilazione per stadio (senza UI)
+# - Tempo, righe/celle prodotte e (opzionale) picco di memoria di ogni stadio della pipeline
+# - Export JSON e Chrome trace (chrome://tracing, Perfetto) per diagnosticare i rerun lenti senza un profiler esterno
+
+import json
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+def output_size(obj) -> dict:
+    """Righe/celle di un DataFrame, Styler o dict di frame (righe = massimo, celle = somma); byte per i file."""
+    frames = obj.values() if isinstance(obj, dict) else [obj]
+    rows = cells = nbytes = 0
+    for f in frames:
+        f = getattr(f, "data", f) if not isinstance(f, (pd.DataFrame, pd.Series)) else f  # Styler -> DataFrame
+        if isinstance(f, (pd.DataFrame, pd.Series)):
+            rows = max(rows, len(f))
+            cells += f.size
+        elif isinstance(f, (bytes, bytearray)):
+            nbytes += len(f)
+    out = {"rows": rows, "cells": int(cells)}
+    if nbytes:
+        out["bytes"] = nbytes
+    return out
+
+# tracemalloc è globale al processo (sessioni e thread): conteggio dei profiler che lo usano,
+# lo si ferma solo quando esce l'ultimo e solo se è stato avviato da qui
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+def _acquire_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+
+def _release_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+class StageProfiler:
+    """Registro degli stadi di un'esecuzione. Con `memory` usa tracemalloc (globale al processo, rallenta):
+    il picco è misurato per stadio, quindi gli stadi non vanno annidati. Il tracing resta attivo finché
+    almeno un profiler con `memory` è aperto (close, o raccolta del profiler se lo script si interrompe)."""
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.records = []
+        self.started = datetime.now()
+        self._t0 = time.perf_counter()
+        self._release = None
+        if memory:
+            _acquire_tracing()
+            self._release = weakref.finalize(self, _release_tracing)
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        """Cronometra il blocco; il dict restituito può essere arricchito (es. cache, righe/celle)."""
+        rec = {"stage": name, **info}
+        tracing = self.memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec["start_s"] = round(t - self._t0, 6)
+            rec["dur_s"] = round(time.perf_counter() - t, 6)
+            if tracing:
+                rec["peak_mb"] = round((tracemalloc.get_traced_memory()[1] - base) / 2**20, 3)
+            self.records.append(rec)
+
+    def track(self, name: str, fn, **info):
+        """Esegue fn() come stadio `name`, registrando anche righe/celle del risultato."""
+        with self.stage(name, **info) as rec:
+            out = fn()
+            rec.update(output_size(out))
+        return out
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def close(self):
+        if self._release is not None:
+            self._release()  # una sola volta anche se chiamato di nuovo
+
+    def run_record(self, **info) -> dict:
+        """Riepilogo dell'esecuzione (per storico ed export)."""
+        return {"started": self.started.isoformat(timespec="seconds"), "total_s": round(self.elapsed(), 6),
+                "memory": self.memory, **info, "stages": list(self.records)}
+
+# ------------------------------
+# Export
+# ------------------------------
+def runs_json(runs: list) -> str:
+    return json.dumps({"runs": runs}, indent=2, default=str)
+
+def runs_chrome_trace(runs: list) -> str:
+    """Formato Trace Event: un thread per esecuzione, uno slice 'X' per stadio (ts/dur in µs)."""
+    events = []
+    for tid, run in enumerate(runs, start=1):
+        label = f"rerun {tid} · {run.get('started', '')}"
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": label}})
+        events.append({"name": "rerun", "cat": "run", "ph": "X", "pid": 1, "tid": tid, "ts": 0,
+                       "dur": int(run["total_s"] * 1e6), "args": {k: v for k, v in run.items() if k != "stages"}})
+        for rec in run["stages"]:
+            events.append({
+                "name": rec["stage"], "cat": rec.get("cache") or "stage", "ph": "X", "pid": 1, "tid": tid,
+                "ts": int(rec["start_s"] * 1e6), "dur": max(1, int(rec["dur_s"] * 1e6)),
+                "args": {k: v for k, v in rec.items() if k not in ("stage", "start_s", "dur_s")},
+            })
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str)
+
+def records_frame(records: list) -> pd.DataFrame:
+    """Tabella leggibile degli stadi (ms, righe, celle, picco MB, cache)."""
+    df = pd.DataFrame(records)
+    if df.empty:
+        return df
+    df["ms"] = (df["dur_s"] * 1000).round(1)
+    if "cache" in df.columns:
+        df["cache"] = df["cache"].fillna("")
+    cols = [c for c in ("stage", "cache", "ms", "rows", "cells", "peak_mb") if c in df.columns]
+    return df[cols].rename(columns={"stage": "Stadio", "cache": "Cache", "rows": "Righe", "cells": "Celle", "peak_mb": "Picco MB"})
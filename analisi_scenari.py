@@ -0,0 +1,127 @@
+# Scenari what-if sul Budget (senza UI)
+# - Ogni scenario moltiplica coeff / budget_mensile / xselling (di tutti i clienti o di una categoria)
+# - Ore slot di tutti gli scenari in un solo calcolo vettoriale scenario x cliente x mese, confrontate
+#   con l'Effettivo già allineato: totali e scostamenti affiancati, senza rieseguire la pipeline
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from analisi_engine import period_axis, variance_kernel, summary_percent, fmt_hours, PERC_COLS, SUMMARY_FMT
+from analisi_budget_store import WIDE_SUFFIX
+
+SCENARIO_COLUMNS = ["scenario", "categoria", "coeff", "budget_mensile", "xselling"]
+MULTIPLIERS = ["coeff", "budget_mensile", "xselling"]
+MAX_CELLS = 4_000_000  # celle scenario x cliente x mese per blocco (memoria limitata anche con decine di scenari)
+SCENARIO_FMT = {
+    **SUMMARY_FMT,
+    "Δ Ore a Budget": fmt_hours,
+    "× coeff": "{:g}",
+    "× budget": "{:g}",
+    "× xselling": "{:g}",
+}
+
+def parse_multipliers(text: str) -> list:
+    """'0.9, 1, 1.1' -> [0.9, 1.0, 1.1]; con ';' come separatore è ammessa la virgola decimale ('0,9; 1; 1,1')."""
+    if ";" in text:
+        parts = [p.replace(",", ".") for p in text.split(";")]
+    else:
+        parts = re.split(r"[,\s]+", text)
+    try:
+        values = [float(p) for p in (p.strip() for p in parts) if p]
+    except ValueError:
+        raise ValueError(f"Moltiplicatori non validi: '{text}' (es. 0.9, 1, 1.1)")
+    if any(v <= 0 for v in values):
+        raise ValueError("I moltiplicatori devono essere positivi.")
+    return values
+
+def scenario_grid(coeff_mults, budget_mults) -> pd.DataFrame:
+    """Prodotto cartesiano coeff x budget (xselling segue il budget), su tutti i clienti."""
+    grid = pd.MultiIndex.from_product([list(coeff_mults), list(budget_mults)], names=["coeff", "budget_mensile"]).to_frame(index=False)
+    grid["xselling"] = grid["budget_mensile"]
+    grid["categoria"] = ""
+    grid["scenario"] = [f"coeff ×{c:g} · budget ×{b:g}" for c, b in zip(grid["coeff"], grid["budget_mensile"])]
+    return grid[SCENARIO_COLUMNS]
+
+def clean_scenarios(scenari: pd.DataFrame) -> pd.DataFrame:
+    """Scenari validi: moltiplicatori mancanti = 1, nome di default, categoria normalizzata (vuota = tutti)."""
+    df = scenari.reindex(columns=SCENARIO_COLUMNS).copy()
+    for c in MULTIPLIERS:
+        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(1.0)
+    if (df[MULTIPLIERS] <= 0).any().any():
+        raise ValueError("I moltiplicatori degli scenari devono essere positivi.")
+    df["categoria"] = df["categoria"].fillna("").astype(str).str.strip().str.title()
+    nomi = df["scenario"].fillna("").astype(str).str.strip()
+    df["scenario"] = nomi.where(nomi != "", [f"Scenario {i + 1}" for i in range(len(df))])
+    return df.drop_duplicates("scenario", keep="last").reset_index(drop=True)
+
+def budget_components(df_budget: pd.DataFrame, clients, mesi) -> dict:
+    """Matrici clienti x mesi di coeff, budget_mensile, xselling dal Budget largo preparato (NaN se assenti)."""
+    out = {}
+    for field in MULTIPLIERS:
+        cols = [f"{m}{WIDE_SUFFIX[field]}" for m in mesi]
+        out[field] = df_budget.reindex(index=clients, columns=cols).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    return out
+
+def evaluate_scenarios(df_budget: pd.DataFrame, budget_fine: pd.DataFrame, eff_fine: pd.DataFrame,
+                       scenari: pd.DataFrame, cat_map: pd.Series) -> pd.DataFrame:
+    """Totali e scostamenti per scenario (una riga per scenario, più 'Attuale').
+    budget_fine / eff_fine: ore allineate clienti x 'YYYY-MM (1-fine)' (come nel cubo).
+    Ore scenario = (budget × m_b + xselling × m_x) / (coeff × m_c), arrotondate come le ore slot;
+    dove il Budget non ha le componenti (solo colonne ore) le ore attuali sono scalate per m_b / m_c."""
+    scenari = clean_scenarios(scenari)
+    clients = eff_fine.index
+    ax = period_axis(eff_fine.columns)
+    mesi = [f"{y}-{m:02d}" for y, m in zip(ax["anno"], ax["mese"])]
+    comp = budget_components(df_budget, clients, mesi)
+    base = budget_fine.to_numpy(dtype=float)
+    eff = eff_fine.to_numpy(dtype=float)[None]
+    has_comp = (comp["coeff"] > 0) & ~np.isnan(comp["budget_mensile"])
+    coeff = np.where(has_comp, comp["coeff"], 1.0)[None]
+    budget = np.nan_to_num(comp["budget_mensile"])[None]
+    xsell = np.nan_to_num(comp["xselling"])[None]
+
+    # moltiplicatori per scenario e cliente: la categoria limita lo scenario ai suoi clienti
+    cat = cat_map.reindex(clients).fillna("").to_numpy()
+    scope = (scenari["categoria"].to_numpy()[:, None] == "") | (scenari["categoria"].to_numpy()[:, None] == cat[None, :])
+    mult = {c: np.where(scope, scenari[c].to_numpy()[:, None], 1.0)[:, :, None] for c in MULTIPLIERS}
+
+    n_s = len(scenari)
+    tot = {k: np.zeros(n_s) for k in ("budget", "eff_in", "eff_extra")}
+    clienti_extra = np.zeros(n_s, dtype=np.int64)
+    clienti_sopra = np.zeros(n_s, dtype=np.int64)
+    step = max(1, MAX_CELLS // max(1, base.size))
+    for a in range(0, n_s, step):
+        sl = slice(a, a + step)
+        hours = np.where(
+            has_comp[None],
+            (budget * mult["budget_mensile"][sl] + xsell * mult["xselling"][sl]) / (coeff * mult["coeff"][sl]),
+            base[None] * mult["budget_mensile"][sl] / mult["coeff"][sl],
+        ).round(2)
+        var = variance_kernel(hours, np.broadcast_to(eff, hours.shape))
+        tot["budget"][sl] = hours.sum(axis=(1, 2))
+        tot["eff_in"][sl] = var["eff_in"].sum(axis=(1, 2))
+        tot["eff_extra"][sl] = var["eff_extra"].sum(axis=(1, 2))
+        clienti_extra[sl] = (var["eff_extra"].sum(axis=2) > 0).sum(axis=1)
+        clienti_sopra[sl] = (eff.sum(axis=2) > hours.sum(axis=2)).sum(axis=1)
+
+    # riga di riferimento: il Budget attuale così com'è (anche con ore modificate a mano)
+    var0 = variance_kernel(base, eff[0])
+    names = ["Attuale"] + list(scenari["scenario"])
+    be = np.round(np.concatenate([[base.sum()], tot["budget"]]), 2)
+    ee_in = np.round(np.concatenate([[var0["eff_in"].sum()], tot["eff_in"]]), 2)
+    ee_extra = np.round(np.concatenate([[var0["eff_extra"].sum()], tot["eff_extra"]]), 2)
+    out = pd.DataFrame({
+        "Ore a Budget": be,
+        "Δ Ore a Budget": np.round(be - be[0], 2),
+        "Ore Effettive (senza Extrabudget)": ee_in,
+        "Ore Extrabudget": ee_extra,
+        PERC_COLS[0]: summary_percent(be, ee_in, extrabudget=False),
+        PERC_COLS[1]: summary_percent(be, np.round(ee_in + ee_extra, 2)),
+        "Clienti con Extrabudget": np.concatenate([[(var0["eff_extra"].sum(axis=1) > 0).sum()], clienti_extra]),
+        "Clienti sopra Budget": np.concatenate([[(eff[0].sum(axis=1) > base.sum(axis=1)).sum()], clienti_sopra]),
+    }, index=pd.Index(names, name="Scenario"))
+    mults = pd.concat([pd.DataFrame([{"categoria": "", **{c: 1.0 for c in MULTIPLIERS}}]), scenari[["categoria"] + MULTIPLIERS]], ignore_index=True)
+    mults.index = out.index
+    return pd.concat([mults.rename(columns={"categoria": "Categoria", "coeff": "× coeff", "budget_mensile": "× budget", "xselling": "× xselling"}), out], axis=1)
@@ -0,0 +1,197 @@
+# Confronto tra caricamenti successivi dell'Effettivo (senza UI)
+# - Impronta delle righe come in analisi_effettivo_merge: hash di (data, cliente, ore + colonne chiave) con la
+#   molteplicità, più l'hash dell'identità (data, cliente + colonne chiave) per riconoscere le righe modificate
+# - Righe aggiunte, rimosse e modificate dal confronto delle molteplicità; Δ ore cliente x periodo dalla
+#   differenza dei due pivot. Niente aggiornamento incrementale degli aggregati dal Δ: il costo di un caricamento
+#   è la lettura del workbook (decine di secondi su 200k righe), il pivot completo sulle righe lette è trascurabile
+# - Lo snapshot di riferimento è per utente (o sessione): ogni salvataggio è una versione nuova resa visibile
+#   dal replace atomico di un puntatore, così un load() concorrente non legge mai file di versioni diverse
+# - Report "cosa è cambiato": celle cliente x periodo il cui scostamento si è mosso
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analisi_engine import parse_effettivo, merge_pivots, variance_kernel, report_progress
+
+CHANGE_COLUMNS = ["Cliente", "Periodo", "Budget", "Ore prima", "Ore ora", "Δ Ore", "Scostamento % prima", "Scostamento % ora"]
+
+def _key_column(col: pd.Series) -> pd.Categorical:
+    """Colonna chiave come testo ripulito ('' per i vuoti), calcolato sui soli valori distinti.
+    Stesso hash di hash_pandas_object sulla colonna testo: i Categorical si hashano per valore."""
+    codes, valori = pd.factorize(col)
+    testo = np.append(pd.Index(valori).astype(str).str.strip().to_numpy(dtype=object), "")
+    codici, categorie = pd.factorize(testo)
+    return pd.Categorical.from_codes(codici[codes], categorie)  # codes -1 (vuoti) -> ultimo valore, ''
+
+def row_fingerprint(df_eff: pd.DataFrame, chiavi=()) -> pd.DataFrame:
+    """Impronta delle righe con cliente e data validi: indice 'hash' = hash di (data, cliente, ore + `chiavi`),
+    colonne "identita" (hash di data, cliente + `chiavi`) e "n" (molteplicità). Le righe uguali non hanno un
+    ordine: eliminarne una non sposta l'identità delle altre. Le colonne chiave assenti valgono ''."""
+    ok = (df_eff["cliente"].notna() & df_eff["data"].notna()).to_numpy()
+    key = pd.DataFrame({
+        "data": df_eff["data"][ok].dt.normalize().to_numpy(),
+        "cliente": df_eff["cliente"][ok].astype(str).to_numpy(),
+    })
+    for c in chiavi:
+        key[c] = _key_column(df_eff[c][ok]) if c in df_eff.columns else ""
+    identita = pd.util.hash_pandas_object(key, index=False).to_numpy()
+    ore = pd.to_numeric(df_eff["ore"][ok], errors="coerce").fillna(0.0).astype(float).round(4)
+    # hash della riga = combinazione dell'identità con le ore: si evita di ripassare sulle colonne testo
+    riga = identita ^ pd.util.hash_array(ore.to_numpy() + 0.0)
+    fp = pd.DataFrame({"identita": identita}, index=pd.Index(riga, name="hash"))
+    n = fp.groupby(level=0, sort=False).size()
+    fp = fp[~fp.index.duplicated()]
+    fp["n"] = n.reindex(fp.index).to_numpy()
+    return fp
+
+def diff_fingerprints(old: pd.DataFrame, new: pd.DataFrame) -> dict:
+    """Righe aggiunte / rimosse / modificate tra due impronte. Per ogni hash conta la differenza di molteplicità;
+    una riga rimossa e una aggiunta con la stessa identità (stesso cliente, giorno e chiavi, ore diverse)
+    sono una riga modificata."""
+    n = pd.concat([new["n"], -old["n"]]).groupby(level=0, sort=False).sum()
+    n = n[n != 0]
+    identita = pd.concat([new["identita"], old["identita"]])
+    identita = identita[~identita.index.duplicated()].reindex(n.index)
+    per_id = pd.DataFrame({"piu": n.clip(lower=0), "meno": (-n).clip(lower=0)}).groupby(identita.to_numpy()).sum()
+    modificate = int(np.minimum(per_id["piu"], per_id["meno"]).sum())
+    return {
+        "aggiunte": int(per_id["piu"].sum()) - modificate,
+        "rimosse": int(per_id["meno"].sum()) - modificate,
+        "modificate": modificate,
+    }
+
+def pivot_delta(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Δ ore cliente x periodo (new - old, 0 dove assenti), ristretta alle righe e colonne con almeno una differenza."""
+    delta = merge_pivots([new, -old]).round(6) if len(old) else new
+    cambiate = delta.to_numpy() != 0
+    return delta.loc[cambiate.any(axis=1), cambiate.any(axis=0)]
+
+def parse_effettivo_snapshot(source, chiavi=(), progress=None) -> dict:
+    """parse_effettivo + "impronta" delle righe (row_fingerprint con `chiavi`): dipende solo dal file,
+    quindi va in cache come il resto; il confronto con lo snapshot è compare_snapshot."""
+    out = parse_effettivo(source, progress)
+    report_progress(progress, 0.95, "Impronta delle righe")
+    out["impronta"] = row_fingerprint(out["rows"], chiavi)
+    return out
+
+class SnapshotStore:
+    """Ultimo caricamento (impronta + pivot in Parquet, metadati in JSON) nella cartella `root`, una per utente.
+    Ogni save() scrive una versione completa in una sottocartella nuova e poi sostituisce atomicamente il
+    puntatore CORRENTE: load() legge sempre una versione intera. Restano l'ultima versione e la precedente."""
+
+    FRAMES = ("impronta", "pivot")
+    POINTER = "CORRENTE"
+    _lock = threading.Lock()  # un salvataggio alla volta nel processo (le sessioni Streamlit sono thread)
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _current(self):
+        try:
+            with open(os.path.join(self.root, self.POINTER), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def load(self):
+        """{"meta", "impronta", "pivot"} o None se assente/illeggibile. Se la versione puntata viene rimossa
+        durante la lettura (due salvataggi nel frattempo) si riprova con il puntatore aggiornato."""
+        for _ in range(3):
+            versione = self._current()
+            if versione is None:
+                return None
+            base = os.path.join(self.root, versione)
+            try:
+                with open(os.path.join(base, "meta.json"), encoding="utf-8") as f:
+                    out = {"meta": json.load(f)}
+                for name in self.FRAMES:
+                    out[name] = pd.read_parquet(os.path.join(base, f"{name}.parquet"))
+                return out
+            except Exception:
+                continue
+        return None
+
+    def save(self, frames: dict, meta: dict):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            precedente = self._current()
+            base = tempfile.mkdtemp(prefix="v-", dir=self.root)
+            for name in self.FRAMES:
+                frames[name].to_parquet(os.path.join(base, f"{name}.parquet"))
+            with open(os.path.join(base, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            tmp = os.path.join(self.root, self.POINTER + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(os.path.basename(base))
+            os.replace(tmp, os.path.join(self.root, self.POINTER))
+            for nome in os.listdir(self.root):
+                if nome.startswith("v-") and nome not in (os.path.basename(base), precedente):
+                    shutil.rmtree(os.path.join(self.root, nome), ignore_errors=True)
+
+def prune_snapshots(root: str, max_age_s: float):
+    """Rimuove le cartelle snapshot in `root` non salvate da più di `max_age_s` secondi (sessioni chiuse)."""
+    if not os.path.isdir(root):
+        return
+    limite = time.time() - max_age_s
+    for nome in os.listdir(root):
+        path = os.path.join(root, nome)
+        if os.path.isdir(path) and os.path.getmtime(path) < limite:
+            shutil.rmtree(path, ignore_errors=True)
+
+def compare_snapshot(store: SnapshotStore, frames: dict, chiavi=()):
+    """Confronta l'Effettivo appena letto (frame di parse_effettivo_snapshot) con lo snapshot in `store` e ne
+    fa il nuovo riferimento. Restituisce {"modifiche": riepilogo a una riga, "delta": Δ ore cliente x periodo},
+    o None senza uno snapshot confrontabile (assente o con altre colonne chiave).
+    Se non è cambiata nessuna riga lo snapshot non viene riscritto."""
+    fp, pivot = frames["impronta"], frames["pivot"]
+    prev = store.load()
+    out = None
+    if prev is not None and prev["meta"].get("chiavi") == list(chiavi):
+        diff = diff_fingerprints(prev["impronta"], fp)
+        out = {
+            "modifiche": pd.DataFrame([{
+                "precedente": prev["meta"].get("salvato", ""), "righe_precedenti": int(prev["impronta"]["n"].sum()),
+                "righe": int(fp["n"].sum()), **diff,
+            }]),
+            "delta": pivot_delta(prev["pivot"], pivot),
+        }
+        if not (diff["aggiunte"] or diff["rimosse"] or diff["modificate"]):
+            return out
+    store.save({"impronta": fp, "pivot": pivot},
+               {"chiavi": list(chiavi), "salvato": datetime.now().isoformat(timespec="seconds")})
+    return out
+
+def what_changed(delta: pd.DataFrame, cube) -> pd.DataFrame:
+    """Celle cliente x periodo del cubo con ore cambiate: ore e scostamento % prima e dopo (stesso Budget),
+    ordinate per |Δ Ore|."""
+    if delta.empty:
+        return pd.DataFrame(columns=CHANGE_COLUMNS)
+    clienti = delta.index.intersection(cube.clients)
+    cols = [c for c in delta.columns if c in set(cube.columns)]
+    if not len(clienti) or not cols:
+        return pd.DataFrame(columns=CHANGE_COLUMNS)
+    rows, pos = cube.locate(clienti, cols)
+    eff = cube.frame("eff", rows, pos).to_numpy()
+    budget = cube.frame("budget", rows, pos).to_numpy()
+    d = delta.reindex(index=clienti, columns=cols).fillna(0.0).to_numpy().round(2)
+    prima = (eff - d).round(2)
+    r, c = np.nonzero(d)
+    out = pd.DataFrame({
+        "Cliente": clienti[r],
+        "Periodo": np.asarray(cols)[c],
+        "Budget": budget[r, c],
+        "Ore prima": prima[r, c],
+        "Ore ora": eff[r, c],
+        "Δ Ore": d[r, c],
+        "Scostamento % prima": variance_kernel(budget, prima)["perc"][r, c],
+        "Scostamento % ora": variance_kernel(budget, eff)["perc"][r, c],
+    })
+    return out.iloc[np.argsort(-np.abs(out["Δ Ore"].to_numpy()), kind="stable")].reset_index(drop=True)
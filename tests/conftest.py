@@ -0,0 +1,36 @@
+# Fixture comuni: Budget ed Effettivo sintetici dal generatore del benchmark (piccoli, deterministici)
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analisi_bench import generate_budget, generate_effettivo  # noqa: E402
+from analisi_engine import add_periods, align, pivot_effettivo, prepare_budget  # noqa: E402
+
+CLIENTI, MESI, RIGHE = 40, 8, 4000
+
+@pytest.fixture(scope="session")
+def budget_wide():
+    """Budget largo come dal Budget Editor (circa il 15% dei mesi cliente a budget zero)."""
+    return generate_budget(CLIENTI, MESI)
+
+@pytest.fixture(scope="session")
+def eff_raw():
+    """Righe timesheet come nel foglio 'Effettivo' (intestazioni già in minuscolo)."""
+    df = generate_effettivo(CLIENTI, MESI, RIGHE)
+    df.columns = df.columns.str.lower()
+    return df
+
+@pytest.fixture
+def eff_rows(eff_raw):
+    """Righe con data normalizzata e colonne mese/giorno (copia: add_periods lavora in place)."""
+    return add_periods(eff_raw.copy())
+
+@pytest.fixture(scope="session")
+def aligned(budget_wide, eff_raw):
+    """Output di align (eff, budget, colonne, clienti, cube) sul Budget e sull'Effettivo sintetici."""
+    df_budget = prepare_budget(budget_wide)
+    return align(df_budget, pivot_effettivo(add_periods(eff_raw.copy())))
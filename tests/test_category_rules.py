@@ -0,0 +1,64 @@
+# Regole di categoria: precedenza tabella → prefisso più lungo → regex in ordine, pulizia e persistenza
+
+import pandas as pd
+import pytest
+
+from analisi_budget_db import BudgetDB
+from analisi_category_rules import assign_categories, clean_rules, merge_rules
+
+def regole(*righe) -> pd.DataFrame:
+    return pd.DataFrame(righe, columns=["tipo", "modello", "categoria"])
+
+def test_precedence_table_prefix_regex():
+    rules = regole(
+        ("regex", "spa$", "Altro"),
+        ("prefisso", "acme", "Progetto"),
+        ("prefisso", "acme int", "Interno"),
+        ("tabella", "acme interna srl", "Ricorrente"),
+        ("regex", "^beta", "Progetto"),
+        ("regex", "beta", "Interno"),
+    )
+    got = assign_categories(["ACME Interna SRL", "Acme Internazionale", "Acme Spa", "Beta Spa", "Beta Uno", "Gamma"], rules)
+    assert got.to_dict() == {
+        "ACME Interna SRL": "Ricorrente",  # la tabella vince sul prefisso
+        "Acme Internazionale": "Interno",  # il prefisso più lungo vince
+        "Acme Spa": "Progetto",  # coperto dal prefisso: la regex 'spa$' non lo riguarda
+        "Beta Spa": "Altro",  # prima regex nell'ordine salvato
+        "Beta Uno": "Progetto",
+        "Gamma": "",
+    }
+
+def test_regex_only_on_unmatched_clients():
+    rules = regole(("tabella", "alfa", "Interno"), ("regex", ".*", "Altro"))
+    got = assign_categories(["Alfa", "Beta"], rules)
+    assert list(got) == ["Interno", "Altro"]
+
+def test_case_and_space_folding():
+    rules = regole(("tabella", "  acme SPA ", "progetto"), ("prefisso", "BETA ", "interno"))
+    got = assign_categories([" Acme spa", "ACME SPA  ", "beta srl"], rules)
+    assert list(got) == ["Progetto", "Progetto", "Interno"]
+
+def test_clean_rules_drops_incomplete_and_keeps_last_duplicate():
+    rules = clean_rules(regole(
+        ("Tabella", "Acme", "progetto"), ("tabella", "", "Altro"), ("prefisso", "b", None),
+        ("tabella", " ACME ", "interno"),
+    ))
+    assert rules.to_dict("records") == [{"tipo": "tabella", "modello": "ACME", "categoria": "Interno"}]
+    with pytest.raises(ValueError):
+        clean_rules(regole(("jolly", "a", "Altro")))
+    with pytest.raises(ValueError):
+        clean_rules(regole(("regex", "([", "Altro")))
+
+def test_merge_rules_replaces_same_type_and_model():
+    merged = merge_rules(regole(("tabella", "a", "Altro"), ("prefisso", "a", "Altro")), regole(("tabella", "A", "Interno")))
+    assert sorted(map(tuple, merged.to_numpy())) == [("prefisso", "a", "Altro"), ("tabella", "A", "Interno")]
+
+def test_budget_db_rules_round_trip(tmp_path):
+    db = BudgetDB(str(tmp_path / "budget.sqlite"))
+    rules = regole(("regex", "^z", "Altro"), ("tabella", "Acme", "Progetto"), ("regex", "^a", "Interno"))
+    assert db.save_category_rules(rules) == 3
+    pd.testing.assert_frame_equal(db.category_rules(), clean_rules(rules))  # stesso ordine di applicazione
+    db.add_category_rules(regole(("tabella", "acme", "Ricorrente")))
+    saved = db.category_rules()
+    assert len(saved) == 3 and saved.loc[saved["tipo"] == "tabella", "categoria"].item() == "Ricorrente"
+    assert list(assign_categories(["acme", "zeta"], saved)) == ["Ricorrente", "Altro"]
@@ -0,0 +1,64 @@
+# Grafici di andamento: PNG dagli aggregati e riduzione delle serie ai clienti principali + 'Altri'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analisi_charts
+from analisi_charts import budget_vs_effettivo_chart, category_chart, cumulative_burn_chart, top_series
+from analisi_engine import category_map, cols_of_half, monthly_table, period_rollup, prepare_budget, rollup_totals, variance_frames
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+@pytest.fixture
+def fine(aligned):
+    cols = cols_of_half(aligned["budget"].columns, "1-fine")
+    return aligned["budget"][cols], aligned["eff"][cols]
+
+@pytest.fixture
+def legend(monkeypatch):
+    """Etichette della legenda dell'ultimo grafico disegnato (il PNG resta il valore restituito)."""
+    etichette = []
+    disegna = analisi_charts._png
+
+    def _png(fig):
+        etichette[:] = fig.axes[0].get_legend_handles_labels()[1]
+        return disegna(fig)
+    monkeypatch.setattr(analisi_charts, "_png", _png)
+    return etichette
+
+def test_each_view_returns_png(aligned, budget_wide, fine):
+    budget, eff = aligned["budget"], aligned["eff"]
+    var = variance_frames(budget, eff)
+    mensile = monthly_table(budget, var["eff_in"], var["eff_extra"])
+    trimestrale = period_rollup(budget, var["eff_in"], var["eff_extra"], cols_of_half(budget.columns, "1-fine"), "trimestre")
+    viste = [
+        budget_vs_effettivo_chart(mensile, "mese"),
+        budget_vs_effettivo_chart(rollup_totals(trimestrale), "trimestre"),
+        cumulative_burn_chart(*fine),
+        category_chart(*fine, category_map(prepare_budget(budget_wide))),
+    ]
+    for png in viste:
+        assert isinstance(png, bytes) and png.startswith(PNG)
+
+def test_burn_chart_folds_the_rest_into_altri(fine, legend):
+    budget, eff = fine
+    con_budget = int((budget.sum(axis=1) > 0).sum())
+    cumulative_burn_chart(budget, eff, max_series=5)
+    clienti = [e for e in legend if e != "Consumo lineare"]
+    assert len(clienti) == 6 and clienti[-1] == f"Altri ({con_budget - 5})"
+    # i 5 clienti disegnati sono quelli con più Budget nel periodo
+    attesi = budget.sum(axis=1).sort_values(ascending=False, kind="stable").index[:5]
+    assert clienti[:5] == [str(c) for c in attesi]
+
+def test_burn_chart_without_folding(fine, legend):
+    budget, eff = fine
+    cumulative_burn_chart(budget.iloc[:3], eff.iloc[:3], max_series=5)
+    assert not any(e.startswith("Altri") for e in legend)
+
+def test_top_series_sums_the_rest():
+    m = pd.DataFrame(np.arange(12.0).reshape(4, 3), index=list("abcd"))
+    got = top_series(m, pd.Series({"a": 1.0, "b": 5.0, "c": 3.0, "d": 0.0}), max_series=2)
+    assert list(got.index) == ["b", "c", "Altri (2)"]
+    np.testing.assert_allclose(got.loc["Altri (2)"], m.loc[["a", "d"]].sum())
+    assert top_series(m, pd.Series(dtype=float), max_series=4) is m
@@ -0,0 +1,219 @@
+# Kernel vettoriali del motore confrontati con i loop per cella / per cliente dell'app originale
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from analisi_engine import (
+    EXTRABUDGET, PERC_COLS, CubeSlice, IngestCache, cols_of_half, fmt_percent_numeric, heatmap_html, monthly_table,
+    order_clients, page_window, percent_css, percent_labels, period_rollup, rollup_totals,
+    variance_frames, variance_kernel, dashboard_table, category_map, prepare_budget,
+)
+
+# ------------------------------
+# Implementazioni di riferimento (loop dell'app originale)
+# ------------------------------
+def baseline_percent(budget: pd.DataFrame, eff: pd.DataFrame) -> pd.DataFrame:
+    out = pd.DataFrame(index=eff.index, columns=eff.columns, dtype=float)
+    for col in eff.columns:
+        num = budget[col].astype(float) - eff[col].astype(float)
+        den = budget[col].astype(float)
+        perc = np.zeros_like(num, dtype=float)
+        np.divide(num, den, out=perc, where=den != 0)
+        perc = pd.Series(np.round(perc * 100, 1), index=eff.index)
+        perc.loc[(den == 0) & (eff[col] == 0)] = np.nan
+        perc.loc[(den == 0) & (eff[col] > 0)] = -9999
+        out[col] = perc.astype(float)
+    return out
+
+def baseline_css(v) -> str:
+    if pd.isna(v):
+        return "background-color: black; color: black;"
+    if v == -9999:
+        return "background-color: violet; color: white;"
+    norm = max(0.0, min(1.0, (float(v) + 50) / 150))
+    return f"background-color: {matplotlib.colors.rgb2hex(matplotlib.colormaps['RdYlGn'](norm))}"
+
+def baseline_summary(be, ee_in, ee_extra) -> dict:
+    be, ee_in, ee_extra = round(be, 2), round(ee_in, 2), round(ee_extra, 2)
+    ee_tot = round(ee_in + ee_extra, 2)
+    if be > 0:
+        s_in, s_tot = round((be - ee_in) / be * 100, 1), round((be - ee_tot) / be * 100, 1)
+    else:
+        s_in, s_tot = np.nan, (-9999 if ee_tot > 0 else np.nan)
+    return {"Ore a Budget": be, "Ore Effettive (senza Extrabudget)": ee_in, "Ore Extrabudget": ee_extra,
+            PERC_COLS[0]: s_in, PERC_COLS[1]: s_tot}
+
+def baseline_quarters(budget_f: pd.DataFrame, eff_f: pd.DataFrame) -> pd.DataFrame:
+    by_quarter = {}
+    for c in cols_of_half(budget_f.columns, "1-fine"):
+        y, m = int(c[:4]), int(c[5:7])
+        by_quarter.setdefault((y, (m - 1) // 3 + 1), []).append(c)
+    rows = []
+    for (y, q), cols in sorted(by_quarter.items()):
+        bq, eq = budget_f[cols], eff_f[cols]
+        extra = (bq == 0) & (eq > 0)
+        for cliente in bq.index:
+            rows.append({"Cliente": cliente, "Anno-Trimestre": f"{y}-Q{q}", **baseline_summary(
+                float(bq.loc[cliente].sum()),
+                float(eq.loc[cliente].where(~extra.loc[cliente], 0).sum()),
+                float(eq.loc[cliente].where(extra.loc[cliente], 0).sum()),
+            )})
+    return pd.DataFrame(rows).set_index(["Cliente", "Anno-Trimestre"])
+
+def random_pair(seed: int = 0, shape=(60, 24)):
+    """Budget/Effettivo a 2 decimali con zeri in entrambi (None ed Extrabudget presenti)."""
+    rng = np.random.default_rng(seed)
+    cols = [f"2024-{m:02d} ({h})" for m in range(1, 13) for h in ("1-15", "1-fine")][: shape[1]]
+    idx = [f"C{i:03d}" for i in range(shape[0])]
+    b = rng.gamma(2.0, 20.0, shape).round(2)
+    e = rng.gamma(2.0, 20.0, shape).round(2)
+    b[rng.random(shape) < 0.2] = 0.0
+    e[rng.random(shape) < 0.2] = 0.0
+    return pd.DataFrame(b, index=idx, columns=cols), pd.DataFrame(e, index=idx, columns=cols)
+
+# ------------------------------
+# Scostamenti
+# ------------------------------
+def test_variance_kernel_matches_baseline_loop():
+    budget, eff = random_pair()
+    var = variance_frames(budget, eff)
+    pd.testing.assert_frame_equal(var["perc"], baseline_percent(budget, eff))
+    extra = (budget == 0) & (eff > 0)
+    pd.testing.assert_frame_equal(var["eff_in"], eff.where(~extra, 0.0))
+    pd.testing.assert_frame_equal(var["eff_extra"], eff.where(extra, 0.0))
+
+def test_variance_kernel_accepts_arrays():
+    out = variance_kernel([[10.0, 0.0, 0.0]], [[5.0, 0.0, 3.0]])
+    assert out["perc"][0, 0] == 50.0
+    assert np.isnan(out["perc"][0, 1])
+    assert out["perc"][0, 2] == EXTRABUDGET
+    assert set(out) == {"perc", "eff_in", "eff_extra"}
+
+def test_monthly_table_matches_baseline_loop():
+    budget, eff = random_pair(1)
+    var = variance_frames(budget, eff)
+    got = monthly_table(budget, var["eff_in"], var["eff_extra"])
+    rows = {}
+    for c in cols_of_half(budget.columns, "1-fine"):
+        extra = (budget[c] == 0) & (eff[c] > 0)
+        rows[c[:7]] = baseline_summary(float(budget[c].sum()), float(eff[c][~extra].sum()), float(eff[c][extra].sum()))
+    expected = pd.DataFrame.from_dict(rows, orient="index").rename_axis("Anno-Mese")
+    pd.testing.assert_frame_equal(got, expected, check_exact=False, atol=0.051)
+
+def test_dashboard_uses_fine_columns(budget_wide, aligned):
+    var = variance_frames(aligned["budget"], aligned["eff"])
+    dash = dashboard_table(aligned["budget"], var["eff_in"], var["eff_extra"], category_map(prepare_budget(budget_wide)))
+    fine = cols_of_half(aligned["budget"].columns, "1-fine")
+    np.testing.assert_allclose(dash["Ore a Budget"], aligned["budget"][fine].sum(axis=1).round(2))
+    np.testing.assert_allclose(dash["Ore Effettive"], aligned["eff"][fine].sum(axis=1).round(2))
+    senza_budget = dash["Ore a Budget"] == 0
+    assert (dash.loc[senza_budget & (dash["Ore Effettive"] > 0), "Scostamento %"] == EXTRABUDGET).all()
+    assert dash.loc[senza_budget & (dash["Ore Effettive"] == 0), "Scostamento %"].isna().all()
+
+# ------------------------------
+# Rollup per periodo
+# ------------------------------
+def test_period_rollup_quarters_match_baseline_loop():
+    budget, eff = random_pair(2)
+    var = variance_frames(budget, eff)
+    cols_fine = cols_of_half(budget.columns, "1-fine")
+    got = period_rollup(budget, var["eff_in"], var["eff_extra"], cols_fine, "trimestre")
+    expected = baseline_quarters(budget, eff)
+    pd.testing.assert_frame_equal(got, expected, check_exact=False, atol=0.051)
+
+def test_rollup_totals_sum_clients():
+    budget, eff = random_pair(3)
+    var = variance_frames(budget, eff)
+    per_client = period_rollup(budget, var["eff_in"], var["eff_extra"], cols_of_half(budget.columns, "1-fine"), "trimestre")
+    totals = rollup_totals(per_client)
+    sums = per_client.groupby(level="Anno-Trimestre")["Ore a Budget"].sum().round(2)
+    np.testing.assert_allclose(totals["Ore a Budget"], sums)
+
+@pytest.mark.parametrize("kind", ["ytd", "r12"])
+def test_period_rollup_cumulative(kind):
+    budget, eff = random_pair(4)
+    var = variance_frames(budget, eff)
+    cols_fine = cols_of_half(budget.columns, "1-fine")
+    got = period_rollup(budget, var["eff_in"], var["eff_extra"], cols_fine, kind)
+    # stesso anno e meno di 12 mesi: YTD e ultimi 12 mesi coincidono con la somma progressiva
+    expected = budget[cols_fine].cumsum(axis=1).round(2)
+    for c in cols_fine:
+        np.testing.assert_allclose(got.xs(c[:7], level=1)["Ore a Budget"].to_numpy(), expected[c].to_numpy(), atol=0.011)
+
+# ------------------------------
+# Heatmap
+# ------------------------------
+def test_percent_css_matches_matplotlib_per_cell():
+    values = np.concatenate([np.arange(-80, 130, 0.1).round(1), [np.nan, EXTRABUDGET, 0.0, -50.0, 100.0]])
+    css = percent_css(values.reshape(-1, 1))[:, 0]
+    assert list(css) == [baseline_css(v) for v in values]
+
+def test_percent_labels_match_fmt_percent_numeric():
+    budget, eff = random_pair(5)
+    perc = variance_frames(budget, eff)["perc"]
+    perc.iloc[0, :3] = [1e-12, -0.04, 0.05]
+    assert (percent_labels(perc) == perc.map(fmt_percent_numeric).to_numpy()).all()
+
+def test_heatmap_html_cells_and_escaping():
+    df = pd.DataFrame([[12.5, np.nan], [EXTRABUDGET, 0.0]], index=pd.Index(["A&B", "<C>"], name="Cliente"),
+                      columns=["2024-01 (1-fine)", "2024-02 (1-fine)"])
+    html = heatmap_html(df)
+    assert html.count("<td ") == 4
+    assert "A&amp;B" in html and "&lt;C&gt;" in html and "<C>" not in html
+    assert f'<td style="{baseline_css(12.5)}">12.5%</td>' in html
+    assert '<td style="background-color: violet; color: white;">Extrabudget</td>' in html
+
+# ------------------------------
+# Cubo e finestra di righe
+# ------------------------------
+def test_cube_slice_frames_match_aligned(aligned):
+    cube = aligned["cube"]
+    clienti = list(aligned["eff"].index[::3])
+    cols = list(aligned["eff"].columns[1::2])
+    sel = CubeSlice(cube, *cube.locate(clienti, cols))
+    f = sel.frames()
+    pd.testing.assert_frame_equal(f["eff"], aligned["eff"].loc[clienti, cols], check_index_type=False)
+    pd.testing.assert_frame_equal(f["budget"], aligned["budget"].loc[clienti, cols], check_index_type=False)
+    var = variance_frames(aligned["budget"].loc[clienti, cols], aligned["eff"].loc[clienti, cols])
+    pd.testing.assert_frame_equal(f["perc"], var["perc"], check_index_type=False)
+    finestra = sel.frames(clienti[-2:])
+    assert list(finestra["eff"].index) == clienti[-2:]
+
+def test_cube_contiguous_selection_is_a_view(aligned):
+    cube = aligned["cube"]
+    rows, cols = cube.locate(list(cube.clients[2:10]), list(cube.columns[:4]))
+    assert isinstance(rows, slice) and isinstance(cols, slice)
+    assert np.shares_memory(cube.plane("eff", rows, cols), cube.values)
+    assert CubeSlice(cube, rows, cols).nbytes == 0
+
+def test_cube_locate_unknown_client(aligned):
+    with pytest.raises(KeyError):
+        aligned["cube"].locate(["non esiste"])
+
+def test_order_clients_and_page_window():
+    dash = pd.DataFrame({"Scostamento %": [10.0, np.nan, EXTRABUDGET, -30.0], "Ore Effettive": [5.0, 1.0, 9.0, 3.0]},
+                        index=["a", "b", "c", "d"])
+    assert list(order_clients(dash, "peggiore")) == ["c", "d", "a", "b"]
+    assert list(order_clients(dash, "ore")) == ["c", "a", "d", "b"]
+    assert list(page_window(order_clients(dash, "cliente"), 2, 3)) == ["d"]
+
+# ------------------------------
+# Cache di ingestione
+# ------------------------------
+def test_ingest_cache_evicts_least_recently_used():
+    frame = pd.DataFrame({"v": np.zeros(1000)})  # ~8 kB
+    cache = IngestCache(max_bytes=20_000)
+    cache.put("a", {"f": frame}, persist=False)
+    cache.put("b", {"f": frame}, persist=False)
+    assert cache.get("a") is not None  # "a" torna la più recente
+    cache.put("c", {"f": frame}, persist=False)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+def test_ingest_cache_sidecar_survives_restart(tmp_path):
+    frame = pd.DataFrame({"v": [1.0, 2.0]}, index=["x", "y"])
+    IngestCache(10_000_000, str(tmp_path)).put("k", {"pivot": frame})
+    got = IngestCache(10_000_000, str(tmp_path)).get("k")
+    pd.testing.assert_frame_equal(got["pivot"], frame)
@@ -0,0 +1,73 @@
+# Export Excel: formattazione condizionale nativa della heatmap, con xlsxwriter e con il fallback openpyxl
+
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+import analisi_export
+from analisi_engine import EXTRABUDGET, PERC_COLS
+from analisi_export import HEAT_SCALE, write_xlsx
+
+@pytest.fixture(params=["xlsxwriter", "openpyxl"])
+def writer(request, monkeypatch):
+    if request.param == "xlsxwriter" and analisi_export.xlsxwriter is None:
+        pytest.skip("xlsxwriter non installato")
+    if request.param == "openpyxl":
+        monkeypatch.setattr(analisi_export, "xlsxwriter", None)
+    return request.param
+
+def rules_by_range(ws) -> dict:
+    """{"B2:D5": [regole nell'ordine di applicazione]}: una voce per tratto, anche se il writer li raggruppa."""
+    out = {}
+    for cf in ws.conditional_formatting:
+        for ref in str(cf.sqref).split():
+            out.setdefault(ref, []).extend(sorted(cf.rules, key=lambda r: r.priority))
+    return out
+
+def rgb(color) -> str:
+    return color.rgb[-6:].upper()
+
+def check_heat_rules(rules: list, first_cell: str):
+    blank, extra, scale = rules
+    # celle vuote (None): nero su nero, con stop
+    assert blank.type in ("containsBlanks", "expression") and blank.stopIfTrue
+    assert blank.formula == [f"LEN(TRIM({first_cell}))=0"]
+    assert rgb(blank.dxf.fill.bgColor) == "000000" and rgb(blank.dxf.font.color) == "000000"
+    # Extrabudget: cellIs == -9999, viola con testo bianco, con stop
+    assert (extra.type, extra.operator, extra.formula) == ("cellIs", "equal", [str(EXTRABUDGET)]) and extra.stopIfTrue
+    assert rgb(extra.dxf.fill.bgColor) == "EE82EE" and rgb(extra.dxf.font.color) == "FFFFFF"
+    # scala RdYlGn a tre punti su -50 / 25 / 100
+    assert scale.type == "colorScale"
+    assert [(v.type, v.val) for v in scale.colorScale.cfvo] == [("num", float(v)) for v, _ in HEAT_SCALE]
+    assert [rgb(c) for c in scale.colorScale.color] == [c[1:].upper() for _, c in HEAT_SCALE]
+
+def test_conditional_formatting_on_heat_ranges(writer):
+    heat = pd.DataFrame([[12.5, np.nan, EXTRABUDGET]] * 4, index=[f"C{i}" for i in range(4)],
+                        columns=["2024-01 (1-fine)", "2024-02 (1-fine)", "2024-03 (1-fine)"])
+    dash = pd.DataFrame({"Ore a Budget": [1.0, 2, 3], "Scostamento %": [5.0, np.nan, EXTRABUDGET],
+                         "Ore Effettive": [1.0, 2, 3], PERC_COLS[0]: [1.0, 2, 3]}, index=list("abc"))
+    wb = openpyxl.load_workbook(BytesIO(write_xlsx({"Heatmap": heat, "Dashboard": dash}, percent_sheets=["Heatmap"])))
+
+    # foglio heatmap: tutte le colonne dati, righe 2..5 (colonna A = clienti)
+    heat_rules = rules_by_range(wb["Heatmap"])
+    assert list(heat_rules) == ["B2:D5"]
+    check_heat_rules(heat_rules["B2:D5"], "B2")
+    # altri fogli: solo le colonne scostamento %, un tratto per gruppo contiguo
+    dash_rules = rules_by_range(wb["Dashboard"])
+    assert sorted(dash_rules) == ["C2:C4", "E2:E4"]
+    check_heat_rules(dash_rules["C2:C4"], "C2")
+    assert [r.type for r in dash_rules["E2:E4"]][1:] == ["cellIs", "colorScale"]
+
+def test_values_stay_numeric_with_percent_format(writer):
+    heat = pd.DataFrame({"2024-01 (1-fine)": [12.5, np.nan, EXTRABUDGET]}, index=["a", "b", "c"])
+    ws = openpyxl.load_workbook(BytesIO(write_xlsx({"Heatmap": heat}, percent_sheets=["Heatmap"])))["Heatmap"]
+    assert [ws.cell(r, 2).value for r in (2, 3, 4)] == [12.5, None, EXTRABUDGET]
+    assert ws.cell(2, 2).number_format == analisi_export.FMT_PERCENT
+
+def test_sheet_without_percent_columns_has_no_rules(writer):
+    ore = pd.DataFrame({"Ore a Budget": [1.0, 2.0]}, index=["a", "b"])
+    ws = openpyxl.load_workbook(BytesIO(write_xlsx({"Mensile": ore})))["Mensile"]
+    assert not rules_by_range(ws)
@@ -0,0 +1,106 @@
+# Ingestione Effettivo: date eterogenee, pivot parziali, streaming, archivio per mese e unione di più export
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analisi_effettivo_archive import EffettivoArchive, month_columns
+from analisi_effettivo_merge import merge_effettivo_files
+from analisi_engine import (
+    EMPTY_DATE, build_cube, merge_pivots, normalize_dates, parse_effettivo, pivot_effettivo, pivot_from_daily,
+    daily_totals, prepare_budget, stream_effettivo,
+)
+from analisi_export import write_xlsx
+
+def effettivo_xlsx(df: pd.DataFrame) -> bytes:
+    return write_xlsx({"Effettivo": df}, index=False)
+
+# ------------------------------
+# Date
+# ------------------------------
+def test_normalize_dates_mixed_formats():
+    values = pd.Series([
+        datetime(2024, 3, 5), "05/03/2024", "2024-03-05", 45356, "45356", "05.03.2024", "5/3/24",
+        "05/03/2024 17:30", "", None, "boh", "boh",
+    ], dtype=object)
+    dates, scartate = normalize_dates(values)
+    attesa = pd.Timestamp("2024-03-05")
+    assert (dates.iloc[:7] == attesa).all()
+    assert dates.iloc[7] == pd.Timestamp("2024-03-05 17:30")
+    assert dates.iloc[8:].isna().all()
+    assert dict(zip(scartate["valore"], scartate["righe"])) == {"boh": 2, EMPTY_DATE: 2}
+
+def test_normalize_dates_matches_baseline_day_first():
+    giorni = pd.date_range("2023-01-01", "2024-12-31", freq="D")
+    testo = pd.Series(giorni.strftime("%d/%m/%Y"), dtype=object)
+    dates, scartate = normalize_dates(testo)
+    pd.testing.assert_series_equal(dates, pd.to_datetime(testo, dayfirst=True, errors="coerce"), check_names=False)
+    assert scartate.empty
+
+def test_normalize_dates_empty_counted_on_mask():
+    dates, scartate = normalize_dates(pd.Series(["01/02/2024", None, None], dtype=object), [True, True, False])
+    assert dict(zip(scartate["valore"], scartate["righe"])) == {EMPTY_DATE: 1}
+
+# ------------------------------
+# Pivot
+# ------------------------------
+def test_pivot_from_daily_matches_pivot_effettivo(eff_rows):
+    expected = pivot_effettivo(eff_rows)
+    got = pivot_from_daily(daily_totals(eff_rows))
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_names=False)
+
+def test_merge_pivots_matches_pivot_of_all_rows(eff_rows):
+    parti = [eff_rows.iloc[i::3] for i in range(3)]
+    got = merge_pivots([pivot_effettivo(p) for p in parti])
+    expected = pivot_effettivo(eff_rows)
+    got = got.reindex(index=expected.index)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_names=False)
+
+def test_merge_pivots_ignores_empty(eff_rows):
+    p = pivot_effettivo(eff_rows)
+    assert merge_pivots([pd.DataFrame(), p]) is p
+    assert merge_pivots([]).empty
+
+# ------------------------------
+# Streaming
+# ------------------------------
+def test_stream_effettivo_matches_parse(eff_raw):
+    data = effettivo_xlsx(eff_raw)
+    full = parse_effettivo(data)
+    stream = stream_effettivo(data, chunk_rows=700)
+    pd.testing.assert_frame_equal(stream["pivot"], full["pivot"], check_dtype=False, check_names=False)
+
+# ------------------------------
+# Archivio per mese
+# ------------------------------
+def test_archive_month_without_first_half_has_all_columns(tmp_path, eff_raw, budget_wide):
+    archive = EffettivoArchive(str(tmp_path / "archivio"))
+    date = pd.to_datetime(eff_raw["data"])
+    archive.ingest(eff_raw[(date.dt.month != 1) | (date.dt.day > 15)])  # gennaio: solo giorni 16-31
+    mesi = archive.months()
+    gennaio = archive.month_aggregates("2024-01")["pivot"]
+    assert list(gennaio.columns) == month_columns(["2024-01"])
+    assert (gennaio["2024-01 (1-15)"] == 0).all() and gennaio["2024-01 (1-fine)"].sum() > 0
+    # le colonne scelte da month_columns esistono nel cubo costruito dalle partizioni
+    pivot = merge_pivots([archive.month_aggregates(m)["pivot"] for m in mesi])
+    cube = build_cube(prepare_budget(budget_wide), pivot)
+    cube.locate(list(cube.clients), month_columns(mesi))
+
+# ------------------------------
+# Più export
+# ------------------------------
+def test_merge_files_counts_overlapping_rows_once(eff_raw):
+    distinte = eff_raw.drop_duplicates(["data", "cliente", "ore", "risorsa", "attività"]).reset_index(drop=True)
+    a, b = distinte.iloc[:2500], distinte.iloc[1500:]
+    chiavi = ("risorsa", "attività")
+    got = merge_effettivo_files([("a.xlsx", effettivo_xlsx(a)), ("b.xlsx", effettivo_xlsx(b))], chiavi)
+    expected = parse_effettivo(effettivo_xlsx(distinte))["pivot"]
+    pd.testing.assert_frame_equal(got["pivot"].reindex(index=expected.index), expected, check_dtype=False, check_names=False)
+    assert int(got["parti"]["duplicate"].sum()) == 1000
+
+def test_merge_files_keeps_repeats_within_one_export(eff_raw):
+    riga = eff_raw.iloc[[0]]
+    doppia = pd.concat([riga, riga], ignore_index=True)
+    got = merge_effettivo_files([("a.xlsx", effettivo_xlsx(doppia)), ("b.xlsx", effettivo_xlsx(riga))], ("risorsa",))
+    assert np.isclose(got["pivot"].to_numpy().max(), 2 * float(riga["ore"].iloc[0]))
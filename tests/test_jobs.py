@@ -0,0 +1,92 @@
+# Pool dei job in background: un job per chiave, iscrizioni delle sessioni, annullamento cooperativo
+
+import threading
+
+import pytest
+
+from analisi_jobs import ANNULLATO, COMPLETATO, ERRORE, JobPool
+
+def lavoro(gate: threading.Event, chiamate: list):
+    """Calcolo che riporta avanzamento finché `gate` non viene aperto (punto di annullamento)."""
+    def fn(tag, progress):
+        chiamate.append(tag)
+        while not gate.wait(0.01):
+            progress(0.5, "in attesa")
+        return f"fatto {tag}"
+    return fn
+
+@pytest.fixture
+def pool():
+    return JobPool(workers=2)
+
+def test_submit_same_key_runs_once(pool):
+    gate, chiamate = threading.Event(), []
+    a = pool.submit("k", lavoro(gate, chiamate), "x", subscriber="s1")
+    b = pool.submit("k", lavoro(gate, chiamate), "y", subscriber="s2")
+    assert a is b and a.subscribers == {"s1", "s2"}
+    gate.set()
+    a.wait(5)
+    assert a.status == COMPLETATO and a.result == "fatto x" and a.progress == 1.0
+    assert chiamate == ["x"]
+
+def test_reattach_to_finished_job_then_forget(pool):
+    gate, chiamate = threading.Event(), []
+    gate.set()
+    job = pool.submit("k", lavoro(gate, chiamate), 1)
+    job.wait(5)
+    assert pool.submit("k", lavoro(gate, chiamate), 2) is job  # risultato non ancora ritirato
+    pool.forget("k")
+    again = pool.submit("k", lavoro(gate, chiamate), 3)
+    again.wait(5)
+    assert again is not job and again.result == "fatto 3"
+    assert pool.get("assente") is None
+
+def test_cancel_waits_for_last_subscriber(pool):
+    gate, chiamate = threading.Event(), []
+    job = pool.submit("k", lavoro(gate, chiamate), 1, subscriber="s1")
+    pool.submit("k", lavoro(gate, chiamate), 1, subscriber="s2")
+    assert not pool.cancel("k", "s1")  # s2 attende ancora lo stesso file
+    assert not job.cancelled and job.subscribers == {"s2"}
+    assert pool.cancel("k", "s2")
+    job.wait(5)
+    assert job.status == ANNULLATO
+    gate.set()
+
+def test_cancel_without_subscriber_is_unconditional(pool):
+    gate = threading.Event()
+    job = pool.submit("k", lavoro(gate, []), 1, subscriber="s1")
+    assert pool.cancel("k")
+    job.wait(5)
+    assert job.status == ANNULLATO
+    assert not pool.cancel("k")  # già terminato
+    gate.set()
+
+def test_submit_after_cancel_starts_a_new_job(pool):
+    gate, chiamate = threading.Event(), []
+    job = pool.submit("k", lavoro(gate, chiamate), 1, subscriber="s1")
+    pool.cancel("k", "s1")
+    # un'altra sessione carica lo stesso file: non eredita l'annullamento, anche prima che il job si fermi
+    nuovo = pool.submit("k", lavoro(gate, chiamate), 2, subscriber="s2")
+    assert nuovo is not job and nuovo.subscribers == {"s2"}
+    job.wait(5)
+    gate.set()
+    nuovo.wait(5)
+    assert job.status == ANNULLATO and nuovo.status == COMPLETATO and nuovo.result == "fatto 2"
+
+def test_cancel_queued_job_never_runs():
+    pool = JobPool(workers=1)
+    gate, chiamate = threading.Event(), []
+    primo = pool.submit("a", lavoro(gate, chiamate), "a")
+    in_coda = pool.submit("b", lavoro(gate, chiamate), "b", subscriber="s1")
+    assert pool.cancel("b", "s1")
+    assert in_coda.status == ANNULLATO
+    gate.set()
+    primo.wait(5)
+    assert chiamate == ["a"]
+
+def test_error_is_reported(pool):
+    def fn(progress):
+        raise ValueError("foglio mancante")
+    job = pool.submit("k", fn)
+    job.wait(5)
+    assert job.status == ERRORE and isinstance(job.error, ValueError)
@@ -0,0 +1,96 @@
+# Profilazione per stadio: record degli stadi, conteggio degli utenti di tracemalloc, export JSON / Chrome trace
+
+import gc
+import json
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analisi_profile import StageProfiler, output_size, records_frame, runs_chrome_trace, runs_json
+
+@pytest.fixture
+def no_tracing():
+    if tracemalloc.is_tracing():
+        pytest.skip("tracemalloc già attivo nel processo di test")
+    yield
+    while tracemalloc.is_tracing():  # non lasciare il tracing acceso per gli altri test
+        tracemalloc.stop()
+
+def test_stage_records():
+    prof = StageProfiler()
+    df = prof.track("pivot", lambda: pd.DataFrame(np.zeros((3, 4))), cache="miss")
+    assert df.shape == (3, 4)
+    with pytest.raises(ValueError):
+        with prof.stage("render") as rec:
+            rec["rows"] = 7
+            raise ValueError("stadio interrotto")
+    pivot, render = prof.records
+    assert pivot["stage"] == "pivot" and pivot["cache"] == "miss" and (pivot["rows"], pivot["cells"]) == (3, 12)
+    assert render["stage"] == "render" and render["rows"] == 7  # registrato anche se lo stadio fallisce
+    assert 0 <= pivot["start_s"] <= render["start_s"] and pivot["dur_s"] >= 0
+    assert "peak_mb" not in pivot
+    run = prof.run_record(rerun=1)
+    assert run["memory"] is False and run["rerun"] == 1 and run["stages"] == prof.records
+
+def test_output_size_of_frames_and_bytes():
+    out = output_size({"a": pd.DataFrame(np.zeros((5, 2))), "b": pd.Series(np.zeros(8)), "x": b"1234"})
+    assert out == {"rows": 8, "cells": 18, "bytes": 4}
+
+def test_tracing_counts_memory_profilers(no_tracing):
+    a, b, c = StageProfiler(memory=True), StageProfiler(memory=True), StageProfiler(memory=False)
+    assert tracemalloc.is_tracing()
+    with a.stage("alloc") as rec:
+        blocco = np.ones(2**20)  # 8 MB
+    assert rec["peak_mb"] >= 7.5
+    del blocco
+    a.close()
+    a.close()  # una sola uscita anche se chiuso due volte
+    assert tracemalloc.is_tracing()  # b è ancora aperto
+    c.close()
+    assert tracemalloc.is_tracing()  # un profiler senza memoria non conta
+    b.close()
+    assert not tracemalloc.is_tracing()
+
+def test_tracing_released_when_profiler_is_collected(no_tracing):
+    prof = StageProfiler(memory=True)
+    assert tracemalloc.is_tracing()
+    del prof  # script interrotto prima di close()
+    gc.collect()
+    assert not tracemalloc.is_tracing()
+
+def test_tracing_started_elsewhere_is_left_running(no_tracing):
+    tracemalloc.start()
+    StageProfiler(memory=True).close()
+    assert tracemalloc.is_tracing()
+
+def test_chrome_trace_shape():
+    prof = StageProfiler()
+    prof.track("lettura", lambda: pd.DataFrame({"v": [1.0]}), cache="hit")
+    with prof.stage("render"):
+        pass
+    runs = [prof.run_record(), prof.run_record()]
+    trace = json.loads(runs_chrome_trace(runs))
+    assert trace["displayTimeUnit"] == "ms"
+    events = trace["traceEvents"]
+    meta = [e for e in events if e["ph"] == "M"]
+    assert [(e["name"], e["tid"]) for e in meta] == [("thread_name", 1), ("thread_name", 2)]
+    slices = [e for e in events if e["ph"] == "X"]
+    assert len(slices) == 2 * (1 + 2)  # per rerun: l'esecuzione intera + uno slice per stadio
+    for e in slices:
+        assert {"name", "cat", "ph", "pid", "tid", "ts", "dur", "args"} <= set(e)
+        assert isinstance(e["ts"], int) and isinstance(e["dur"], int) and e["ts"] >= 0
+    stadi = [e for e in slices if e["name"] != "rerun"]
+    assert all(e["dur"] >= 1 for e in stadi)
+    lettura = next(e for e in stadi if e["name"] == "lettura")
+    assert lettura["cat"] == "hit" and lettura["args"] == {"cache": "hit", "rows": 1, "cells": 1}
+    assert next(e for e in stadi if e["name"] == "render")["cat"] == "stage"
+    assert json.loads(runs_json(runs))["runs"][0]["stages"][0]["stage"] == "lettura"
+
+def test_records_frame_columns():
+    prof = StageProfiler()
+    prof.track("pivot", lambda: pd.DataFrame({"v": [1.0, 2.0]}), cache="miss")
+    df = records_frame(prof.records)
+    assert list(df.columns) == ["Stadio", "Cache", "ms", "Righe", "Celle"]
+    assert records_frame([]).empty
@@ -0,0 +1,94 @@
+# Scenari what-if: calcolo vettoriale a blocchi confrontato con un loop per scenario e per cliente
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analisi_scenari
+from analisi_engine import PERC_COLS, category_map, cols_of_half, prepare_budget
+from analisi_scenari import evaluate_scenarios, parse_multipliers, scenario_grid
+
+def baseline_scenario(df_budget, budget_fine, eff_fine, cat, scenario) -> dict:
+    """Un solo scenario, cliente per cliente e mese per mese come il calcolo delle ore slot."""
+    be = ee_in = ee_extra = 0.0
+    clienti_extra = clienti_sopra = 0
+    for cliente in eff_fine.index:
+        attivo = scenario["categoria"] in ("", cat.get(cliente, ""))
+        m = {k: (scenario[k] if attivo else 1.0) for k in ("coeff", "budget_mensile", "xselling")}
+        ore_cliente = eff_cliente = extra_cliente = 0.0
+        for col in eff_fine.columns:
+            mese = col[:7]
+            coeff = df_budget.loc[cliente, f"{mese}_coeff"] if cliente in df_budget.index else np.nan
+            budget = df_budget.loc[cliente, f"{mese}_budget_mensile"] if cliente in df_budget.index else np.nan
+            xsell = df_budget.loc[cliente, f"{mese}_xselling"] if cliente in df_budget.index else np.nan
+            if coeff > 0 and not np.isnan(budget):
+                xsell = 0.0 if np.isnan(xsell) else xsell
+                ore = (budget * m["budget_mensile"] + xsell * m["xselling"]) / (coeff * m["coeff"])
+            else:
+                ore = budget_fine.loc[cliente, col] * m["budget_mensile"] / m["coeff"]
+            ore = round(ore, 2)
+            eff = eff_fine.loc[cliente, col]
+            if ore == 0 and eff > 0:
+                extra_cliente += eff
+            else:
+                ee_in += eff
+            ore_cliente += ore
+            eff_cliente += eff
+        be += ore_cliente
+        ee_extra += extra_cliente
+        clienti_extra += extra_cliente > 0
+        clienti_sopra += eff_cliente > ore_cliente
+    return {"Ore a Budget": round(be, 2), "Ore Effettive (senza Extrabudget)": round(ee_in, 2),
+            "Ore Extrabudget": round(ee_extra, 2), "Clienti con Extrabudget": clienti_extra, "Clienti sopra Budget": clienti_sopra}
+
+@pytest.fixture
+def inputs(budget_wide, aligned):
+    df_budget = prepare_budget(budget_wide)
+    # un cliente senza componenti in un mese: le ore attuali vengono scalate per m_b / m_c
+    df_budget.loc[df_budget.index[0], "2024-03_budget_mensile"] = np.nan
+    fine = cols_of_half(aligned["budget"].columns, "1-fine")
+    return df_budget, aligned["budget"][fine], aligned["eff"][fine], category_map(df_budget)
+
+def scenari() -> pd.DataFrame:
+    grid = scenario_grid([0.9, 1.2], [0.8, 1.1])
+    categoria = pd.DataFrame([{"scenario": "Solo progetti", "categoria": "progetto", "coeff": 1.0, "budget_mensile": 1.5, "xselling": 2.0}])
+    return pd.concat([grid, categoria], ignore_index=True)
+
+def test_scenarios_match_per_scenario_loop(inputs):
+    df_budget, budget_fine, eff_fine, cat = inputs
+    got = evaluate_scenarios(df_budget, budget_fine, eff_fine, scenari(), cat)
+    assert list(got.index) == ["Attuale"] + list(scenari()["scenario"])
+    assert got.loc["Solo progetti", "Categoria"] == "Progetto"
+    cat_title = cat.to_dict()
+    for row in scenari().assign(categoria=lambda d: d["categoria"].str.title()).to_dict("records"):
+        expected = baseline_scenario(df_budget, budget_fine, eff_fine, cat_title, row)
+        for col, value in expected.items():
+            assert got.loc[row["scenario"], col] == pytest.approx(value, abs=0.011), (row["scenario"], col)
+    # lo scenario di categoria tocca solo i suoi clienti: differisce da 'Attuale' ma meno dello stesso scenario su tutti
+    tutti = evaluate_scenarios(df_budget, budget_fine, eff_fine, scenari().assign(categoria=""), cat)
+    delta = got.loc["Solo progetti", "Δ Ore a Budget"]
+    assert 0 < delta < tutti.loc["Solo progetti", "Δ Ore a Budget"]
+
+def test_attuale_row_is_the_current_budget(inputs):
+    df_budget, budget_fine, eff_fine, cat = inputs
+    got = evaluate_scenarios(df_budget, budget_fine, eff_fine, scenari(), cat).loc["Attuale"]
+    assert got["Ore a Budget"] == pytest.approx(budget_fine.to_numpy().sum(), abs=0.011)
+    assert got["Ore Effettive (senza Extrabudget)"] + got["Ore Extrabudget"] == pytest.approx(eff_fine.to_numpy().sum(), abs=0.011)
+    be, ee = got["Ore a Budget"], got["Ore Effettive (senza Extrabudget)"]
+    assert got[PERC_COLS[0]] == round((be - ee) / be * 100, 1)
+
+def test_chunks_smaller_than_scenario_count(inputs, monkeypatch):
+    df_budget, budget_fine, eff_fine, cat = inputs
+    intero = evaluate_scenarios(df_budget, budget_fine, eff_fine, scenari(), cat)
+    # blocchi da 2 scenari su 5: tre passate, l'ultima parziale
+    monkeypatch.setattr(analisi_scenari, "MAX_CELLS", 2 * budget_fine.size)
+    a_blocchi = evaluate_scenarios(df_budget, budget_fine, eff_fine, scenari(), cat)
+    pd.testing.assert_frame_equal(a_blocchi, intero)
+    monkeypatch.setattr(analisi_scenari, "MAX_CELLS", 1)  # uno scenario per blocco
+    pd.testing.assert_frame_equal(evaluate_scenarios(df_budget, budget_fine, eff_fine, scenari(), cat), intero)
+
+def test_parse_multipliers():
+    assert parse_multipliers("0.9, 1 1.1") == [0.9, 1.0, 1.1]
+    assert parse_multipliers("0,9; 1; 1,1") == [0.9, 1.0, 1.1]
+    with pytest.raises(ValueError):
+        parse_multipliers("0.9, -1")
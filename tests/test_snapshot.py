@@ -0,0 +1,110 @@
+# Confronto tra caricamenti successivi dell'Effettivo e snapshot per utente
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from analisi_engine import pivot_effettivo
+from analisi_snapshot import SnapshotStore, compare_snapshot, diff_fingerprints, pivot_delta, row_fingerprint, what_changed
+
+CHIAVI = ("risorsa", "attività")
+
+def upload(rows: pd.DataFrame) -> dict:
+    """Frame di un caricamento come da parse_effettivo_snapshot, senza passare dall'xlsx."""
+    return {"impronta": row_fingerprint(rows, CHIAVI), "pivot": pivot_effettivo(rows)}
+
+def edited(rows: pd.DataFrame, drop: int = 100, seed: int = 0) -> pd.DataFrame:
+    """`drop` righe eliminate (anche duplicati) e una riga con ore cambiate."""
+    rng = np.random.default_rng(seed)
+    out = rows.drop(index=rows.index[rng.choice(len(rows), drop, replace=False)]).reset_index(drop=True)
+    out.loc[len(out) // 2, "ore"] += 1.5
+    return out
+
+def test_row_identity_ignores_order_of_duplicates(eff_rows):
+    rows = pd.concat([eff_rows, eff_rows.iloc[:300]], ignore_index=True)  # 300 righe ripetute
+    prima = row_fingerprint(rows, CHIAVI)
+    # eliminare la prima copia di una riga ripetuta non sposta le successive
+    dopo = row_fingerprint(rows.drop(index=[0]), CHIAVI)
+    assert diff_fingerprints(prima, dopo) == {"aggiunte": 0, "rimosse": 1, "modificate": 0}
+    assert int(prima["n"].sum()) == len(rows)
+
+def test_diff_counts_deletions_and_one_edit(eff_rows):
+    rows = pd.concat([eff_rows, eff_rows.iloc[:300]], ignore_index=True)
+    diff = diff_fingerprints(row_fingerprint(rows, CHIAVI), row_fingerprint(edited(rows), CHIAVI))
+    assert diff == {"aggiunte": 0, "rimosse": 100, "modificate": 1}
+
+def test_diff_identical_and_reordered(eff_rows):
+    fp = row_fingerprint(eff_rows, CHIAVI)
+    mescolate = row_fingerprint(eff_rows.sample(frac=1, random_state=0), CHIAVI)
+    assert diff_fingerprints(fp, mescolate) == {"aggiunte": 0, "rimosse": 0, "modificate": 0}
+
+def test_key_columns_are_stripped(eff_rows):
+    spazi = eff_rows.assign(risorsa=" " + eff_rows["risorsa"] + " ")
+    assert diff_fingerprints(row_fingerprint(eff_rows, CHIAVI), row_fingerprint(spazi, CHIAVI))["modificate"] == 0
+
+def test_pivot_delta_equals_pivot_difference(eff_rows):
+    old, new = pivot_effettivo(eff_rows), pivot_effettivo(edited(eff_rows))
+    delta = pivot_delta(old, new)
+    full = new.sub(old, fill_value=0).fillna(0)
+    np.testing.assert_allclose(delta.to_numpy(), full.loc[delta.index, delta.columns].to_numpy(), atol=1e-6)
+    resto = full.drop(index=delta.index).to_numpy()
+    assert np.abs(resto).max(initial=0) < 1e-6
+
+def test_compare_snapshot_first_then_diff(tmp_path, eff_rows):
+    store = SnapshotStore(str(tmp_path / "utente"))
+    assert compare_snapshot(store, upload(eff_rows), CHIAVI) is None
+    out = compare_snapshot(store, upload(edited(eff_rows)), CHIAVI)
+    mod = out["modifiche"].iloc[0]
+    assert (mod["aggiunte"], mod["rimosse"], mod["modificate"]) == (0, 100, 1)
+    assert mod["righe_precedenti"] - mod["righe"] == 100
+
+def test_compare_snapshot_skips_rewrite_when_unchanged(tmp_path, eff_rows):
+    root = tmp_path / "utente"
+    store = SnapshotStore(str(root))
+    compare_snapshot(store, upload(eff_rows), CHIAVI)
+    versione = (root / "CORRENTE").read_text()
+    out = compare_snapshot(store, upload(eff_rows), CHIAVI)
+    assert out["delta"].empty
+    assert (root / "CORRENTE").read_text() == versione
+
+def test_compare_snapshot_other_keys_is_a_new_baseline(tmp_path, eff_rows):
+    store = SnapshotStore(str(tmp_path / "utente"))
+    compare_snapshot(store, upload(eff_rows), CHIAVI)
+    assert compare_snapshot(store, {"impronta": row_fingerprint(eff_rows), "pivot": pivot_effettivo(eff_rows)}) is None
+
+def test_store_keeps_two_versions_and_loads_during_saves(tmp_path, eff_rows):
+    store = SnapshotStore(str(tmp_path / "utente"))
+    frames = [upload(eff_rows), upload(edited(eff_rows))]
+    store.save(frames[0], {"chiavi": list(CHIAVI)})
+    errori = []
+
+    def lettore():
+        for _ in range(30):
+            snap = store.load()
+            if snap is None or len(snap["impronta"]) not in {len(f["impronta"]) for f in frames}:
+                errori.append(snap)
+
+    def scrittore(f):
+        for _ in range(5):
+            store.save(f, {"chiavi": list(CHIAVI)})
+
+    threads = [threading.Thread(target=lettore) for _ in range(3)] + [threading.Thread(target=scrittore, args=(f,)) for f in frames]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errori
+    assert len([n for n in os.listdir(store.root) if n.startswith("v-")]) <= 2
+
+def test_what_changed_reports_before_and_after(aligned):
+    cube = aligned["cube"]
+    cliente, col = cube.clients[0], cube.columns[-1]
+    delta = pd.DataFrame({col: [2.5]}, index=[cliente])
+    out = what_changed(delta, cube)
+    assert len(out) == 1
+    row = out.iloc[0]
+    ora = aligned["eff"].loc[cliente, col]
+    assert np.isclose(row["Ore ora"], ora) and np.isclose(row["Ore prima"], round(ora - 2.5, 2))
+    assert np.isclose(row["Budget"], aligned["budget"].loc[cliente, col])
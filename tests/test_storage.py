@@ -0,0 +1,91 @@
+# Strutture di supporto: Budget in formato lungo e su SQLite, indice del drill-down, cubo giornaliero
+
+import numpy as np
+import pandas as pd
+
+from analisi_budget_db import BudgetDB
+from analisi_budget_store import BudgetStore, slot_hours
+from analisi_daily import DailyCube, half_month_bounds, month_calendar, week_bounds
+from analisi_drilldown import RowIndex
+from analisi_engine import daily_totals, pivot_effettivo
+
+# ------------------------------
+# BudgetStore / BudgetDB
+# ------------------------------
+def test_budget_store_wide_round_trip(budget_wide):
+    again = BudgetStore.from_wide(budget_wide).to_wide()
+    pd.testing.assert_frame_equal(again, budget_wide, check_dtype=False)
+
+def test_budget_store_import_computes_slot_hours():
+    store = BudgetStore()
+    n = store.import_table(pd.DataFrame({
+        "Cliente": ["A", "A", "B", "B"], "Anno": [2024] * 4, "Mese": [1, 2, 1, 13],
+        "Coeff": [50, 0, 40, 40], "Budget_mensile": [1000, 1000, 800, 800],
+    }))
+    assert n == 3  # mese 13 scartato
+    wide = store.to_wide().set_index("cliente")
+    assert wide.loc["A", "2024-01 (1-fine)"] == 20.0 and wide.loc["A", "2024-01 (1-15)"] == 10.0
+    assert wide.loc["A", "2024-02 (1-fine)"] == 0.0  # coeff 0
+    np.testing.assert_allclose(slot_hours([50], [900], [100]), ([10.0], [20.0]))
+
+def test_budget_store_empty_category_keeps_existing():
+    store = BudgetStore()
+    store.upsert_clients(pd.DataFrame({"cliente": ["A"], "categoria_cliente": ["Progetto"]}))
+    store.upsert_clients(pd.DataFrame({"cliente": ["A ", "B"], "categoria_cliente": ["", np.nan]}))
+    cat = store.clients.set_index("cliente")["categoria_cliente"]
+    assert cat["A"] == "Progetto" and cat["B"] == ""
+
+def test_budget_db_snapshot_round_trip(tmp_path, budget_wide):
+    db = BudgetDB(str(tmp_path / "budget.sqlite"))
+    snap = db.save(BudgetStore.from_wide(budget_wide), "prima")
+    assert db.latest() == snap
+    pd.testing.assert_frame_equal(db.load_wide(snap), budget_wide, check_dtype=False)
+    cols = db.period_columns(snap)
+    assert cols == [c for c in budget_wide.columns if c.endswith("(1-15)") or c.endswith("(1-fine)")]
+
+def test_budget_db_selective_load(tmp_path, budget_wide):
+    db = BudgetDB(str(tmp_path / "budget.sqlite"))
+    snap = db.save(BudgetStore.from_wide(budget_wide))
+    clienti = list(budget_wide["cliente"][:3])
+    wide = db.load_wide(snap, periodi=[(2024, 2)], clienti=clienti)
+    assert list(wide["cliente"]) == clienti
+    assert {c[:7] for c in wide.columns if c[:4].isdigit()} == {"2024-02"}
+    atteso = budget_wide.set_index("cliente").loc[clienti, "2024-02 (1-fine)"]
+    np.testing.assert_allclose(wide.set_index("cliente")["2024-02 (1-fine)"], atteso)
+
+# ------------------------------
+# Drill-down
+# ------------------------------
+def test_row_index_matches_boolean_filter(eff_rows):
+    index = RowIndex.build(eff_rows)
+    cliente = eff_rows["cliente"].value_counts().index[3]
+    inizio, fine = pd.Timestamp("2024-02-01"), pd.Timestamp("2024-03-15")
+    got = index.rows(cliente, inizio, fine)
+    mask = (eff_rows["cliente"] == cliente) & eff_rows["data"].between(inizio, fine + pd.Timedelta(hours=23, minutes=59))
+    expected = eff_rows[mask].sort_values("data", kind="stable")
+    pd.testing.assert_frame_equal(got, expected)
+    assert len(index.rows("non esiste")) == 0
+    assert len(index.rows(cliente)) == int((eff_rows["cliente"] == cliente).sum())
+
+# ------------------------------
+# Cubo giornaliero
+# ------------------------------
+def test_daily_cube_half_months_match_pivot(eff_rows):
+    daily = daily_totals(eff_rows)
+    inizio, fine = month_calendar(eff_rows["mese"].dropna().unique())
+    pivot = pivot_effettivo(eff_rows)
+    cube = DailyCube.from_daily(daily, pivot.index, inizio, fine)
+    buckets = cube.buckets(half_month_bounds(eff_rows["mese"].dropna().unique()))
+    pd.testing.assert_frame_equal(buckets[pivot.columns], pivot.round(2), check_dtype=False, check_names=False)
+
+def test_daily_cube_range_sums_match_direct_sum(eff_rows):
+    daily = daily_totals(eff_rows)
+    inizio, fine = month_calendar(eff_rows["mese"].dropna().unique())
+    clienti = sorted(daily["cliente"].unique())
+    cube = DailyCube.from_daily(daily, clienti, inizio, fine)
+    settimane = week_bounds(inizio, fine)
+    got = cube.range_sums(settimane["inizio"], settimane["fine"])
+    for j, (a, b) in enumerate(zip(settimane["inizio"], settimane["fine"])):
+        sel = daily[daily["data"].between(a, b)]
+        expected = sel.groupby("cliente")["ore"].sum().reindex(clienti, fill_value=0.0)
+        np.testing.assert_allclose(got[:, j], expected.to_numpy(), atol=1e-9)